@@ -1,32 +1,103 @@
 from lexer import *
+from ir import *
+
+
+# Nodes without children build their code in get_ir. The other nodes
+# describe it in ir_steps, a generator that yields each child node and is
+# sent the child's code back. generate_ir runs these generators on an
+# explicit stack, so deep trees do not hit the recursion limit.
+#
+# The code of a node is an instruction tuple, a BLANK_LINE, or a list of
+# code, so a parent never copies the code of its children.
+# Program.extend_code flattens it once, at the end.
+#
+# A node leaves its value in the last temporary, where its parent reads it.
+# A parent that does not read it yields the child as a Statement, and
+# builder.value_wanted tells the nodes that have no value of their own,
+# like IF, the loops and FUN, whether to set one. The top level
+# statements of a program are generated as statements.
+def generate_ir(node, builder):
+    builder.value_wanted = False
+    if not hasattr(node, 'ir_steps'):
+        return node.get_ir(builder)
+
+    stack = [node.ir_steps(builder)]
+    code = None
+
+    while stack:
+        try:
+            child = stack[-1].send(code)
+        except StopIteration as stop:
+            stack.pop()
+            code = stop.value
+            continue
+
+        # Read by the child before its first step
+        if child.__class__ is Statement:
+            builder.value_wanted = False
+            child = child.node
+        else:
+            builder.value_wanted = True
+
+        if hasattr(child, 'ir_steps'):
+            stack.append(child.ir_steps(builder))
+            code = None
+        else:
+            code = child.get_ir(builder)
+
+    return code
+
+
+class Statement:
+    # A node whose value is not used
+    __slots__ = ('node',)
+
+    def __init__(self, node):
+        self.node = node
+
+
+def null_value(builder):
+    # The value of a node that gives none
+    return (OP_MOVE, builder.new_temp(), builder.const(None))
 
 
 class NumberNode:
     def __init__(self, tok):
         self.tok = tok
 
-        self.pos_start = self.tok.pos_start
-        self.pos_end = self.tok.pos_end
+    # The positions are only built when they are needed
+    @property
+    def pos_start(self):
+        return self.tok.pos_start
+
+    @property
+    def pos_end(self):
+        return self.tok.pos_end
 
     def __repr__(self):
         return f'{self.tok}'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        return f't{get_next_temp_var()} = {self.tok.value}\n'
+    def get_ir(self, builder):
+        return (OP_MOVE, builder.new_temp(), builder.const(self.tok.value))
 
 
 class StringNode:
     def __init__(self, tok):
         self.tok = tok
 
-        self.pos_start = self.tok.pos_start
-        self.pos_end = self.tok.pos_end
+    @property
+    def pos_start(self):
+        return self.tok.pos_start
+
+    @property
+    def pos_end(self):
+        return self.tok.pos_end
 
     def __repr__(self):
         return f'{self.tok}'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        return f't{get_next_temp_var()} = "{self.tok.value}"\n'
+    def get_ir(self, builder):
+        return (OP_MOVE, builder.new_temp(), builder.const(self.tok.value))
 
 
 class ListNode:
@@ -39,11 +110,17 @@ class ListNode:
     def __repr__(self):
         return f'{self.element_nodes}'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code_statements = ''
-
-        for node in self.element_nodes:
-            code_statements += node.get_ic(get_next_temp_var, get_current_temp)
+    def ir_steps(self, builder):
+        # The value of the list is the value of its last element
+        wanted = builder.value_wanted
+        if not self.element_nodes:
+            return null_value(builder) if wanted else []
+
+        code_statements = []
+        last = len(self.element_nodes) - 1
+        for idx, node in enumerate(self.element_nodes):
+            code_statements.append(
+                (yield node if wanted and idx == last else Statement(node)))
         return code_statements
 
 
@@ -51,14 +128,19 @@ class VarAccessNode:
     def __init__(self, var_name_tok):
         self.var_name_tok = var_name_tok
 
-        self.pos_start = self.var_name_tok.pos_start
-        self.pos_end = self.var_name_tok.pos_end
+    @property
+    def pos_start(self):
+        return self.var_name_tok.pos_start
+
+    @property
+    def pos_end(self):
+        return self.var_name_tok.pos_end
 
     def __repr__(self):
         return f'{self.var_name_tok}'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        return f't{get_next_temp_var()} = {self.var_name_tok.value}\n'
+    def get_ir(self, builder):
+        return (OP_MOVE, builder.new_temp(), builder.var(self.var_name_tok.value))
 
 
 class VarAssignNode:
@@ -75,8 +157,9 @@ class VarAssignNode:
     def __repr__(self):
         return f'{self.var_token} {self.var_name_tok} {TT_EQ} {self.value_node}'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        return f'{self.value_node.get_ic(get_next_temp_var, get_current_temp)}{self.var_name_tok.value} = t{get_current_temp()}\n'
+    def ir_steps(self, builder):
+        value_code = yield self.value_node
+        return [value_code, (OP_MOVE, builder.var(self.var_name_tok.value), builder.current_temp())]
 
 
 class BinOpNode:
@@ -91,16 +174,19 @@ class BinOpNode:
     def __repr__(self):
         return f'({self.left_node}, {self.op_tok}, {self.right_node})'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        left_code = self.left_node.get_ic(get_next_temp_var, get_current_temp)
-        temp_left_code = get_current_temp()
+    def ir_steps(self, builder):
+        if is_logical(self):
+            return (yield from logical_value_steps(self, builder))
 
-        right_code = self.right_node.get_ic(
-            get_next_temp_var, get_current_temp)
-        temp_right_code = get_current_temp()
+        left_code = yield self.left_node
+        temp_left_code = builder.current_temp()
 
-        op = self.op_symbol_converter()
-        return f'{left_code}{right_code}t{get_next_temp_var()} = t{temp_left_code} {op} t{temp_right_code}\n'
+        right_code = yield self.right_node
+        temp_right_code = builder.current_temp()
+
+        opcode = BINARY_OPCODES[self.op_symbol_converter()]
+        return [left_code, right_code,
+                (opcode, builder.new_temp(), temp_left_code, temp_right_code)]
 
     def op_symbol_converter(self):
         if self.op_tok.type == TT_PLUS:
@@ -138,14 +224,93 @@ class UnaryOpNode:
     def __repr__(self):
         return f'({self.op_tok}, {self.node})'
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        node_code = self.node.get_ic(get_next_temp_var, get_current_temp)
-        temp_node_code = get_current_temp()
+    def ir_steps(self, builder):
+        if is_logical(self):
+            return (yield from logical_value_steps(self, builder))
+
+        node_code = yield self.node
+        temp_node_code = builder.current_temp()
 
         if self.op_tok.type == TT_MINUS:
-            return f'{node_code}t{get_next_temp_var()} = -t{temp_node_code}\n'
+            return [node_code, (OP_NEG, builder.new_temp(), temp_node_code)]
         else:
-            return f'{node_code}t{get_next_temp_var()} = +t{temp_node_code}\n'
+            return [node_code, (OP_POS, builder.new_temp(), temp_node_code)]
+
+
+# AND, OR and NOT are lowered to jumps, so that the right operand of AND
+# and OR is only evaluated when the left one does not decide the result
+def is_logical(node):
+    if isinstance(node, BinOpNode):
+        return node.op_tok.matches(TT_KEYWORD, 'AND') or node.op_tok.matches(TT_KEYWORD, 'OR')
+    return isinstance(node, UnaryOpNode) and node.op_tok.matches(TT_KEYWORD, 'NOT')
+
+
+def logical_value_steps(node, builder):
+    # The value of a logical node is 1 or 0: the result is set to 0, and
+    # to 1 unless the condition jumps over it
+    end_label = builder.new_label()
+    jump_code = yield ConditionalJump(node, end_label, False)
+    result = builder.new_temp()
+    return [(OP_MOVE, result, builder.const(0)), jump_code,
+            (OP_MOVE, result, builder.const(1)), (OP_LABEL, end_label)]
+
+
+"""ConditionalJump class
+
+    Description:
+        Not a node of the tree, but generated like one: the code that
+        evaluates a condition and jumps to a label when its truth value is
+        jump_if, and goes on with the next instruction otherwise. The
+        operands of AND, OR and NOT are conditional jumps themselves, so no
+        value is computed for them.
+
+    Arguments:
+        node (node): The condition
+        label (int): The LABEL operand to jump to
+        jump_if (bool): The truth value of the condition that jumps
+        layout (int): The layout of the jumps on the values of the operands
+
+    Returns:
+        ConditionalJump: A ConditionalJump object
+"""
+
+
+class ConditionalJump:
+    def __init__(self, node, label, jump_if, layout=0):
+        self.node = node
+        self.label = label
+        self.jump_if = jump_if
+        self.layout = layout
+
+    def ir_steps(self, builder):
+        node = self.node
+        if isinstance(node, UnaryOpNode) and is_logical(node):
+            return (yield ConditionalJump(node.node, self.label, not self.jump_if, self.layout))
+
+        if not is_logical(node):
+            node_code = yield node
+            opcode = OP_IF_TRUE if self.jump_if else OP_IF_FALSE
+            return [node_code, (opcode, self.label, builder.current_temp(), NONE, self.layout)]
+
+        # a AND b jumps if false when either operand is false, a OR b jumps
+        # if true when either one is true. Otherwise the right operand
+        # decides, once the left one did not skip it.
+        deciding = node.op_tok.value == 'OR'
+        if self.jump_if == deciding:
+            left_code = yield ConditionalJump(node.left_node, self.label, deciding, self.layout)
+            right_code = yield ConditionalJump(node.right_node, self.label, deciding, self.layout)
+            return [left_code, right_code]
+
+        skip_label = builder.new_label()
+        left_code = yield ConditionalJump(node.left_node, skip_label, deciding, self.layout)
+        right_code = yield ConditionalJump(node.right_node, self.label, self.jump_if, self.layout)
+        return [left_code, right_code,
+                (OP_LABEL, skip_label, NONE, NONE, self.layout & BARE_LABEL)]
+
+
+# IF/ELIF ladders of at least this many cases over one variable become a
+# SWITCH
+MIN_SWITCH_CASES = 4
 
 
 class IfNode:
@@ -195,67 +360,127 @@ class IfNode:
             # res += f"{self.else_token}, {self.else_case}"
         return res
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
-
+    def body_steps(self, builder, body, should_return_null, values):
+        # The code of a case. When the value of the IF is used, the value of
+        # the case goes to a result given once all the cases are generated,
+        # through the list values keeps.
+        if values is None or should_return_null:
+            return (yield Statement(body))
+
+        body_code = yield body
+        move = []
+        values.append((move, builder.current_temp()))
+        return [body_code, move]
+
+    def result_code(self, builder, values, init):
+        # Sets the result of an IF whose value is used: null, unless every
+        # way through the IF gives a value
+        result = builder.new_temp()
+        for move, value in values:
+            move.append((OP_MOVE, result, value))
+        cases = len(self.cases) + (self.else_case is not None)
+        if self.else_case is None or len(values) < cases:
+            init.append((OP_MOVE, result, builder.const(None)))
+
+    def ir_steps(self, builder):
+        values = [] if builder.value_wanted else None
+        if builder.jump_tables:
+            ladder = self.switch_cases()
+            if ladder:
+                return (yield from self.switch_steps(builder, values, *ladder))
+
+        init = []
+        code = [init]
+
+        # After the body of a case, the code goes past the cases that follow
+        # it and the ELSE case
+        end_label = None
+        if len(self.cases) > 1 or self.else_case is not None:
+            end_label = builder.new_label()
+
+        # The IF case and the ELIF cases are generated the same way
+        for idx, (condition, body, should_return_null) in enumerate(self.cases):
+            if is_logical(condition):
+                label = builder.new_label()
+                condition_code = yield ConditionalJump(
+                    condition, label, False, SPACE_BEFORE | SPACE_AFTER)
+            else:
+                condition_code = yield condition
+                temp_condition_code = builder.current_temp()
+                label = builder.new_label()
+                condition_code = [condition_code,
+                                  (OP_IF_FALSE, label, temp_condition_code, NONE, SPACE_BEFORE | SPACE_AFTER)]
+            body_code = yield from self.body_steps(builder, body, should_return_null, values)
+
+            code += [condition_code, body_code]
+            if idx < len(self.cases) - 1 or self.else_case is not None:
+                code.append((OP_GOTO, end_label, NONE, NONE, SPACE_AFTER))
+            code.append((OP_LABEL, label, NONE, NONE, SPACE_BEFORE))
+
+        # Add the ELSE keyword and its statement
         if self.else_case is not None:
-            # Start with the IF keyword and its condition
-            condition_code = self.cases[0][0].get_ic(
-                get_next_temp_var, get_current_temp)
-            temp_condition_code = get_current_temp()
-            label = get_next_temp_var()
-            body_code = self.cases[0][1].get_ic(
-                get_next_temp_var, get_current_temp)
-
-            code += f'{condition_code} if !t{temp_condition_code} goto L{label} \n{body_code} L{label}:\n'
-
-            # Add all the ELIF keywords, their conditions, and their statements
-            for case in self.cases[1:]:
-                condition_code = case[0].get_ic(
-                    get_next_temp_var, get_current_temp)
-                temp_condition_code = get_current_temp()
-                label = get_next_temp_var()
-                body_code = case[1].get_ic(
-                    get_next_temp_var, get_current_temp)
-
-                code += f'{condition_code} if !t{temp_condition_code} goto L{label} \n{body_code} L{label}:\n'
-
-            # Add the ELSE keyword and its statement
-            else_code = self.else_case[0].get_ic(
-                get_next_temp_var, get_current_temp)
-            code += f'{else_code}'
-        else:
-            # Start with the IF keyword and its condition
-            condition_code = self.cases[0][0].get_ic(
-                get_next_temp_var, get_current_temp)
-            temp_condition_code = get_current_temp()
-            label = get_next_temp_var()
-            body_code = self.cases[0][1].get_ic(
-                get_next_temp_var, get_current_temp)
-
-            code += f'{condition_code} if !t{temp_condition_code} goto L{label} \n{body_code} L{label}:\n'
-
-            # Add all the ELIF keywords and their conditions
-            for case in self.cases[1:]:
-                condition_code = case[0].get_ic(
-                    get_next_temp_var, get_current_temp)
-                temp_condition_code = get_current_temp()
-                label = get_next_temp_var()
-                body_code = case[1].get_ic(
-                    get_next_temp_var, get_current_temp)
-
-                code += f'{condition_code} if !t{temp_condition_code} goto L{label} \n{body_code} L{label}:\n'
+            else_code = yield from self.body_steps(builder, *self.else_case, values)
+            code.append(else_code)
+        if end_label is not None:
+            code.append((OP_LABEL, end_label, NONE, NONE, SPACE_BEFORE))
+        if values is not None:
+            self.result_code(builder, values, init)
         return code
-        # condition_code = self.cases[0][0].get_ic(
-        #     get_next_temp_var, get_current_temp)
-        # temp_condition_code = get_current_temp()
-        # label = get_next_temp_var()
-        # body_code = self.cases[0][1].get_ic(
-        #     get_next_temp_var, get_current_temp)
-
-        # code += f'{condition_code} if !t{temp_condition_code} goto L{label} \n{body_code} L{label}:\n'
 
-        # return code
+    def switch_cases(self):
+        # The variable and the values of a ladder of at least
+        # MIN_SWITCH_CASES cases that compare the same variable to distinct
+        # integers, as in IF op == 1 THEN ... ELIF op == 2 THEN ...
+        if len(self.cases) < MIN_SWITCH_CASES:
+            return None
+
+        name = None
+        values = []
+        for condition, body, should_return_null in self.cases:
+            if not isinstance(condition, BinOpNode) or condition.op_tok.type != TT_EE:
+                return None
+            variable, number = condition.left_node, condition.right_node
+            if isinstance(variable, NumberNode):
+                variable, number = number, variable
+            if not isinstance(variable, VarAccessNode) or not isinstance(number, NumberNode) \
+                    or type(number.tok.value) is not int:
+                return None
+            if name is None:
+                name = variable.var_name_tok.value
+            elif variable.var_name_tok.value != name:
+                return None
+            values.append(number.tok.value)
+
+        if len(set(values)) < len(values):
+            return None
+        return name, values
+
+    def switch_steps(self, builder, case_values, name, values):
+        # The variable is read once, and a SWITCH goes to the body of its
+        # case, or to the ELSE case when no value is equal to it
+        init = []
+        temp_value = builder.new_temp()
+        default_label = builder.new_label()
+        end_label = builder.new_label()
+        labels = [builder.new_label() for value in values]
+        table = builder.const(tuple(sorted(zip(values, labels))))
+
+        code = [init, (OP_MOVE, temp_value, builder.var(name)),
+                (OP_SWITCH, default_label, temp_value, table, SPACE_AFTER)]
+
+        for (condition, body, should_return_null), label in zip(self.cases, labels):
+            body_code = yield from self.body_steps(builder, body, should_return_null, case_values)
+            code += [(OP_LABEL, label, NONE, NONE, SPACE_BEFORE), body_code,
+                     (OP_GOTO, end_label, NONE, NONE, SPACE_AFTER)]
+
+        code.append((OP_LABEL, default_label, NONE, NONE, SPACE_BEFORE))
+        if self.else_case is not None:
+            else_code = yield from self.body_steps(builder, *self.else_case, case_values)
+            code.append(else_code)
+        code.append((OP_LABEL, end_label, NONE, NONE, SPACE_BEFORE))
+        if case_values is not None:
+            self.result_code(builder, case_values, init)
+        return code
 
 
 class ForNode:
@@ -280,49 +505,52 @@ class ForNode:
         res = f"{self.for_token}, {self.var_name_tok}, {self.to_token}, {self.end_value_node}, {self.step_token}, {self.step_value_node}, {self.then_token}, {self.body_node}"
         return res
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
-
-        variable_name_token_name = self.var_name_tok.value
+    def ir_steps(self, builder):
+        # The variable is set to the start value, and the end and step values
+        # are computed once. The loop is a do-while behind a first test of
+        # the end: the variable is compared to the end once per iteration,
+        # after it is stepped, and the body runs again while it is not past it.
+        # Its value is null.
+        wanted = builder.value_wanted
+        variable = builder.var(self.var_name_tok.value)
 
-        start_value_code = self.start_value_node.get_ic(
-            get_next_temp_var, get_current_temp)
-        temp_start_value_code = get_current_temp()
+        start_value_code = yield self.start_value_node
+        temp_start_value_code = builder.current_temp()
 
-        end_value_code = self.end_value_node.get_ic(
-            get_next_temp_var, get_current_temp)
-        temp_end_value_code = get_current_temp()
+        end_value_code = yield self.end_value_node
+        temp_end_value_code = builder.current_temp()
 
         if self.step_value_node:
-            step_value_code = self.step_value_node.get_ic(
-                get_next_temp_var, get_current_temp)
-            temp_step_value_code = get_current_temp()
-
-        loop_start_label = get_next_temp_var()
-        loop_end_label = get_next_temp_var()
-
-        code += f'\n {loop_start_label}: \n'
-
-        code += f'{start_value_code}\n'
-        code += f'{start_value_code} t{temp_start_value_code} = {variable_name_token_name} \n'
-        code += f'{end_value_code}\n'
-        if self.step_value_node:
-            code += f'{step_value_code} t{temp_step_value_code} = {variable_name_token_name} \n'
-
-        code += f'if t{temp_start_value_code} > t{temp_end_value_code} goto L{loop_end_label} \n'
-
-        body_code = self.body_node.get_ic(
-            get_next_temp_var, get_current_temp)
-        code += body_code
-
-        if self.step_value_node:
-            code += f'{variable_name_token_name} = {variable_name_token_name} + t{temp_step_value_code} \n'
+            step_value_code = yield self.step_value_node
+            step = builder.current_temp()
         else:
-            code += f'{variable_name_token_name} = {variable_name_token_name} + 1 \n'
-
-        code += f'goto L{loop_start_label} \n'
-
-        code += f'\n {loop_end_label}: \n'
+            step_value_code = []
+            step = builder.const(1)
+
+        body_label = builder.new_label()
+        continue_label = builder.new_label()
+        loop_end_label = builder.new_label()
+        spaced = SPACE_BEFORE | SPACE_AFTER
+
+        code = [start_value_code, end_value_code, step_value_code,
+                (OP_MOVE, variable, temp_start_value_code, NONE, spaced),
+                (OP_IF_GREATER, loop_end_label, variable, temp_end_value_code,
+                 SPACE_AFTER | BARE_LABEL),
+                (OP_LABEL, body_label, NONE, NONE, LINE_BEFORE | spaced | BARE_LABEL)]
+
+        builder.loops.append((continue_label, loop_end_label))
+        body_code = yield Statement(self.body_node)
+        builder.loops.pop()
+
+        temp_test = builder.new_temp()
+        code += [body_code,
+                 (OP_LABEL, continue_label, NONE, NONE, spaced | BARE_LABEL),
+                 (OP_ADD, variable, variable, step, SPACE_AFTER),
+                 (OP_LTE, temp_test, variable, temp_end_value_code),
+                 (OP_IF_TRUE, body_label, temp_test, NONE, SPACE_AFTER | BARE_LABEL),
+                 (OP_LABEL, loop_end_label, NONE, NONE, LINE_BEFORE | spaced | BARE_LABEL)]
+        if wanted:
+            code.append(null_value(builder))
 
         return code
 
@@ -344,30 +572,31 @@ class WhileNode:
         res = f"{self.while_token}, {self.condition_node}, {self.then_token}, {self.body_node}"
         return res
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
+    def ir_steps(self, builder):
+        # A do-while behind a first test of the condition. The condition is
+        # generated again at the end of the body, where it is tested once
+        # per iteration and jumps back to the body while it holds. Its value
+        # is null.
+        wanted = builder.value_wanted
+        body_label = builder.new_label()
+        continue_label = builder.new_label()
+        loop_end_label = builder.new_label()
 
-        condition_code = self.condition_node.get_ic(
-            get_next_temp_var, get_current_temp)
-        temp_condition_code = get_current_temp()
+        guard_code = yield ConditionalJump(self.condition_node, loop_end_label, False, BARE_LABEL)
 
-        loop_start_label = get_next_temp_var()
-        loop_end_label = get_next_temp_var()
+        builder.loops.append((continue_label, loop_end_label))
+        body_code = yield Statement(self.body_node)
+        builder.loops.pop()
 
-        code += f'\n{loop_start_label}:\n'
+        test_code = yield ConditionalJump(self.condition_node, body_label, True, BARE_LABEL)
 
-        code += f'{condition_code}t{get_next_temp_var()} = t{temp_condition_code}\n'
-        code += f'if !t{get_current_temp()} goto {loop_end_label}\n'
-
-        body_code = self.body_node.get_ic(get_next_temp_var, get_current_temp)
-        temp_body_code = get_current_temp()
-
-        code += f'{body_code}t{get_next_temp_var()} = t{temp_body_code}\n'
-
-        code += f'goto {loop_start_label}\n'
-        code += f'{loop_end_label}:\n\n'
-
-        return code
+        return [guard_code,
+                (OP_LABEL, body_label, NONE, NONE, LINE_BEFORE | BARE_LABEL),
+                body_code,
+                (OP_LABEL, continue_label, NONE, NONE, BARE_LABEL),
+                test_code,
+                (OP_LABEL, loop_end_label, NONE, NONE, BARE_LABEL),
+                null_value(builder) if wanted else [], BLANK_LINE]
 
 
 class FuncDefNode:
@@ -392,28 +621,40 @@ class FuncDefNode:
     def __repr__(self):
         return f"{self.fun_token}, {self.var_name_tok}, {self.arg_name_toks}, {self.body_node}"
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
-        func_name = self.var_name_tok.value if self.var_name_tok else None
+    def ir_steps(self, builder):
+        # The value of the definition is the function. An anonymous one is
+        # only stored, in a variable of its own, when the value is used.
+        wanted = builder.value_wanted
+        code = []
 
-        if func_name:
-            code += f'\n\nfunc_start {func_name}\n'
+        function = NONE
+        if self.var_name_tok:
+            function = builder.var(self.var_name_tok.value)
+        elif wanted:
+            function = builder.var(ANONYMOUS_FUNCTION_VARIABLE)
+        if function == NONE:
+            code.append((OP_FUNC_START,))
         else:
-            code += f'\n\nfunc_start\n'
+            code.append((OP_FUNC_START, NONE, function))
 
         for arg_name_tok in self.arg_name_toks:
-            code += f'arg {arg_name_tok.value}\n'
+            code.append((OP_ARG, NONE, builder.var(arg_name_tok.value)))
 
-        body_code = self.body_node.get_ic(get_next_temp_var, get_current_temp)
-        temp_body_code = get_current_temp()
+        builder.loops.append(None)
+        if self.should_auto_return:
+            body_code = yield self.body_node
+        else:
+            body_code = yield Statement(self.body_node)
+        builder.loops.pop()
 
-        # code += f'{body_code} t{get_next_temp_var()} = t{temp_body_code}\n'
-        code += f'{body_code}\n'
+        code += [body_code, BLANK_LINE]
 
         if self.should_auto_return:
-            code += f'RETURN t{get_current_temp()}\n'
+            code.append((OP_RETURN, NONE, builder.current_temp()))
 
-        code += f'func_end\n\n\n'
+        code.append((OP_FUNC_END,))
+        if wanted:
+            code.append((OP_MOVE, builder.new_temp(), function))
 
         return code
 
@@ -440,21 +681,24 @@ class CallNode:
     def __repr__(self):
         return f"{self.node_to_call}, {self.open_paren_token}, {self.arg_nodes}, {self.close_paren_token}"
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        arg_nodes_ic = ''
-        arg_nodes_temps = ''
+    def ir_steps(self, builder):
+        # A named function is called through its variable, any other
+        # expression through the temporary that holds its value
+        arg_nodes_ir = []
+        arg_nodes_params = []
 
-        for arg_node in self.arg_nodes:
-            arg_nodes_ic += arg_node.get_ic(get_next_temp_var,
-                                            get_current_temp)
-            arg_nodes_temp = get_current_temp()
+        if isinstance(self.node_to_call, VarAccessNode):
+            function = builder.var(self.node_to_call.var_name_tok.value)
+        else:
+            arg_nodes_ir.append((yield self.node_to_call))
+            function = builder.current_temp()
 
-            if arg_nodes_temps == '':
-                arg_nodes_temps += f't{arg_nodes_temp}'
-            else:
-                arg_nodes_temps += f', t{arg_nodes_temp}'
+        for arg_node in self.arg_nodes:
+            arg_nodes_ir.append((yield arg_node))
+            arg_nodes_params.append((OP_PARAM, NONE, builder.current_temp()))
 
-        return f'{arg_nodes_ic} CALL {self.node_to_call.var_name_tok.value} {arg_nodes_temps}\n'
+        return [arg_nodes_ir, arg_nodes_params,
+                (OP_CALL, builder.new_temp(), function, NONE, SPACE_BEFORE)]
 
 
 class ReturnNode:
@@ -470,8 +714,12 @@ class ReturnNode:
     def __repr__(self):
         return f"{self.return_token}, {self.node_to_return}"
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        return f'{self.node_to_return.get_ic(get_next_temp_var, get_current_temp)} RETURN t{get_current_temp()}\n'
+    def ir_steps(self, builder):
+        # A RETURN without a value returns null
+        if self.node_to_return is None:
+            return (OP_RETURN, NONE, NONE, NONE, SPACE_BEFORE)
+        return_code = yield self.node_to_return
+        return [return_code, (OP_RETURN, NONE, builder.current_temp(), NONE, SPACE_BEFORE)]
 
 
 class ContinueNode:
@@ -485,11 +733,16 @@ class ContinueNode:
     def __repr__(self):
         return f"{self.continue_token}"
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
-        code += f'goto {get_next_temp_var()}\n\n'
-        code += f'{get_current_temp()}:\n'
-        return code
+    def get_ir(self, builder):
+        # Goes to the step of a FOR loop, or the test of a WHILE loop. Out
+        # of any loop, it jumps to the next instruction and its value is null.
+        if builder.loops and builder.loops[-1] is not None:
+            return [(OP_GOTO, builder.loops[-1][0], NONE, NONE, BARE_LABEL), BLANK_LINE]
+        wanted = builder.value_wanted
+        label = builder.new_label()
+        return [(OP_GOTO, label, NONE, NONE, BARE_LABEL), BLANK_LINE,
+                (OP_LABEL, label, NONE, NONE, BARE_LABEL),
+                null_value(builder) if wanted else []]
 
 
 class BreakNode:
@@ -503,8 +756,13 @@ class BreakNode:
     def __repr__(self):
         return f"{self.break_token}"
 
-    def get_ic(self, get_next_temp_var, get_current_temp):
-        code = ''
-        code += f'goto {get_next_temp_var()}\n\n'
-        code += f'{get_current_temp()}:\n\n'
-        return code
+    def get_ir(self, builder):
+        # Leaves the innermost loop. Out of any loop, it jumps to the next
+        # instruction and its value is null.
+        if builder.loops and builder.loops[-1] is not None:
+            return [(OP_GOTO, builder.loops[-1][1], NONE, NONE, BARE_LABEL), BLANK_LINE]
+        wanted = builder.value_wanted
+        label = builder.new_label()
+        return [(OP_GOTO, label, NONE, NONE, BARE_LABEL), BLANK_LINE,
+                (OP_LABEL, label, NONE, NONE, BARE_LABEL),
+                null_value(builder) if wanted else [], BLANK_LINE]
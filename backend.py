@@ -0,0 +1,578 @@
+import ast
+import keyword
+from ast_nodes import *
+from error import Error, RTError
+from position import Position
+from evaluator import run_deep, PYTHON_FRAMES_PER_CALL
+
+"""
+    This document contains the following:
+    1. PythonBackend class, which translates a tree to a Python ast.Module
+    2. compile_python function, which compiles the module with compile()
+    3. The mapping of the errors of the compiled code back to the source
+    4. run_python function
+
+    The program becomes the body of a Python function, and every Mini
+    function a Python function inside it, so that the code CPython runs
+    keeps the semantics of the intermediate code: comparisons and AND, OR
+    and NOT give 1 or 0, ^ is a power, division always gives a float, and
+    a FOR loop computes its end and step once and runs while its variable
+    is not past its end. The arguments of a function are its locals, and
+    the other variables are globals of the module, shared by all the
+    functions.
+
+    Every node of the Python tree has the position of the Mini node it
+    comes from, so the line and the columns of an error in the compiled
+    code are those of the .mini source.
+"""
+
+
+# The names given to the values the translation keeps to itself start with
+# an underscore, which no Mini name does
+PROGRAM_FUNCTION = '_program'
+
+
+class UnsupportedError(Error):
+    def __init__(self, pos_start, pos_end, details):
+        super().__init__(pos_start, pos_end, 'Unsupported', details)
+
+
+class Unsupported(Exception):
+    def __init__(self, node, details):
+        self.error = UnsupportedError(node.pos_start, node.pos_end, details)
+
+
+COMPARE_OPERATORS = {
+    TT_EE: ast.Eq, TT_NE: ast.NotEq, TT_LT: ast.Lt, TT_GT: ast.Gt,
+    TT_LTE: ast.LtE, TT_GTE: ast.GtE,
+}
+
+ARITHMETIC_OPERATORS = {
+    TT_PLUS: ast.Add, TT_MINUS: ast.Sub, TT_MUL: ast.Mult, TT_DIV: ast.Div,
+    TT_POW: ast.Pow,
+}
+
+
+def python_name(name):
+    # The Mini names that are Python keywords are renamed
+    if keyword.iskeyword(name) or name in ('None', 'True', 'False'):
+        return f'_v_{name}'
+    return name
+
+
+def mini_name(name):
+    return name[3:] if name.startswith('_v_') else name
+
+
+def names_used(node):
+    # The variables node's code reads or writes, leaving out the code of the
+    # functions defined in it
+    names = set()
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        if node is None:
+            continue
+        if isinstance(node, (VarAccessNode, VarAssignNode, ForNode)):
+            names.add(node.var_name_tok.value)
+        if isinstance(node, FuncDefNode):
+            if node.var_name_tok:
+                names.add(node.var_name_tok.value)
+            continue
+
+        if isinstance(node, ListNode):
+            stack.extend(node.element_nodes)
+        elif isinstance(node, VarAssignNode):
+            stack.append(node.value_node)
+        elif isinstance(node, BinOpNode):
+            stack += [node.left_node, node.right_node]
+        elif isinstance(node, UnaryOpNode):
+            stack.append(node.node)
+        elif isinstance(node, IfNode):
+            for condition, body, should_return_null in node.cases:
+                stack += [condition, body]
+            if node.else_case is not None:
+                stack.append(node.else_case[0])
+        elif isinstance(node, ForNode):
+            stack += [node.start_value_node, node.end_value_node,
+                      node.step_value_node, node.body_node]
+        elif isinstance(node, WhileNode):
+            stack += [node.condition_node, node.body_node]
+        elif isinstance(node, CallNode):
+            stack += [node.node_to_call] + node.arg_nodes
+        elif isinstance(node, ReturnNode):
+            stack.append(node.node_to_return)
+    return names
+
+
+# ===============================================================================
+# TRANSLATION
+# ===============================================================================
+"""PythonBackend class
+
+    Description:
+        Translates the tree of a program to a Python ast.Module. A node is
+        translated as a statement where its value is not used, and as an
+        expression otherwise. The definitions an expression needs, such as
+        the function of a FUN inside an expression, are put in a prelude
+        that goes before the statement the expression is in.
+
+    Attributes:
+        scopes (list): The arguments of every Mini function being translated,
+            innermost last, and None for the program
+        loops (list): For the loops being translated, innermost last, whether
+            a CONTINUE of their body jumps back to their step
+        prelude (list): The definitions needed by the statement being
+            translated
+        names (dict): The Mini name of every global of the module
+        calls (dict): The Python name the function of every call is read
+            from, by the span of the call
+        returns (bool): Whether a RETURN leaves the Python function being
+            translated, rather than the function of a loop inside an
+            expression
+
+    Returns:
+        PythonBackend: A PythonBackend object
+"""
+
+
+class PythonBackend:
+    def __init__(self):
+        self.scopes = [None]
+        self.loops = []
+        self.prelude = []
+        self.names = {}
+        self.calls = {}
+        self.hidden_count = 0
+        # The span of every Mini node, by node
+        self.spans = {}
+        # Whether a RETURN leaves the Python function being translated
+        self.returns = True
+
+    def hidden(self, prefix):
+        self.hidden_count += 1
+        return f'_{prefix}{self.hidden_count}'
+
+    def at(self, python_node, node):
+        # Gives the Python node the span of the Mini node. Most Mini nodes
+        # give theirs to several Python nodes, so it is looked up once.
+        span = self.spans.get(node)
+        if span is None:
+            ln, col = node.pos_start.line_col()
+            end_ln, end_col = node.pos_end.line_col()
+            span = self.spans[node] = (ln + 1, col, end_ln + 1, end_col)
+        (python_node.lineno, python_node.col_offset,
+         python_node.end_lineno, python_node.end_col_offset) = span
+        return python_node
+
+    def load(self, name, node):
+        return self.at(ast.Name(self.python_name(name), ast.Load()), node)
+
+    def store(self, name, node):
+        return self.at(ast.Name(self.python_name(name), ast.Store()), node)
+
+    def python_name(self, name):
+        translated = python_name(name)
+        self.names[translated] = name
+        return translated
+
+    def declarations(self, node, arguments):
+        # The names node's code shares with the other functions are globals,
+        # those of the Mini function around it are its arguments
+        names = names_used(node)
+        local = set(arguments)
+        outer = self.scopes[-1] or ()
+        statements = []
+        shared = sorted(python_name(name) for name in names - local
+                        if name not in outer)
+        if shared:
+            statements.append(self.at(ast.Global(shared), node))
+        enclosing = sorted(python_name(name) for name in names - local
+                           if name in outer)
+        if enclosing:
+            statements.append(self.at(ast.Nonlocal(enclosing), node))
+        return statements
+
+    def module(self, tree):
+        body = self.declarations(tree, ()) + self.statements(tree)
+        program = self.at(ast.FunctionDef(
+            PROGRAM_FUNCTION, ast.arguments([], [], None, [], [], None, []),
+            body or [self.at(ast.Pass(), tree)], [], None), tree)
+        module = ast.Module([program], [])
+        return ast.fix_missing_locations(module)
+
+    # STATEMENTS
+    def statements(self, node):
+        # The statements of a node whose value is not used, each one after
+        # the definitions its expressions need
+        if isinstance(node, ListNode):
+            result = []
+            for element in node.element_nodes:
+                result += self.statements(element)
+            return result
+
+        outer_prelude = self.prelude
+        self.prelude = []
+        try:
+            translated = self.statement(node)
+            return self.prelude + translated
+        finally:
+            self.prelude = outer_prelude
+
+    def body(self, node):
+        return self.statements(node) or [self.at(ast.Pass(), node)]
+
+    def statement(self, node):
+        if isinstance(node, VarAssignNode):
+            return [self.at(ast.Assign([self.store(node.var_name_tok.value, node)],
+                                       self.value(node.value_node)), node)]
+        if isinstance(node, IfNode):
+            return [self.if_statement(node, 0)]
+        if isinstance(node, ForNode):
+            return self.for_statements(node)
+        if isinstance(node, WhileNode):
+            self.loops.append(False)
+            body = self.body(node.body_node)
+            self.loops.pop()
+            return [self.at(ast.While(self.test(node.condition_node), body, []), node)]
+        if isinstance(node, FuncDefNode):
+            return self.function_statements(node)
+        if isinstance(node, ReturnNode):
+            if not self.returns:
+                raise Unsupported(node, 'RETURN inside an expression')
+            value = (self.value(node.node_to_return) if node.node_to_return
+                     else self.at(ast.Constant(None), node))
+            return [self.at(ast.Return(value), node)]
+        if isinstance(node, (BreakNode, ContinueNode)):
+            # Out of any loop, they do nothing
+            if not self.loops:
+                return [self.at(ast.Pass(), node)]
+            if isinstance(node, BreakNode):
+                return [self.at(ast.Break(), node)]
+            self.loops[-1] = True
+            return [self.at(ast.Continue(), node)]
+        return [self.at(ast.Expr(self.value(node)), node)]
+
+    def if_statement(self, node, idx):
+        condition, body, should_return_null = node.cases[idx]
+        if idx + 1 < len(node.cases):
+            orelse = [self.if_statement(node, idx + 1)]
+        elif node.else_case is not None:
+            orelse = self.body(node.else_case[0])
+        else:
+            orelse = []
+        return self.at(ast.If(self.test(condition), self.body(body), orelse), condition)
+
+    def for_statements(self, node):
+        # As in the intermediate code: the variable is set to the start, the
+        # loop is skipped if it is past the end, and after each iteration it
+        # is stepped and tested again. A CONTINUE goes to the step, at the
+        # top of the loop, after a first pass that skips it.
+        name = node.var_name_tok.value
+        statements = []
+        if isinstance(node.end_value_node, NumberNode) and \
+                isinstance(node.step_value_node, (NumberNode, type(None))):
+            start = self.value(node.start_value_node)
+        else:
+            # The end and the step are computed before the variable is set
+            start = self.once(node.start_value_node, 'start', statements)
+        end = self.once(node.end_value_node, 'end', statements)
+        step = (self.once(node.step_value_node, 'step', statements)
+                if node.step_value_node else self.at(ast.Constant(1), node))
+        statements.append(self.at(ast.Assign([self.store(name, node)], start), node))
+
+        self.loops.append(False)
+        body = self.body(node.body_node)
+        continues = self.loops.pop()
+
+        stepped = self.at(ast.Assign([self.store(name, node)], self.at(ast.BinOp(
+            self.load(name, node), ast.Add(), step), node)), node)
+        past_end = self.at(ast.If(self.at(ast.UnaryOp(ast.Not(), self.at(ast.Compare(
+            self.load(name, node), [ast.LtE()], [end]), node)), node),
+            [self.at(ast.Break(), node)], []), node)
+
+        if continues:
+            first = self.hidden('first')
+            statements.append(self.at(ast.Assign([self.at(ast.Name(first, ast.Store()), node)],
+                                                 self.at(ast.Constant(True), node)), node))
+            loop_body = [self.at(ast.If(
+                self.at(ast.Name(first, ast.Load()), node),
+                [self.at(ast.Assign([self.at(ast.Name(first, ast.Store()), node)],
+                                    self.at(ast.Constant(False), node)), node)],
+                [stepped, past_end]), node)] + body
+        else:
+            loop_body = body + [stepped, past_end]
+
+        loop = self.at(ast.While(self.at(ast.Constant(True), node), loop_body, []), node)
+        statements.append(self.at(ast.If(self.at(ast.UnaryOp(ast.Not(), self.at(ast.Compare(
+            self.load(name, node), [ast.Gt()], [end]), node)), node), [loop], []), node))
+        return statements
+
+    def once(self, node, prefix, statements):
+        # A value computed once, before the loop, unless it is a constant
+        if isinstance(node, NumberNode):
+            return self.at(ast.Constant(node.tok.value), node)
+        name = self.hidden(prefix)
+        statements.append(self.at(ast.Assign([self.at(ast.Name(name, ast.Store()), node)],
+                                             self.value(node)), node))
+        return self.at(ast.Name(name, ast.Load()), node)
+
+    def function_statements(self, node):
+        # The definition of the function, bound to its name or to a hidden
+        # one for an anonymous function
+        arguments = [arg_name_tok.value for arg_name_tok in node.arg_name_toks]
+        if len(set(arguments)) < len(arguments):
+            raise Unsupported(node, 'A function with an argument named twice')
+
+        outer_scopes, outer_loops, outer_returns = self.scopes, self.loops, self.returns
+        self.scopes = self.scopes + [arguments]
+        self.loops = []
+        self.returns = True
+        try:
+            body = self.declarations(node.body_node, arguments)
+            if node.should_auto_return:
+                outer_prelude = self.prelude
+                self.prelude = []
+                value = self.value(node.body_node)
+                body += self.prelude + [self.at(ast.Return(value), node.body_node)]
+                self.prelude = outer_prelude
+            else:
+                body += self.body(node.body_node)
+        finally:
+            self.scopes, self.loops, self.returns = outer_scopes, outer_loops, outer_returns
+
+        # Missing arguments are None and extra ones are ignored, as with
+        # the PARAMs of a CALL
+        python_arguments = [self.at(ast.arg(self.python_name(argument)), node)
+                            for argument in arguments]
+        signature = ast.arguments(
+            [], python_arguments, self.at(ast.arg('_extra'), node), [], [], None,
+            [self.at(ast.Constant(None), node) for argument in arguments])
+        name = (self.python_name(node.var_name_tok.value) if node.var_name_tok
+                else self.hidden('function'))
+        return [self.at(ast.FunctionDef(name, signature, body, [], None), node)]
+
+    # EXPRESSIONS
+    def test(self, node):
+        # An expression only tested for its truth, where a comparison or a
+        # logical operator does not need to give 1 or 0
+        if isinstance(node, BinOpNode):
+            if is_logical(node):
+                operator = ast.And() if node.op_tok.value == 'AND' else ast.Or()
+                return self.at(ast.BoolOp(operator, [self.test(node.left_node),
+                                                     self.test(node.right_node)]), node)
+            if node.op_tok.type in COMPARE_OPERATORS:
+                return self.compare(node)
+        if isinstance(node, UnaryOpNode) and is_logical(node):
+            return self.at(ast.UnaryOp(ast.Not(), self.test(node.node)), node)
+        return self.value(node)
+
+    def compare(self, node):
+        operator = COMPARE_OPERATORS[node.op_tok.type]()
+        return self.at(ast.Compare(self.value(node.left_node), [operator],
+                                   [self.value(node.right_node)]), node)
+
+    def truth_value(self, test, node):
+        # 1 or 0
+        return self.at(ast.IfExp(test, self.at(ast.Constant(1), node),
+                                 self.at(ast.Constant(0), node)), node)
+
+    def value(self, node):
+        if isinstance(node, (NumberNode, StringNode)):
+            return self.at(ast.Constant(node.tok.value), node)
+        if isinstance(node, VarAccessNode):
+            return self.load(node.var_name_tok.value, node)
+        if isinstance(node, VarAssignNode):
+            return self.at(ast.NamedExpr(self.store(node.var_name_tok.value, node),
+                                         self.value(node.value_node)), node)
+        if isinstance(node, BinOpNode):
+            if is_logical(node) or node.op_tok.type in COMPARE_OPERATORS:
+                return self.truth_value(self.test(node), node)
+            operator = ARITHMETIC_OPERATORS[node.op_tok.type]()
+            return self.at(ast.BinOp(self.value(node.left_node), operator,
+                                     self.value(node.right_node)), node)
+        if isinstance(node, UnaryOpNode):
+            if is_logical(node):
+                return self.truth_value(self.test(node), node)
+            operator = ast.USub() if node.op_tok.type == TT_MINUS else ast.UAdd()
+            return self.at(ast.UnaryOp(operator, self.value(node.node)), node)
+        if isinstance(node, CallNode):
+            # The function is kept in a name, where the error of a call of
+            # something else finds it
+            function = self.value(node.node_to_call)
+            if not isinstance(function, ast.Name):
+                function = self.at(ast.NamedExpr(
+                    self.at(ast.Name(self.hidden('function'), ast.Store()), node),
+                    function), node.node_to_call)
+            call = self.at(ast.Call(function,
+                                    [self.value(arg_node) for arg_node in node.arg_nodes],
+                                    []), node)
+            name = function.id if isinstance(function, ast.Name) else function.target.id
+            self.calls[(call.lineno, call.end_lineno, call.col_offset,
+                        call.end_col_offset)] = name
+            return call
+        if isinstance(node, ListNode):
+            # Its elements in order, giving the last one
+            elements = [self.value(element) for element in node.element_nodes]
+            if not elements:
+                return self.at(ast.Constant(None), node)
+            if len(elements) == 1:
+                return elements[0]
+            return self.at(ast.Subscript(self.at(ast.Tuple(elements, ast.Load()), node),
+                                         self.at(ast.Constant(-1), node), ast.Load()), node)
+        if isinstance(node, IfNode):
+            return self.if_value(node, 0)
+        if isinstance(node, FuncDefNode):
+            definition = self.function_statements(node)
+            self.prelude += definition
+            return self.at(ast.Name(definition[0].name, ast.Load()), node)
+        if isinstance(node, (BreakNode, ContinueNode)) and not self.loops:
+            return self.at(ast.Constant(None), node)
+        if isinstance(node, (ForNode, WhileNode)):
+            return self.loop_value(node)
+        raise Unsupported(node, f'{type(node).__name__[:-4].upper()} inside an expression')
+
+    def if_value(self, node, idx):
+        if idx == len(node.cases):
+            if node.else_case is None:
+                return self.at(ast.Constant(None), node)
+            return self.body_value(*node.else_case)
+        condition, body, should_return_null = node.cases[idx]
+        return self.at(ast.IfExp(self.test(condition),
+                                 self.body_value(body, should_return_null),
+                                 self.if_value(node, idx + 1)), condition)
+
+    def body_value(self, body, should_return_null):
+        value = self.value(body)
+        if not should_return_null:
+            return value
+        none = self.at(ast.Constant(None), body)
+        return self.at(ast.Subscript(self.at(ast.Tuple([value, none], ast.Load()), body),
+                                     self.at(ast.Constant(1), body), ast.Load()), body)
+
+    def loop_value(self, node):
+        # A loop inside an expression runs in a function of its own, called
+        # where the loop is. Its value is None. The arguments of the Mini
+        # function around it are nonlocal to it.
+        outer_loops, outer_returns = self.loops, self.returns
+        self.loops = []
+        self.returns = False
+        try:
+            body = self.declarations(node, ()) + self.statements(node)
+        finally:
+            self.loops, self.returns = outer_loops, outer_returns
+        name = self.hidden('loop')
+        self.prelude.append(self.at(ast.FunctionDef(
+            name, ast.arguments([], [], None, [], [], None, []), body, [], None), node))
+        return self.at(ast.Call(self.at(ast.Name(name, ast.Load()), node), [], []), node)
+
+
+# ===============================================================================
+# COMPILE AND RUN
+# ===============================================================================
+def translate(tree):
+    # The ast.Module of a program, the Mini name of its globals and the
+    # name of the function of its calls
+    backend = PythonBackend()
+    try:
+        return (backend.module(tree), backend.names, backend.calls), None
+    except Unsupported as exception:
+        return None, exception.error
+    except RecursionError:
+        # The translation recurses once per level of the tree
+        return None, nesting_error(tree)
+
+
+def nesting_error(tree):
+    return UnsupportedError(tree.pos_start, tree.pos_end,
+                            'The program is nested too deeply for Python')
+
+
+def format_python(tree):
+    # The Python source of a program, as ast.unparse prints the module
+    translation, error = translate(tree)
+    if error:
+        return None, error
+    module, names, calls = translation
+    try:
+        return ast.unparse(module), None
+    except RecursionError:
+        return None, nesting_error(tree)
+
+
+def compile_python(tree, fn):
+    # The code object of a program, the Mini name of its globals and the
+    # name of the function of its calls. Its file name is fn, so the
+    # tracebacks of the compiled code show the lines of the .mini source.
+    translation, error = translate(tree)
+    if error:
+        return None, error
+    module, names, calls = translation
+    try:
+        return (compile(module, fn, 'exec'), names, calls), None
+    except (SyntaxError, RecursionError) as exception:
+        return None, UnsupportedError(tree.pos_start, tree.pos_end, str(exception))
+
+
+def source_error(exception, fn, tree, calls):
+    # The error of the innermost frame of the compiled code, at the span of
+    # the Mini node its instruction comes from
+    traceback = exception.__traceback__
+    position = frame = None
+    while traceback is not None:
+        code = traceback.tb_frame.f_code
+        if code.co_filename == fn and traceback.tb_lasti >= 0:
+            if hasattr(code, 'co_positions'):
+                positions = list(code.co_positions())
+                position = positions[traceback.tb_lasti // 2]
+            else:
+                # Before Python 3.11 only the line of the instruction is
+                # known, and the error spans all of it
+                position = (traceback.tb_lineno, traceback.tb_lineno, 0, None)
+            frame = traceback.tb_frame
+        traceback = traceback.tb_next
+
+    details = ('Maximum call depth exceeded' if isinstance(exception, RecursionError)
+               else str(exception))
+    # A call of a value that is not a function, worded as the other engines
+    # word it
+    if isinstance(exception, TypeError) and position in calls:
+        name = calls[position]
+        function = frame.f_locals[name] if name in frame.f_locals else frame.f_globals[name]
+        if not callable(function):
+            details = f'{function!r} is not a function'
+    src = tree.pos_start.src
+    if position is None or position[0] is None:
+        return RTError(details, pos_start=tree.pos_start, pos_end=tree.pos_end)
+
+    line, end_line, col, end_col = position
+    if col is None:
+        col, end_col = 0, None
+    pos_start = Position(src.line_start(line - 1) + col, src)
+    if end_col is None:
+        line_end = src.ftxt.find('\n', pos_start.idx)
+        pos_end = Position(len(src.ftxt) if line_end < 0 else line_end, src)
+    else:
+        pos_end = Position(src.line_start(end_line - 1) + end_col, src)
+    return RTError(details, pos_start=pos_start, pos_end=pos_end)
+
+
+def execute_python(compiled, fn, tree):
+    # Runs a compiled program in a new module. Returns the variables it ends
+    # with, by name.
+    code, names, calls = compiled
+    namespace = {python_name: None for python_name in names}
+    exec(code, namespace)
+    try:
+        run_deep(namespace[PROGRAM_FUNCTION], PYTHON_FRAMES_PER_CALL)
+    except (ArithmeticError, TypeError, ValueError, RecursionError) as exception:
+        return None, source_error(exception, fn, tree, calls)
+    return {mini_name(name): namespace[name] for name in names
+            if namespace[name] is not None}, None
+
+
+def run_python(tree, fn):
+    compiled, error = compile_python(tree, fn)
+    if error:
+        return None, error
+    return execute_python(compiled, fn, tree)
@@ -0,0 +1,1171 @@
+import argparse
+import backend
+import gc
+import resource
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import cfg
+import evaluator
+import mini
+import optimizer
+import parser
+import ssa
+import vm
+
+"""Bench
+        Description:
+            Benchmarks for the Mini compiler. Every benchmark works on a
+            generated program so the numbers do not depend on the sample
+            files, and checks that the engines it compares agree before
+            reporting any timing.
+
+        Usage:
+            python3 bench.py lexer
+            python3 bench.py lexer --lines 200000
+            python3 bench.py memory --tokens 1000000
+            python3 bench.py streaming --lines 20000
+            python3 bench.py expressions
+            python3 bench.py prediction
+            python3 bench.py deep --depth 100000
+            python3 bench.py emit --lines 100000
+            python3 bench.py optimize
+            python3 bench.py cfg --lines 40000
+            python3 bench.py ssa --lines 20000
+            python3 bench.py loops
+            python3 bench.py algebra
+            python3 bench.py logic
+            python3 bench.py switch
+            python3 bench.py temps --lines 10000
+            python3 bench.py vm
+            python3 bench.py closures
+            python3 bench.py python
+            python3 bench.py cache
+"""
+
+
+# ===============================================================================
+# PROGRAM GENERATOR
+# ===============================================================================
+PROGRAM_TEMPLATE = '''# generated block {n}
+VAR x{n} = {n} * 3 + 4.5 / 2
+VAR s{n} = "value \\\\t {n}"
+FUN add{n}(a, b) -> a + b ^ 2
+IF x{n} >= 10 AND x{n} != 3 THEN VAR y = x{n} - 1 ELSE VAR y = [1, 2, 3]
+FOR i = 0 TO {n} STEP 2 THEN VAR z = add{n}(i, x{n})
+WHILE y <= 100 THEN VAR y = y + 1; VAR w = -y
+'''
+
+
+EXPRESSION_OPERATORS = ['+', '-', '*', '/', '^', '==', '!=', '<', '>', '<=', '>=',
+                        'AND', 'OR']
+EXPRESSION_ATOMS = ['1', '2.5', 'x', 'y', '"s"', 'f()', 'g(x, 1)', '[1, x]',
+                    '(IF x THEN 1 ELSE 2)', '(FUN (a) -> a)']
+
+
+def generate_expression(rng, depth):
+    if depth <= 0 or rng.random() < 0.2:
+        return rng.choice(EXPRESSION_ATOMS)
+    choice = rng.random()
+    if choice < 0.6:
+        return (generate_expression(rng, depth - 1) + ' ' + rng.choice(EXPRESSION_OPERATORS)
+                + ' ' + generate_expression(rng, depth - 1))
+    if choice < 0.7:
+        return rng.choice(['-', '+']) + generate_expression(rng, depth - 1)
+    if choice < 0.75:
+        return '(NOT ' + generate_expression(rng, depth - 1) + ')'
+    if choice < 0.9:
+        return '(' + generate_expression(rng, depth - 1) + ')'
+    return '(VAR v = ' + generate_expression(rng, depth - 1) + ')'
+
+
+def generate_expression_corpus(count, seed=0):
+    # Valid expressions, and copies with a token dropped or repeated so the
+    # error paths are compared too
+    rng = random.Random(seed)
+    corpus = []
+    for _ in range(count):
+        words = generate_expression(rng, 6).split(' ')
+        if rng.random() < 0.3:
+            idx = rng.randrange(len(words))
+            if rng.random() < 0.5:
+                del words[idx]
+            else:
+                words.insert(idx, words[idx])
+        corpus.append(' '.join(words))
+    return corpus
+
+
+def lines_for_tokens(tokens):
+    block = PROGRAM_TEMPLATE.format(n=0)
+    block_tokens, _ = mini.RegexLexer('<bench>', block).make_tokens()
+    return tokens * block.count('\n') // (len(block_tokens) - 1)
+
+
+def generate_program(lines):
+    blocks = []
+    block_lines = PROGRAM_TEMPLATE.count('\n')
+    for n in range(max(1, lines // block_lines)):
+        blocks.append(PROGRAM_TEMPLATE.format(n=n))
+    return ''.join(blocks)
+
+
+def best_of(repeat, func):
+    # Like timeit, the garbage collector is paused while a run is timed
+    best = None
+    result = None
+    for _ in range(repeat):
+        result = None
+        gc.collect()
+        gc.disable()
+        try:
+            start = time.perf_counter_ns()
+            result = func()
+            elapsed = time.perf_counter_ns() - start
+        finally:
+            gc.enable()
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+# ===============================================================================
+# BENCHMARKS
+# ===============================================================================
+def token_key(tok):
+    return (tok.type, tok.value,
+            tok.pos_start.idx, tok.pos_start.ln, tok.pos_start.col,
+            tok.pos_end.idx, tok.pos_end.ln, tok.pos_end.col)
+
+
+def bench_lexer(args):
+    text = generate_program(args.lines)
+    print(f'Program: {args.lines} lines, {len(text)} characters')
+
+    times = {}
+    keys = {}
+    for name, lexer_class in mini.LEXERS.items():
+        elapsed, (tokens, error) = best_of(
+            args.repeat, lambda: lexer_class('<bench>', text).make_tokens())
+        if error:
+            print(error.as_string())
+            return
+        times[name] = elapsed
+        keys[name] = [token_key(tok) for tok in tokens]
+        tokens = None
+        print(f'{name:>8}: {elapsed / 1e6:10.2f} ms, {len(keys[name])} tokens')
+
+    if keys['classic'] != keys['regex']:
+        print('Token streams differ')
+        return
+    print(f'Token streams are identical, speedup: '
+          f'{times["classic"] / times["regex"]:.2f}x')
+
+
+def measure_token_memory(mode, lines):
+    # Runs in a fresh interpreter, see bench_memory
+    text = generate_program(lines)
+    lexer = mini.RegexLexer('<bench>', text)
+
+    tracemalloc.start()
+    if mode == 'stream':
+        tokens, error = lexer.make_token_stream()
+    else:
+        tokens, error = lexer.make_tokens()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(len(tokens), current, peak, max_rss)
+
+
+def bench_memory(args):
+    if args.child:
+        measure_token_memory(args.child, args.lines)
+        return
+
+    lines = lines_for_tokens(args.tokens)
+    print(f'Program: {lines} lines')
+    print(f'{"":>8}  {"tokens":>9}  {"retained MB":>11}  {"peak MB":>9}  {"max RSS MB":>10}')
+    for mode in ('list', 'stream'):
+        output = subprocess.run(
+            [sys.executable, __file__, 'memory',
+                '--child', mode, '--lines', str(lines)],
+            capture_output=True, text=True, check=True).stdout
+        count, current, peak, max_rss = map(int, output.split())
+        print(f'{mode:>8}  {count:>9}  {current / 2**20:>11.1f}  '
+              f'{peak / 2**20:>9.1f}  {max_rss / 2**10:>10.1f}')
+
+
+def measure_compile_memory(mode, file_name):
+    # Runs in a fresh interpreter, see bench_streaming
+    tracemalloc.start()
+    if mode == 'stream':
+        for code, error in mini.stream_intermediate_code(file_name):
+            pass
+    else:
+        mini.CompileSession(file_name).generate_intermediate_code()
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(peak)
+
+
+def bench_streaming(args):
+    if args.child:
+        measure_compile_memory(args.child, args.file)
+        return
+
+    print(f'{"lines":>8}  {"batch peak KB":>13}  {"stream peak KB":>14}')
+    for lines in (args.lines // 4, args.lines):
+        with tempfile.NamedTemporaryFile('w', suffix='.mini', delete=False) as file:
+            file.write(generate_program(lines))
+        try:
+            peaks = []
+            for mode in ('list', 'stream'):
+                output = subprocess.run(
+                    [sys.executable, __file__, 'streaming',
+                        '--child', mode, '--file', file.name],
+                    capture_output=True, text=True, check=True).stdout
+                peaks.append(int(output) / 2**10)
+        finally:
+            os.remove(file.name)
+        print(f'{lines:>8}  {peaks[0]:>13.0f}  {peaks[1]:>14.0f}')
+
+
+def parse_with(expr_engine, tokens):
+    parser = mini.Parser(tokens, expr_engine)
+    res = parser.parse()
+    return (repr(res.node), res.error and res.error.as_string(),
+            res.advance_count, parser.tok_idx)
+
+
+def bench_expressions(args):
+    corpus = generate_expression_corpus(args.corpus)
+    errors = 0
+    for text in corpus:
+        tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+        if error:
+            continue
+        classic = parse_with('classic', tokens)
+        if classic != parse_with('pratt', tokens):
+            print('Parsers differ on:', text)
+            return
+        errors += classic[1] is not None
+    print(f'Differential check: {len(corpus)} expressions parse identically '
+          f'({errors} with syntax errors)')
+
+    rng = random.Random(1)
+    text = '\n'.join(generate_expression(rng, 8) for _ in range(args.lines))
+    tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+    if not error:
+        error = mini.Parser(tokens).parse().error
+    if error:
+        print(error.as_string())
+        return
+    print(f'Program: {args.lines} expression lines, {len(tokens)} tokens')
+
+    times = {}
+    for expr_engine in mini.EXPR_ENGINES:
+        times[expr_engine], _ = best_of(
+            args.repeat, lambda: mini.Parser(tokens, expr_engine).parse())
+        print(f'{expr_engine:>8}: {times[expr_engine] / 1e6:10.2f} ms')
+    print(f'Speedup: {times["classic"] / times["pratt"]:.2f}x')
+
+
+class CountedSyntaxError(mini.InvalidSyntaxError):
+    count = 0
+
+    def __init__(self, *args):
+        CountedSyntaxError.count += 1
+        super().__init__(*args)
+
+
+def parse_counted(tokens, predict):
+    # Counts the syntax errors built while parsing, by swapping the class the
+    # parser module refers to
+    CountedSyntaxError.count = 0
+    parser.InvalidSyntaxError = CountedSyntaxError
+    try:
+        p = mini.Parser(tokens, 'pratt', predict)
+        res = p.parse()
+    finally:
+        parser.InvalidSyntaxError = mini.InvalidSyntaxError
+    return res, p.reverse_count, CountedSyntaxError.count
+
+
+def bench_prediction(args):
+    programs = [(file_name, open(file_name).read())
+                for file_name in ('ex.mini', 'tac.mini')]
+    programs.append(('generated', generate_program(args.lines)))
+
+    print(f'{"":>10}  {"reversals":>19}  {"errors built":>19}  {"parse ms":>17}')
+    print(f'{"":>10}  {"before":>9} {"after":>9}  {"before":>9} {"after":>9}  '
+          f'{"before":>8} {"after":>8}')
+    for name, text in programs:
+        tokens, error = mini.RegexLexer(name, text).make_tokens()
+        results = []
+        for predict in (False, True):
+            res, reversals, errors = parse_counted(tokens, predict)
+            if res.error:
+                print(res.error.as_string())
+                return
+            elapsed, _ = best_of(
+                args.repeat, lambda: mini.Parser(tokens, 'pratt', predict).parse())
+            results.append((repr(res.node), reversals, errors, elapsed / 1e6))
+        if results[0][0] != results[1][0]:
+            print('Trees differ on', name)
+            return
+        before, after = results
+        print(f'{name:>10}  {before[1]:>9} {after[1]:>9}  {before[2]:>9} {after[2]:>9}  '
+              f'{before[3]:>8.2f} {after[3]:>8.2f}')
+
+
+DEEP_PROGRAMS = {
+    'left': lambda depth: '1' + ' + 1' * depth,
+    'right': lambda depth: '2' + ' ^ 2' * depth,
+    'parens': lambda depth: '(' * depth + '1' + ')' * depth,
+    'unary': lambda depth: '-' * depth + '1',
+    'lists': lambda depth: '[' * depth + '1' + ']' * depth,
+    'calls': lambda depth: 'f(' * depth + '1' + ')' * depth,
+    'blocks': lambda depth: ''.join(DEEP_BLOCKS[n % 4] for n in range(depth))
+    + 'VAR x = 1\n' + 'END\n' * depth,
+    'elifs': lambda depth: 'IF x == 0 THEN 0 ' + ''.join(
+        f'ELIF x == {n} THEN {n} ' for n in range(1, depth)) + 'ELSE 1',
+}
+
+DEEP_BLOCKS = ['IF 1 THEN\n', 'WHILE 0 THEN\n', 'FOR i = 1 TO 2 THEN\n', 'FUN f()\n']
+
+
+def compile_deep(text):
+    tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+    if error:
+        return None, error
+    res = mini.Parser(tokens, 'stack').parse()
+    if res.error:
+        return None, res.error
+    return mini.IntermediateCodeGenerator(res.node).generate_intermediate_code(), None
+
+
+def bench_deep(args):
+    # Each shape is compiled at half and at full depth: the times should
+    # double, and no depth should need a higher recursion limit
+    print(f'Recursion limit: {sys.getrecursionlimit()}')
+    print(f'{"":>8}  {"depth":>8}  {"ms":>9}  {"depth":>8}  {"ms":>9}  {"ratio":>6}')
+    for name, generate in DEEP_PROGRAMS.items():
+        times = []
+        for depth in (args.depth // 2, args.depth):
+            text = generate(depth)
+            elapsed, (code, error) = best_of(
+                args.repeat, lambda: compile_deep(text))
+            if error:
+                print(error.as_string())
+                return
+            times.append(elapsed / 1e6)
+        print(f'{name:>8}  {args.depth // 2:>8}  {times[0]:>9.2f}  '
+              f'{args.depth:>8}  {times[1]:>9.2f}  {times[1] / times[0]:>6.2f}')
+
+
+def nested_blocks(depth):
+    # Built directly, so that only the code generation is timed
+    tok = mini.Token(mini.TT_INT, 1)
+    node = mini.VarAssignNode(mini.Token(mini.TT_IDENTIFIER, 'x'), mini.NumberNode(tok))
+    for n in range(depth):
+        if n % 2:
+            node = mini.WhileNode(mini.NumberNode(tok), node, False)
+        else:
+            node = mini.IfNode([(mini.NumberNode(tok), node, False)], None)
+    return mini.ListNode([node], None, None)
+
+
+def emit_to_buffer(ast):
+    return mini.IntermediateCodeGenerator(ast).generate_intermediate_code()
+
+
+def emit_to_file(ast, file_name):
+    with open(file_name, 'w') as out:
+        mini.IntermediateCodeGenerator(ast).emit_intermediate_code(out)
+
+
+def bench_emit(args):
+    # The time per line, or per level of nesting, should stay flat as the
+    # input grows
+    with tempfile.NamedTemporaryFile('w', suffix='.tac', delete=False) as file:
+        pass
+    try:
+        print(f'{"":>7}  {"size":>8}  {"buffer ms":>10}  {"file ms":>9}  '
+              f'{"ns/unit":>8}  {"output KB":>9}')
+        for shape in ('lines', 'depth'):
+            for size in (args.lines // 4, args.lines // 2, args.lines):
+                if shape == 'lines':
+                    text = generate_program(size)
+                    tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+                    ast = mini.Parser(tokens).parse().node
+                else:
+                    ast = nested_blocks(size)
+                buffer_time, code = best_of(args.repeat, lambda: emit_to_buffer(ast))
+                file_time, _ = best_of(args.repeat, lambda: emit_to_file(ast, file.name))
+                if open(file.name).read() != code:
+                    print('Buffer and file output differ')
+                    return
+                print(f'{shape:>7}  {size:>8}  {buffer_time / 1e6:>10.2f}  '
+                      f'{file_time / 1e6:>9.2f}  {buffer_time / size:>8.0f}  '
+                      f'{len(code) / 2**10:>9.0f}')
+    finally:
+        os.remove(file.name)
+
+
+def bench_cfg(args):
+    # Building the graphs is linear, so the time per instruction should stay
+    # flat as the program grows
+    print(f'{"":>7}  {"size":>8}  {"instrs":>8}  {"blocks":>8}  {"graphs":>6}  '
+          f'{"ms":>8}  {"ns/instr":>8}')
+    for shape in ('lines', 'depth'):
+        for size in (args.lines // 4, args.lines // 2, args.lines):
+            if shape == 'lines':
+                text = generate_program(size)
+                tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+                ast = mini.Parser(tokens).parse().node
+            else:
+                ast = nested_blocks(size)
+            icg = mini.IntermediateCodeGenerator(ast)
+            icg.generate_ir()
+            program = icg.program
+            elapsed, graphs = best_of(args.repeat, lambda: cfg.build_graphs(program))
+            blocks = sum(len(graph) for graph in graphs)
+            print(f'{shape:>7}  {size:>8}  {len(program):>8}  {blocks:>8}  '
+                  f'{len(graphs):>6}  {elapsed / 1e6:>8.2f}  '
+                  f'{elapsed / len(program):>8.0f}')
+
+
+def bench_ssa(args):
+    # Building, checking and leaving the SSA form of ever larger programs.
+    # The time per block should stay about flat. Programs whose functions
+    # reuse their temporaries are checked first, as each function numbers
+    # them from t0 again.
+    texts = [generate_program(60)] + [template.format(n=n)
+                                       for name, n, expected, template in VM_PROGRAMS]
+    for text in texts:
+        for level in (0, optimizer.MAX_OPTIMIZATION_LEVEL):
+            program, error = mini.CompileSession('<bench>', text, opt_level=level).generate_ir()
+            if error:
+                print(error.as_string())
+                return
+            for max_temps in (None, 2):
+                reused = optimizer.allocate_temps(program, max_temps)
+                form = ssa.to_ssa(reused)
+                problems = ssa.verify_ssa(form)
+                if problems or cfg.load(ssa.from_ssa(form)) != cfg.load(reused):
+                    print('The SSA form of reused temporaries is not valid:',
+                          *problems[:5], text, sep='\n')
+                    return
+    print(f'{len(texts)} programs with reused temporaries are valid in SSA form')
+
+    print(f'{"":>7}  {"size":>8}  {"blocks":>8}  {"phis":>8}  {"to ssa ms":>9}  '
+          f'{"verify ms":>9}  {"from ssa ms":>11}  {"ns/block":>8}')
+    for shape in ('lines', 'depth'):
+        for size in (args.lines // 4, args.lines // 2, args.lines):
+            if shape == 'lines':
+                text = generate_program(size)
+                tokens, error = mini.RegexLexer('<bench>', text).make_tokens()
+                ast = mini.Parser(tokens).parse().node
+            else:
+                ast = nested_blocks(size)
+            icg = mini.IntermediateCodeGenerator(ast)
+            icg.generate_ir()
+            program = icg.program
+
+            build_time, form = best_of(args.repeat, lambda: ssa.to_ssa(program))
+            verify_time, problems = best_of(args.repeat, lambda: ssa.verify_ssa(form))
+            leave_time, result = best_of(args.repeat, lambda: ssa.from_ssa(form))
+            if problems or cfg.load(result) != cfg.load(program):
+                print('The SSA form is not valid:', *problems[:5], sep='\n')
+                return
+
+            blocks = sum(len(function.graph) for function in form.functions)
+            phis = sum(len(phis) for function in form.functions
+                       for phis in function.phis)
+            print(f'{shape:>7}  {size:>8}  {blocks:>8}  {phis:>8}  '
+                  f'{build_time / 1e6:>9.2f}  {verify_time / 1e6:>9.2f}  '
+                  f'{leave_time / 1e6:>11.2f}  {build_time / blocks:>8.0f}')
+
+
+LOOP_PROGRAM = '''VAR n = 40
+VAR x = 7
+VAR total = 0
+VAR i = 0
+WHILE i < n * n THEN
+  VAR total = total + (x / 2) * 3
+  VAR i = i + 1
+END
+VAR j = 0
+FOR j = 0 TO n * 5 THEN
+  VAR k = 0
+  WHILE (k + x) / 2 < n / 2 + x THEN
+    VAR product = x * x + k
+    VAR k = k + 1
+  END
+END
+'''
+
+
+def count_executed(program):
+    # Runs a program on the register machine, and counts the instructions it
+    # executes
+    stats = {}
+    variables, error = vm.run_program(program, stats)
+    if error:
+        print(error.as_string())
+    return variables, stats['executed']
+
+
+def bench_loops(args):
+    # Invariant code moved out of the loops runs once instead of every
+    # iteration. Each column adds a pass to the previous one.
+    program, error = mini.CompileSession('<bench>', LOOP_PROGRAM).generate_ir()
+    if error:
+        print(error.as_string())
+        return
+    passes = [('generated', []),
+              ('fold + cse', [optimizer.fold_constants, optimizer.number_values]),
+              ('+ licm', [optimizer.fold_constants, optimizer.number_values,
+                          optimizer.hoist_invariants])]
+    print(f'{"":>12}  {"static":>8}  {"executed":>10}  {"run ms":>8}')
+    expected = None
+    for name, optimizations in passes:
+        code = program
+        for optimization in optimizations:
+            code = optimization(code)
+        elapsed, (variables, executed) = best_of(args.repeat, lambda: count_executed(code))
+        if expected is None:
+            expected = variables
+        elif variables != expected:
+            print(name, 'changes the values of the variables')
+            return
+        print(f'{name:>12}  {len(code):>8}  {executed:>10}  {elapsed / 1e6:>8.2f}')
+
+
+ALGEBRA_ATOMS = ['i', 'x', 'y', '0', '1', '2', '3']
+
+
+def generate_algebra_term(rng, depth):
+    # Integer terms full of identities, small powers and products of the
+    # loop counter
+    if depth <= 0 or rng.random() < 0.25:
+        choice = rng.random()
+        if choice < 0.3:
+            return f'{rng.choice(["i", "x", "y"])} ^ {rng.randint(0, 5)}'
+        if choice < 0.5:
+            return rng.choice([f'i * {rng.randint(1, 9)}', f'{rng.randint(1, 9)} * i'])
+        return rng.choice(ALGEBRA_ATOMS)
+    operator = rng.choice(['+', '-', '*', '+', '-'])
+    left = generate_algebra_term(rng, depth - 1)
+    right = left if rng.random() < 0.2 else generate_algebra_term(rng, depth - 1)
+    return f'({left} {operator} {right})'
+
+
+def generate_algebra_program(rng, loops):
+    lines = [f'VAR x = {rng.randint(-3, 3)}', f'VAR y = {rng.randint(-3, 3)}',
+             'VAR i = 0']
+    for n in range(loops):
+        lines.append(f'VAR s{n} = 0')
+        lines.append(f'FOR i = {rng.randint(-2, 2)} TO {rng.randint(3, 12)} THEN')
+        lines.append(f'  VAR s{n} = s{n} + {generate_algebra_term(rng, 3)}')
+        lines.append('END')
+    return '\n'.join(lines) + '\n'
+
+
+def bench_algebra(args):
+    # Differential check of simplify_algebra and reduce_induction_variables:
+    # every generated program runs before and after them and must end with
+    # the same variables
+    rng = random.Random(0)
+    before = [optimizer.fold_constants, optimizer.number_values,
+              optimizer.eliminate_dead_code]
+    after = [optimizer.fold_constants, optimizer.number_values,
+             optimizer.simplify_algebra, optimizer.number_values,
+             optimizer.reduce_induction_variables, optimizer.eliminate_dead_code]
+    simplified = {}
+    reduced = {}
+    totals = [0, 0, 0, 0]
+    for _ in range(args.corpus // 25):
+        text = generate_algebra_program(rng, 4)
+        program, error = mini.CompileSession('<bench>', text).generate_ir()
+        if error:
+            print(error.as_string())
+            return
+        codes = []
+        for passes in (before, after):
+            code = program
+            for optimization in passes:
+                if optimization == optimizer.simplify_algebra:
+                    code = optimization(code, simplified)
+                elif optimization == optimizer.reduce_induction_variables:
+                    code = optimization(code, reduced)
+                else:
+                    code = optimization(code)
+            codes.append(code)
+        (expected, executed), (variables, reduced_executed) = map(count_executed, codes)
+        if variables != expected:
+            print('The passes change the values of the variables of:', text, sep='\n')
+            return
+        totals = [totals[0] + len(codes[0]), totals[1] + len(codes[1]),
+                  totals[2] + executed, totals[3] + reduced_executed]
+
+    print(f'{args.corpus // 25} programs agree')
+    print(f'{"":>12}  {"static":>8}  {"executed":>10}')
+    print(f'{"cse + dce":>12}  {totals[0]:>8}  {totals[2]:>10}')
+    print(f'{"+ algebra":>12}  {totals[1]:>8}  {totals[3]:>10}')
+    for name, count in sorted(simplified.items()):
+        print(f'{name:>12}  {count:>8} simplified')
+    print(f'{"MUL":>12}  {sum(reduced.values()):>8} reduced in loops')
+
+
+LOGIC_PROGRAM = '''VAR calls = 0
+FUN expensive(n)
+  VAR calls = calls + 1
+  VAR k = 0
+  WHILE k < 50 THEN
+    VAR k = k + 1
+  END
+  RETURN n > 2
+END
+VAR hits = 0
+VAR i = 0
+FOR i = 0 TO 1000 THEN
+  IF i > 990 AND expensive(i) OR NOT (i < 1000) THEN VAR hits = hits + 1
+END
+'''
+
+
+def generate_condition(rng, depth):
+    if depth <= 0 or rng.random() < 0.25:
+        return rng.choice(['a', 'b', 'c', '0', '1',
+                           f'(a < {rng.randint(0, 2)})', f'(b == {rng.randint(0, 2)})'])
+    if rng.random() < 0.2:
+        return '(NOT ' + generate_condition(rng, depth - 1) + ')'
+    return (f'({generate_condition(rng, depth - 1)} {rng.choice(["AND", "OR"])} '
+            f'{generate_condition(rng, depth - 1)})')
+
+
+def bench_logic(args):
+    # AND, OR and NOT are lowered to jumps. The values and the branches of
+    # generated conditions are checked against Python, then a loop whose
+    # condition guards an expensive call is run.
+    rng = random.Random(0)
+    checked = 0
+    for _ in range(args.corpus // 50):
+        condition = generate_condition(rng, 4)
+        expression = (condition.replace('AND', 'and').replace('OR', 'or')
+                      .replace('NOT', 'not'))
+        for a, b, c in ((0, 0, 0), (1, 0, 2), (0, 2, 1), (2, 1, 0), (1, 1, 1)):
+            text = (f'VAR a = {a}\nVAR b = {b}\nVAR c = {c}\n'
+                    f'VAR value = NOT NOT {condition}\nVAR taken = 0\n'
+                    f'IF {condition} THEN VAR taken = 1\n')
+            program, error = mini.CompileSession('<bench>', text).generate_ir()
+            if error:
+                print(error.as_string())
+                return
+            values, _ = count_executed(program)
+            expected = int(bool(eval(expression)))
+            if values['value'] != expected or values['taken'] != expected:
+                print('Wrong result of', condition, 'for', (a, b, c))
+                return
+            checked += 1
+    print(f'{checked} conditions agree with Python')
+
+    program, error = mini.CompileSession('<bench>', LOGIC_PROGRAM).generate_ir()
+    if error:
+        print(error.as_string())
+        return
+    elapsed, (values, executed) = best_of(args.repeat, lambda: count_executed(program))
+    print(f'guarded calls: {values["calls"]} of 1001 iterations, '
+          f'{executed} instructions executed in {elapsed / 1e6:.2f} ms')
+
+
+def generate_ladder(values, calls):
+    # A function whose IF/ELIF ladder compares its argument to the values,
+    # called with every number up to calls
+    lines = ['VAR total = 0', 'FUN dispatch(op)']
+    for idx, value in enumerate(values):
+        keyword = 'ELIF' if idx else 'IF'
+        lines.append(f'  {keyword} op == {value} THEN')
+        lines.append(f'    VAR total = total + {idx + 1}')
+    lines += ['  ELSE', '    VAR total = total - 1', '  END', 'END',
+              'VAR i = 0', f'FOR i = 0 TO {calls - 1} THEN', '  dispatch(i)', 'END']
+    return '\n'.join(lines) + '\n'
+
+
+def bench_switch(args):
+    # Ladders compiled to compare-and-branch sequences, then to a SWITCH.
+    # A dense table is indexed, a sparse one binary searched.
+    rng = random.Random(0)
+    ladders = [('dense', list(range(128)), 256),
+               ('sparse', sorted(rng.sample(range(4096), 128)), 4096),
+               ('strided', list(range(0, 400, 2)), 400)]
+    print(f'{"":>8}  {"arms":>5}  {"lowering":>8}  {"static":>8}  '
+          f'{"executed":>10}  {"run ms":>8}')
+    for name, values, calls in ladders:
+        session = mini.CompileSession('<bench>', generate_ladder(values, calls))
+        ast, error = session.parse()
+        if error:
+            print(error.as_string())
+            return
+        expected = None
+        for lowering, jump_tables in (('ladder', False), ('switch', True)):
+            program = mini.IntermediateCodeGenerator(ast, jump_tables).generate_ir()
+            elapsed, (variables, executed) = best_of(
+                args.repeat, lambda: count_executed(program))
+            if expected is None:
+                expected = variables
+            elif variables != expected:
+                print(name, 'SWITCH changes the values of the variables')
+                return
+            print(f'{name:>8}  {len(values):>5}  {lowering:>8}  {len(program):>8}  '
+                  f'{executed:>10}  {elapsed / 1e6:>8.2f}')
+
+
+def bench_temps(args):
+    # Temporaries before and after allocate_temps, without a limit and with
+    # a few small pools. The programs that can run here are checked to end
+    # with the same variables.
+    checked = [('loops', LOOP_PROGRAM), ('logic', LOGIC_PROGRAM),
+               ('ladder', generate_ladder(list(range(128)), 256))]
+    for name, text in checked:
+        for level in range(optimizer.MAX_OPTIMIZATION_LEVEL + 1):
+            program, error = mini.CompileSession('<bench>', text, opt_level=level).generate_ir()
+            if error:
+                print(error.as_string())
+                return
+            expected, _ = count_executed(program)
+            for max_temps in (None, 1, 2, 4):
+                variables, _ = count_executed(optimizer.allocate_temps(program, max_temps))
+                if variables != expected:
+                    print(name, 'changes its variables with', max_temps, 'temporaries')
+                    return
+    print(f'{len(checked)} programs agree at every level')
+
+    text = generate_program(args.lines)
+    print(f'{"level":>5}  {"max":>4}  {"before":>8}  {"peak":>5}  {"after":>5}  '
+          f'{"stack":>5}  {"ms":>8}')
+    for level in (0, optimizer.MAX_OPTIMIZATION_LEVEL):
+        program, error = mini.CompileSession('<bench>', text, opt_level=level).generate_ir()
+        for max_temps in (None, 8, 4, 2):
+            allocation = {}
+            elapsed, _ = best_of(args.repeat, lambda: optimizer.allocate_temps(
+                program, max_temps, allocation))
+            print(f'{level:>5}  {max_temps or "-":>4}  {allocation["temps"]:>8}  '
+                  f'{allocation["peak"]:>5}  {allocation["slots"]:>5}  '
+                  f'{allocation["stack slots"]:>5}  {elapsed / 1e6:>8.2f}')
+
+
+def fib(n):
+    return n if n < 2 else fib(n - 1) + fib(n - 2)
+
+
+# Each program leaves its answer in result, checked against Python
+VM_PROGRAMS = [
+    ('fib', 20, fib, '''FUN fib(n)
+  IF n < 2 THEN RETURN n
+  RETURN fib(n - 1) + fib(n - 2)
+END
+VAR result = fib({n})
+'''),
+    ('nested', 300, lambda n: (n * (n + 1) // 2) ** 2 - n * n * (n + 1) // 2, '''VAR result = 0
+VAR i = 0
+VAR j = 0
+FOR i = 1 TO {n} THEN
+  FOR j = 1 TO {n} THEN
+    VAR result = result + i * j - j
+  END
+END
+'''),
+    ('concat', 5000, lambda n: 'ab' * n, '''VAR result = ""
+VAR i = 0
+WHILE i < {n} THEN
+  VAR result = result + "ab"
+  VAR i = i + 1
+END
+'''),
+    # The calls follow a long top level, whose temporaries a CALL must not
+    # save; p comes from a call so that the optimizer cannot fold it
+    ('calls', 20000, lambda n: n, 'FUN zero() -> 0\nVAR p = zero()\n'
+     + 'VAR p = p * 2 - p + 1\n' * 10000 + '''FUN f(a) -> a + 1
+VAR result = p - 10000
+FOR i = 1 TO {n} THEN VAR result = f(result)
+'''),
+]
+
+
+def bench_vm(args):
+    # The register machine on programs dominated by calls, loops and string
+    # building, before and after the optimizer
+    print(f'{"":>8}  {"level":>5}  {"static":>7}  {"executed":>10}  '
+          f'{"load ms":>8}  {"run ms":>8}  {"Minstr/s":>9}')
+    for name, n, expected, template in VM_PROGRAMS:
+        for level in (0, optimizer.MAX_OPTIMIZATION_LEVEL):
+            program, error = mini.CompileSession(
+                '<bench>', template.format(n=n), opt_level=level).generate_ir()
+            if error:
+                print(error.as_string())
+                return
+            load_time, executable = best_of(args.repeat, lambda: vm.load_program(program))
+            stats = {}
+            elapsed, (registers, error) = best_of(
+                args.repeat, lambda: vm.execute(executable, stats))
+            if error:
+                print(error.as_string())
+                return
+            if executable.variables(registers)['result'] != expected(n):
+                print(name, 'gives a wrong result at level', level)
+                return
+            executed = stats['executed']
+            print(f'{name:>8}  {level:>5}  {len(executable):>7}  {executed:>10}  '
+                  f'{load_time / 1e6:>8.2f}  {elapsed / 1e6:>8.2f}  '
+                  f'{executed / elapsed * 1e3:>9.2f}')
+
+
+def plain_values(variables):
+    # The numbers and strings of the variables, which every engine gives the
+    # same way
+    return {name: value for name, value in variables.items()
+            if isinstance(value, (int, float, str))}
+
+
+# IF, FUN and the loops used as values, and RETURN without one, which every
+# engine must give the same way
+VALUE_PROGRAMS = [
+    'FUN f()\n  RETURN\nEND\nVAR r = f()\nVAR g = FUN (a) -> a * 2\nVAR y = g(3)\n'
+    'VAR c = 2\nVAR x = IF c THEN 10 ELSE 20\nVAR z = IF c == 0 THEN 10\n'
+    'VAR w = WHILE c < 3 THEN VAR c = c + 1\nVAR n = (FUN () -> 7)()\n'
+    'VAR h = FUN k(a) -> a + 1\nVAR v = h(4) + k(5)\n',
+    'VAR s = 0\nFOR i = 0 TO 6 THEN\n  VAR k = IF i == 1 THEN 5 ELIF i == 2 THEN 7 '
+    'ELIF i == 3 THEN 9 ELIF i == 4 THEN 11\n  VAR s = s + (IF k THEN k ELSE 1)\nEND\n',
+    'FUN early(n)\n  IF n > 2 THEN RETURN\n  RETURN n * 10\nEND\n'
+    'VAR a = early(1)\nVAR b = early(5)\nFUN t(n) -> IF n THEN 1 ELSE 2\n'
+    'VAR d = t(0) + t(5) + (IF a THEN 2 ELSE 3)\n'
+    'VAR g = IF a == 10 THEN FUN (z) -> z - 1 ELSE FUN (z) -> z + 1\nVAR e = g(10)\n'
+    'VAR m = IF a == 10 THEN\n  VAR q = 1\n  q + 41\nEND\n'
+    'VAR o = IF a == 10 THEN BREAK ELSE 1\nFUN lv(n) -> FOR j = 0 TO n THEN j\nVAR l = lv(3)\n',
+]
+
+
+# Calls of values that are not functions, which every engine reports with
+# the same error
+CALL_ERROR_PROGRAMS = [
+    'VAR a = 1\nVAR b = a(2)\n',
+    'VAR b = x()\n',
+    'VAR b = "s"()\n',
+    'FUN g(h) -> h(2)\nVAR b = g(FUN (z) -> z * 5)\nVAR d = g(4)\n',
+    'VAR c = 1\nVAR b = (IF c THEN 2 ELSE 3)(1)\n',
+]
+
+# Programs with an operation that fails, at the node of the operation
+OPERATION_ERROR_PROGRAMS = [
+    'VAR a = 1\nVAR b = 2 + (a / 0)\n',
+    'VAR a = "s"\nVAR b = 1 + -a\n',
+    'VAR a = "s"\nVAR b = 1 + (a < 2)\n',
+    'VAR a = "s"\nFOR i = 1 TO a THEN VAR b = i\n',
+    'FOR i = 1 TO 3 THEN VAR b = 1 + i / 0\n',
+    'FUN f(x) -> x * "a" ^ 2\nVAR b = f(2)\n',
+    'VAR a = 0\nWHILE 1 / a THEN VAR b = 1\n',
+]
+
+
+def error_position(error):
+    # What a failing program reports, and where
+    return error.details, error.pos_start.idx, error.pos_end.idx
+
+
+def bench_closures(args):
+    # The tree compiled to closures against a tree walker and the register
+    # machine. Generated programs and programs that use IF, FUN and the
+    # loops as values are checked to end with the same variables on all
+    # three, and failing programs to fail with the same error at the same
+    # node on the tree walker and the closures, then loop-heavy programs are
+    # timed.
+    rng = random.Random(0)
+    texts = [generate_algebra_program(rng, 3) for _ in range(args.corpus // 50)]
+    texts += [LOGIC_PROGRAM, generate_ladder(list(range(0, 40, 3)), 50)] + VALUE_PROGRAMS
+    for text in texts:
+        session = mini.CompileSession('<bench>', text)
+        ast, error = session.parse()
+        if error:
+            print(error.as_string())
+            return
+        expected, _ = count_executed(session.generate_ir()[0])
+        for name, run in (('tree walker', evaluator.walk_program),
+                          ('closures', evaluator.run_closures)):
+            variables, error = run(ast)
+            if error or plain_values(variables) != plain_values(expected):
+                print(f'The {name} and the register machine disagree on:', text, sep='\n')
+                return
+    print(f'{len(texts)} programs agree')
+    for text in OPERATION_ERROR_PROGRAMS + CALL_ERROR_PROGRAMS:
+        ast, error = mini.CompileSession('<bench>', text).parse()
+        errors = {error_position(run(ast)[1])
+                  for run in (evaluator.walk_program, evaluator.run_closures)}
+        if len(errors) > 1:
+            print('The tree walker and the closures report other errors for:', text,
+                  *errors, sep='\n')
+            return
+    print(f'{len(OPERATION_ERROR_PROGRAMS) + len(CALL_ERROR_PROGRAMS)} failing programs '
+          'fail at the same node')
+
+    programs = [('loops', LOOP_PROGRAM)]
+    programs += [(name, template.format(n=n)) for name, n, expected, template in VM_PROGRAMS]
+    print(f'{"":>8}  {"walk ms":>9}  {"compile ms":>10}  {"closures ms":>11}  '
+          f'{"vm ms":>9}  {"speedup":>7}')
+    for name, text in programs:
+        session = mini.CompileSession('<bench>', text)
+        ast, error = session.parse()
+        executable = vm.load_program(session.generate_ir()[0])
+        walk_time, (expected, error) = best_of(
+            args.repeat, lambda: evaluator.walk_program(ast))
+        compile_time, (run, error) = best_of(
+            args.repeat, lambda: evaluator.compile_closures(ast))
+        closures_time, (variables, error) = best_of(args.repeat, run)
+        vm_time, _ = best_of(args.repeat, lambda: vm.execute(executable))
+        if plain_values(variables) != plain_values(expected):
+            print(name, 'ends with other variables on the closures')
+            return
+        print(f'{name:>8}  {walk_time / 1e6:>9.2f}  {compile_time / 1e6:>10.2f}  '
+              f'{closures_time / 1e6:>11.2f}  {vm_time / 1e6:>9.2f}  '
+              f'{walk_time / closures_time:>6.1f}x')
+
+
+def bench_python(args):
+    # Programs compiled to Python against the engines that interpret them.
+    # Generated programs and the ones that use statements as values are
+    # checked to end with the same variables as on the register machine,
+    # then numeric loops are timed.
+    rng = random.Random(1)
+    texts = [generate_algebra_program(rng, 3) for _ in range(args.corpus // 50)]
+    texts += [LOGIC_PROGRAM, generate_ladder(list(range(0, 40, 3)), 50)] + VALUE_PROGRAMS
+    for text in texts:
+        session = mini.CompileSession('<bench>', text)
+        ast, error = session.parse()
+        if error:
+            print(error.as_string())
+            return
+        expected, _ = count_executed(session.generate_ir()[0])
+        variables, error = backend.run_python(ast, '<bench>')
+        if error or plain_values(variables) != plain_values(expected):
+            print('Python and the register machine disagree on:', text, sep='\n')
+            return
+    print(f'{len(texts)} programs agree')
+    for text in CALL_ERROR_PROGRAMS:
+        errors = {mini.run_program('<bench>', text, engine=engine)[1].details
+                  for engine in mini.ENGINES}
+        if len(errors) > 1:
+            print('The engines report other errors for:', text, *errors, sep='\n')
+            return
+    print(f'{len(CALL_ERROR_PROGRAMS)} calls of values that are not functions fail the same way')
+
+    programs = [('loops', LOOP_PROGRAM)]
+    programs += [(name, template.format(n=n)) for name, n, expected, template in VM_PROGRAMS]
+    print(f'{"":>8}  {"walk ms":>9}  {"vm ms":>9}  {"closures ms":>11}  '
+          f'{"compile ms":>10}  {"python ms":>9}  {"vs walk":>7}  {"vs closures":>11}')
+    for name, text in programs:
+        session = mini.CompileSession('<bench>', text)
+        ast, error = session.parse()
+        executable = vm.load_program(session.generate_ir()[0])
+        run, error = evaluator.compile_closures(ast)
+        walk_time, _ = best_of(args.repeat, lambda: evaluator.walk_program(ast))
+        vm_time, _ = best_of(args.repeat, lambda: vm.execute(executable))
+        closures_time, (expected, error) = best_of(args.repeat, run)
+        compile_time, (compiled, error) = best_of(
+            args.repeat, lambda: backend.compile_python(ast, '<bench>'))
+        python_time, (variables, error) = best_of(
+            args.repeat, lambda: backend.execute_python(compiled, '<bench>', ast))
+        if error or plain_values(variables) != plain_values(expected):
+            print(name, 'ends with other variables in Python')
+            return
+        print(f'{name:>8}  {walk_time / 1e6:>9.2f}  {vm_time / 1e6:>9.2f}  '
+              f'{closures_time / 1e6:>11.2f}  {compile_time / 1e6:>10.2f}  '
+              f'{python_time / 1e6:>9.2f}  {walk_time / python_time:>6.1f}x  '
+              f'{closures_time / python_time:>10.1f}x')
+
+
+# Applied one after the other, each column counts the instructions left
+OPTIMIZATION_PASSES = [
+    ('fold', optimizer.fold_constants),
+    ('cse', optimizer.number_values),
+    ('algebra', optimizer.simplify_algebra),
+    ('licm', optimizer.hoist_invariants),
+    ('induction', optimizer.reduce_induction_variables),
+    ('dead code', optimizer.eliminate_dead_code),
+]
+
+
+# Programs the optimizer once got wrong. Each must end with the same
+# variables, or fail with the same error, at every level.
+OPTIMIZER_CASES = [
+    # A function defined over a constant in its variable
+    'VAR f = 1\nFUN f(a) -> a + 1\nVAR g = f(5)\nVAR h = f\n',
+    # Identities of numbers on values that are not ints, in a loop where
+    # their values are not folded
+    'VAR x = "s"\nVAR n = 0\nWHILE n < 1 THEN\n  VAR n = n + 1\n  VAR b = x * 2\n'
+    '  VAR c = x * 1\n  VAR a = x + 0\nEND\n',
+    'VAR f = 10.0 ^ 308 * 10\nVAR g = 1.1\nVAR n = 0\nWHILE n < 1 THEN\n'
+    '  VAR n = n + 1\n  VAR c = f - f\n  VAR h = g ^ 3\n  VAR k = g ^ 4\nEND\n',
+    'VAR s = 0\nFOR i = 0.1 TO 100 THEN\n  VAR m = i * 3\n  VAR s = s + m\nEND\n',
+    # A folded -0.0 is another constant than 0.0
+    'VAR a = 0.0\nVAR z = -0.0\nVAR d = z + 0\n',
+    # Dead stores of operations that fail
+    'VAR a = -c\nVAR a = -1\n',
+    'VAR b = "x"\nVAR a = b + 1\nVAR a = 1 / 0\nVAR a = 2\n',
+] + VALUE_PROGRAMS
+
+
+def run_at_levels(text):
+    results = []
+    for level in range(mini.MAX_OPTIMIZATION_LEVEL + 1):
+        variables, error = mini.run_program('<bench>', text, level)
+        # By repr, which tells nan and -0.0 apart
+        results.append(error.details if error else
+                       {name: repr(value) for name, value in plain_values(variables).items()})
+    return results
+
+
+def compile_files(files, cache):
+    # The intermediate code of every file through the run functions
+    return [mini.run_intermediate_code_generator(name, text, 2, cache)
+            for name, text in files]
+
+
+def bench_cache(args):
+    # Compiles a directory of files without the cache, then twice through
+    # the cache next to them: once to fill it and once from it. The code
+    # must be the same every time, also after an entry is corrupted and once
+    # the cache has to evict entries to stay under its size.
+    with tempfile.TemporaryDirectory() as directory:
+        files = []
+        for n in range(args.corpus // 50):
+            name = os.path.join(directory, f'file{n}.mini')
+            text = generate_program(args.lines // 200).replace('block', f'file {n}')
+            with open(name, 'w') as file:
+                file.write(text)
+            files.append((name, text))
+        cache = mini.cache_for(files[0][0])
+
+        uncached_time, expected = best_of(1, lambda: compile_files(files, None))
+        cold_time, cold = best_of(1, lambda: compile_files(files, True))
+        warm_time, warm = best_of(1, lambda: compile_files(files, True))
+        if cold != expected or warm != expected:
+            print('The cached code differs from the compiled code')
+            return
+        print(f'{len(files)} files: uncached {uncached_time / 1e6:.1f} ms, '
+              f'cold cache {cold_time / 1e6:.1f} ms, warm cache '
+              f'{warm_time / 1e6:.1f} ms ({uncached_time / warm_time:.1f}x)')
+
+        last_use, size, path = max(cache.entries())
+        with open(path, 'r+b') as file:
+            file.truncate(size // 2)
+        if compile_files(files, True) != expected or not cache.stats['invalid']:
+            print('A corrupted entry was not dropped')
+            return
+
+        # Going round all the files again would miss every time under LRU,
+        # so the last quarter is compiled once more, from the cache
+        bounded = mini.CompileCache(cache.directory, cache.entries_size() // 2)
+        bounded.clear()
+        recent = files[-len(files) // 4:]
+        if (compile_files(files, bounded) != expected
+                or compile_files(recent, bounded) != expected[-len(recent):]):
+            print('The bounded cache gives other code')
+            return
+        if bounded.entries_size() > bounded.max_size:
+            print('The bounded cache grew past its size')
+            return
+        print('cache:', cache.stats)
+        print('bounded to', bounded.max_size // 2**10, 'KB:', bounded.stats)
+
+
+def bench_optimize(args):
+    for text in OPTIMIZER_CASES:
+        results = run_at_levels(text)
+        if any(result != results[0] for result in results):
+            print('The optimization levels disagree on:', text, sep='\n')
+            return
+    print(f'{len(OPTIMIZER_CASES)} programs agree at every level')
+
+    programs = [(file_name, open(file_name).read())
+                for file_name in ('ex.mini', 'tac.mini', 'rand.mini')]
+    programs.append(('generated', generate_program(args.lines)))
+
+    header = ''.join(f'  {name:>9}' for name, _ in OPTIMIZATION_PASSES)
+    print(f'{"":>10}  {"before":>9}{header}  {"pass ms":>9}')
+    for name, text in programs:
+        program, error = mini.CompileSession(name, text).generate_ir()
+        if error:
+            print(error.as_string())
+            return
+        counts = [len(program)]
+        elapsed = 0
+        for _, optimize in OPTIMIZATION_PASSES:
+            pass_time, program = best_of(
+                args.repeat, lambda: optimize(program))
+            counts.append(len(program))
+            elapsed += pass_time
+        print(f'{name:>10}' + ''.join(f'  {count:>9}' for count in counts)
+              + f'  {elapsed / 1e6:>9.2f}')
+
+    # Instructions value numbering replaced, per function of the samples
+    print()
+    for name, text in programs[:-1]:
+        program, _ = mini.CompileSession(name, text).generate_ir()
+        eliminated = {}
+        optimizer.number_values(optimizer.fold_constants(program), eliminated)
+        for function, count in eliminated.items():
+            print(f'{name:>10}  {function:<12} {count:>4} eliminated')
+
+
+BENCHMARKS = {
+    'lexer': bench_lexer,
+    'memory': bench_memory,
+    'streaming': bench_streaming,
+    'expressions': bench_expressions,
+    'prediction': bench_prediction,
+    'deep': bench_deep,
+    'emit': bench_emit,
+    'optimize': bench_optimize,
+    'cfg': bench_cfg,
+    'ssa': bench_ssa,
+    'loops': bench_loops,
+    'algebra': bench_algebra,
+    'logic': bench_logic,
+    'switch': bench_switch,
+    'temps': bench_temps,
+    'vm': bench_vm,
+    'closures': bench_closures,
+    'python': bench_python,
+    'cache': bench_cache,
+}
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description='Mini benchmarks')
+    arg_parser.add_argument('benchmark', choices=list(BENCHMARKS))
+    arg_parser.add_argument('--lines', type=int, default=60000,
+                            help='size of the generated program')
+    arg_parser.add_argument('--repeat', type=int, default=3,
+                            help='number of runs, the best one is reported')
+    arg_parser.add_argument('--corpus', type=int, default=5000,
+                            help='expressions in the differential check')
+    arg_parser.add_argument('--tokens', type=int, default=1000000,
+                            help='approximate token count for memory')
+    arg_parser.add_argument('--depth', type=int, default=100000,
+                            help='nesting depth for deep')
+    arg_parser.add_argument('--child', choices=['list', 'stream'],
+                            help=argparse.SUPPRESS)
+    arg_parser.add_argument('--file', help=argparse.SUPPRESS)
+    args = arg_parser.parse_args()
+    BENCHMARKS[args.benchmark](args)
+
+
+if __name__ == '__main__':
+    main()
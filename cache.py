@@ -0,0 +1,238 @@
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
+
+"""
+    This document contains the following:
+    1. compiler_version function
+    2. CompileCache class
+    3. cache_for function, the caches the mini.run_* functions use
+
+    The cache keeps what the compiler makes of a source text, the tokens,
+    the AST and the intermediate code, in a directory next to the source,
+    like __pycache__ does for Python. Every entry is addressed by a hash of
+    the source, the version of the compiler and the options the artifact
+    depends on, so an entry is never stale: a changed file or compiler
+    simply asks for another entry, and the old one ages out.
+
+    An entry is a header followed by the pickled (result, error) pair of a
+    phase. The header repeats the key and holds a hash of the pickle, so a
+    truncated or corrupted file is dropped instead of loaded. Entries are
+    written to a temporary file and renamed into place, so readers never see
+    half an entry, and the least recently used ones are removed once the
+    directory grows past its size.
+"""
+
+
+CACHE_DIRECTORY = '__minicache__'
+ENTRY_SUFFIX = '.mc'
+MAGIC = b'MINI\x01\r\n\x00'
+DIGEST_SIZE = 32
+HEADER_SIZE = len(MAGIC) + 2 * DIGEST_SIZE
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+# The modules whose code decides what the cached artifacts are. A change to
+# any of them is a new version of the compiler.
+COMPILER_MODULES = [
+    'constants.py', 'position.py', 'error.py', 'lexer.py', 'parser.py',
+    'ast_nodes.py', 'ir.py', 'cfg.py', 'ssa.py', 'optimizer.py', 'mini.py',
+    'cache.py',
+]
+
+_compiler_version = None
+
+
+def compiler_version():
+    # A hash of the code of the compiler and the Python that runs it, read
+    # once per process
+    global _compiler_version
+    if _compiler_version is None:
+        digest = hashlib.sha256(sys.implementation.cache_tag.encode())
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in COMPILER_MODULES:
+            with open(os.path.join(directory, name), 'rb') as file:
+                digest.update(file.read())
+        _compiler_version = digest.hexdigest()
+    return _compiler_version
+
+
+"""CompileCache class
+
+    Description:
+        A directory of cached compiler artifacts with a bound on its size.
+        Failing to read or write the directory is never an error: the
+        artifact is then compiled as if the cache were empty.
+
+    Arguments:
+        directory (str): The cache directory, created on the first store
+        max_size (int): The size in bytes the entries are kept under
+
+    Attributes:
+        stats (dict): The hits and misses of the loads, the entries stored,
+            the ones evicted to stay under max_size and the invalid ones
+            that were dropped
+
+    Returns:
+        CompileCache: A CompileCache object
+"""
+
+
+class CompileCache:
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size
+        self.stats = {'hits': 0, 'misses': 0, 'stores': 0, 'evictions': 0,
+                      'invalid': 0}
+        # The size of the entries, counted when it is first needed and kept
+        # up to date by the stores and evictions of this cache
+        self.size = None
+
+    def key(self, text, artifact, options=()):
+        digest = hashlib.sha256()
+        digest.update(compiler_version().encode())
+        digest.update(repr((artifact, tuple(options))).encode())
+        digest.update(b'\0')
+        digest.update(text.encode('utf-8', 'surrogatepass'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key + ENTRY_SUFFIX)
+
+    def load(self, key):
+        # The (result, error) pair stored under key, or None
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as file:
+                data = file.read()
+        except OSError:
+            self.stats['misses'] += 1
+            return None
+
+        payload = data[HEADER_SIZE:]
+        entry = None
+        if (data[:len(MAGIC)] == MAGIC
+                and data[len(MAGIC):len(MAGIC) + DIGEST_SIZE] == bytes.fromhex(key)
+                and data[len(MAGIC) + DIGEST_SIZE:HEADER_SIZE]
+                == hashlib.sha256(payload).digest()):
+            try:
+                entry = pickle.loads(payload)
+            except Exception:
+                entry = None
+        if entry is None:
+            self.stats['invalid'] += 1
+            self.stats['misses'] += 1
+            self.remove(path)
+            return None
+
+        # The time of the last use orders the entries for eviction
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.stats['hits'] += 1
+        return entry
+
+    def store(self, key, entry):
+        try:
+            payload = pickle.dumps(entry, pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, RecursionError, TypeError, AttributeError):
+            # Too deep or holding something that cannot be pickled
+            return False
+        data = MAGIC + bytes.fromhex(key) + hashlib.sha256(payload).digest() + payload
+        if len(data) > self.max_size:
+            return False
+
+        path = self.path(key)
+        try:
+            # The directory the cache is in must already exist
+            if not os.path.isdir(self.directory):
+                os.mkdir(self.directory)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            fd, temp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as file:
+                    file.write(data)
+                os.replace(temp_path, path)
+            except BaseException:
+                self.remove(temp_path)
+                raise
+        except OSError:
+            return False
+
+        self.stats['stores'] += 1
+        if self.size is None:
+            self.size = self.entries_size()
+        else:
+            self.size += len(data) - replaced
+        if self.size > self.max_size:
+            self.evict(path)
+        return True
+
+    def entries(self):
+        # (last use, size, path) of every entry in the directory
+        entries = []
+        try:
+            with os.scandir(self.directory) as scan:
+                for dir_entry in scan:
+                    if dir_entry.name.endswith(ENTRY_SUFFIX):
+                        try:
+                            stat = dir_entry.stat()
+                        except OSError:
+                            continue
+                        entries.append((stat.st_mtime_ns, stat.st_size, dir_entry.path))
+        except OSError:
+            pass
+        return entries
+
+    def entries_size(self):
+        return sum(size for last_use, size, path in self.entries())
+
+    def evict(self, keep=None):
+        # Removes the least recently used entries until the directory fits
+        # in max_size. Other processes may have added entries, so the
+        # directory is counted again.
+        entries = sorted(self.entries())
+        size = sum(size for last_use, size, path in entries)
+        for last_use, entry_size, path in entries:
+            if size <= self.max_size:
+                break
+            if path == keep:
+                continue
+            if self.remove(path):
+                self.stats['evictions'] += 1
+                size -= entry_size
+        self.size = size
+
+    def clear(self):
+        for last_use, size, path in self.entries():
+            self.remove(path)
+        self.size = 0
+
+    def remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            return False
+        return True
+
+
+# ===============================================================================
+# CACHES OF THE RUN FUNCTIONS
+# ===============================================================================
+_caches = {}
+
+
+def cache_for(fn):
+    # The cache of the directory of the file fn, shared by all the sessions
+    # of the process. Names like <stdin>, or of files that do not exist, are
+    # not cached.
+    if not os.path.isfile(fn) or os.environ.get('MINI_NO_CACHE'):
+        return None
+    directory = os.path.join(os.path.dirname(os.path.abspath(fn)), CACHE_DIRECTORY)
+    cache = _caches.get(directory)
+    if cache is None:
+        cache = _caches[directory] = CompileCache(directory)
+    return cache
@@ -0,0 +1,262 @@
+from ir import *
+
+"""
+    This document contains the following:
+    1. The control flow between the instructions of a Program
+    2. BasicBlock class
+    3. ControlFlowGraph class
+    4. build_graphs function
+    5. The Graphviz dot export of the graphs
+
+    The passes of the optimizer work on the instructions of a program as a
+    list of (opcode, dest, arg1, arg2, layout) tuples. Every step here is a
+    single pass over that list, so large generated programs stay cheap.
+"""
+
+
+BRANCH_OPCODES = frozenset([OP_IF_FALSE, OP_IF_GREATER, OP_IF_TRUE])
+
+# The successor of an instruction that leaves the function or the program
+EXIT = -1
+
+MAIN_FUNCTION = '<program>'
+ANONYMOUS_FUNCTION = '<anonymous>'
+
+
+def load(program):
+    return list(zip(program.opcodes, program.dests, program.arg1s,
+                    program.arg2s, program.layouts))
+
+
+def function_ends(instructions):
+    # The index of the func_end of every func_start
+    ends = {}
+    open_functions = []
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if opcode == OP_FUNC_START:
+            open_functions.append(idx)
+        elif opcode == OP_FUNC_END and open_functions:
+            ends[open_functions.pop()] = idx
+    return ends
+
+
+def control_flow(instructions, constants):
+    # Returns the successors of every instruction, and the func_end of every
+    # func_start. The code around a function definition skips its body,
+    # which is entered at the instruction after its func_start. The labels
+    # of a SWITCH are in its table, among the constants.
+    count = len(instructions)
+    labels = {dest: idx for idx, (opcode, dest, arg1, arg2, layout)
+              in enumerate(instructions) if opcode == OP_LABEL}
+    ends = function_ends(instructions)
+
+    successors = []
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if opcode == OP_GOTO:
+            targets = (labels.get(dest, EXIT),)
+        elif opcode in BRANCH_OPCODES:
+            targets = (idx + 1, labels.get(dest, EXIT))
+        elif opcode == OP_SWITCH:
+            targets = tuple(dict.fromkeys(
+                [labels.get(dest, EXIT)] + [labels.get(case, EXIT)
+                                            for value, case in constants[arg2 >> 2]]))
+        elif opcode == OP_RETURN or opcode == OP_FUNC_END:
+            targets = (EXIT,)
+        elif opcode == OP_FUNC_START and idx in ends:
+            targets = (ends[idx] + 1,)
+        else:
+            targets = (idx + 1,)
+        successors.append(tuple(EXIT if target >= count else target
+                                for target in targets))
+    return successors, ends
+
+
+def split_blocks(instructions, successors):
+    # Returns the (start, end) bounds of the basic blocks, and the block of
+    # every instruction
+    starts = []
+    block_of = []
+    ends_block = True
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if ends_block or opcode == OP_LABEL:
+            starts.append(idx)
+        block_of.append(len(starts) - 1)
+        ends_block = successors[idx] != (idx + 1,) or opcode == OP_FUNC_START
+    return list(zip(starts, starts[1:] + [len(instructions)])), block_of
+
+
+def function_of(program, instructions):
+    # The name of the function every instruction belongs to. The code outside
+    # any function belongs to MAIN_FUNCTION, and a func_start to the code
+    # that defines the function.
+    functions = []
+    open_functions = [MAIN_FUNCTION]
+    for opcode, dest, arg1, arg2, layout in instructions:
+        functions.append(open_functions[-1])
+        if opcode == OP_FUNC_START:
+            open_functions.append(program.names[arg1 >> 2] if arg1 >= 0
+                                  else ANONYMOUS_FUNCTION)
+        elif opcode == OP_FUNC_END and len(open_functions) > 1:
+            functions[-1] = open_functions.pop()
+    return functions
+
+
+"""BasicBlock class
+
+    Description:
+        A run of instructions that is only entered at its first one and only
+        left after its last one.
+
+    Attributes:
+        index (int): The index of the block in its graph
+        start (int): The index of its first instruction in the program
+        end (int): The index after its last instruction
+        successors (list): The blocks control goes to next, EXIT when it
+            leaves the function
+        predecessors (list): The blocks control comes from
+
+    Returns:
+        BasicBlock: A BasicBlock object
+"""
+
+
+class BasicBlock:
+    __slots__ = ('index', 'start', 'end', 'successors', 'predecessors')
+
+    def __init__(self, index, start, end):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.successors = []
+        self.predecessors = []
+
+    def __len__(self):
+        return self.end - self.start
+
+    def __repr__(self):
+        return f'B{self.index}[{self.start}:{self.end}] -> {self.successors}'
+
+
+"""ControlFlowGraph class
+
+    Description:
+        The basic blocks of the code outside any function, or of the body of
+        one function, from the instruction after its func_start to its
+        func_end. The first block is the entry.
+
+    Arguments:
+        program (Program): The program the blocks are in
+        function (str): The name of the function
+
+    Attributes:
+        blocks (list): The BasicBlocks, in the order of the program
+
+    Returns:
+        ControlFlowGraph: A ControlFlowGraph object
+"""
+
+
+class ControlFlowGraph:
+    def __init__(self, program, function):
+        self.program = program
+        self.function = function
+        self.blocks = []
+
+    def __len__(self):
+        return len(self.blocks)
+
+    def __repr__(self):
+        return f'{self.function}: ' + ', '.join(map(repr, self.blocks))
+
+    def edges(self):
+        for block in self.blocks:
+            for successor in block.successors:
+                yield block.index, successor
+
+
+def build_graphs(program):
+    # The graph of the code outside any function comes first, then the graph
+    # of every function in the order of their func_start
+    instructions = load(program)
+    successors, ends = control_flow(instructions, program.constants)
+    bounds, block_of = split_blocks(instructions, successors)
+    functions = function_of(program, instructions)
+
+    graphs = [ControlFlowGraph(program, MAIN_FUNCTION)]
+    function_ends = set(ends.values())
+    graph_of = []
+    open_graphs = [0]
+    local_block = []
+    for start, end in bounds:
+        # A function body starts a block, as its func_start ends one
+        if start and instructions[start - 1][0] == OP_FUNC_START \
+                and start - 1 in ends:
+            open_graphs.append(len(graphs))
+            graphs.append(ControlFlowGraph(program, functions[start]))
+
+        graph = graphs[open_graphs[-1]]
+        local_block.append(len(graph.blocks))
+        graph_of.append(open_graphs[-1])
+        graph.blocks.append(BasicBlock(len(graph.blocks), start, end))
+
+        if instructions[end - 1][0] == OP_FUNC_END and len(open_graphs) > 1 \
+                and end - 1 in function_ends:
+            open_graphs.pop()
+
+    for idx, (start, end) in enumerate(bounds):
+        graph = graphs[graph_of[idx]]
+        block = graph.blocks[local_block[idx]]
+        for target in successors[end - 1]:
+            if target == EXIT or graph_of[block_of[target]] != graph_of[idx]:
+                successor = EXIT
+            else:
+                successor = local_block[block_of[target]]
+            if successor in block.successors:
+                continue
+            block.successors.append(successor)
+            if successor != EXIT:
+                graph.blocks[successor].predecessors.append(block.index)
+
+    return graphs
+
+
+# ===============================================================================
+# GRAPHVIZ
+# ===============================================================================
+def dot_string(text):
+    escaped = text.replace('\\', '\\\\').replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def block_text(program, block):
+    # The instructions of the block as printed, one left aligned line each
+    lines = []
+    write_program(program, lines.append, block.start, block.end)
+    text = ''.join(lines)
+    return ''.join(dot_string(line.strip())[1:-1] + '\\l'
+                   for line in text.split('\n') if line.strip())
+
+
+def write_dot(graphs, write):
+    # Writes the graphs as one Graphviz digraph, with a cluster per function
+    write('digraph mini {\n')
+    write('  node [shape=box, fontname="monospace"];\n')
+    for number, graph in enumerate(graphs):
+        prefix = f'g{number}_'
+        write(f'  subgraph cluster_{number} {{\n')
+        write(f'    label={dot_string(graph.function)};\n')
+        for block in graph.blocks:
+            label = f'B{block.index}\\l' + block_text(graph.program, block)
+            write(f'    {prefix}b{block.index} [label="{label}"];\n')
+        write(f'    {prefix}exit [label="exit", shape=oval];\n')
+        for source, target in graph.edges():
+            target = 'exit' if target == EXIT else f'b{target}'
+            write(f'    {prefix}b{source} -> {prefix}{target};\n')
+        write('  }\n')
+    write('}\n')
+
+
+def format_dot(graphs):
+    lines = []
+    write_dot(graphs, lines.append)
+    return ''.join(lines)
@@ -38,6 +38,34 @@ TT_ARROW = 'ARROW'
 TT_NEWLINE = 'NEWLINE'
 TT_EOF = 'EOF'
 
+TOKEN_TYPES = [
+    TT_INT,
+    TT_FLOAT,
+    TT_STRING,
+    TT_IDENTIFIER,
+    TT_KEYWORD,
+    TT_PLUS,
+    TT_MINUS,
+    TT_MUL,
+    TT_DIV,
+    TT_POW,
+    TT_EQ,
+    TT_LPAREN,
+    TT_RPAREN,
+    TT_LSQUARE,
+    TT_RSQUARE,
+    TT_EE,
+    TT_NE,
+    TT_LT,
+    TT_GT,
+    TT_LTE,
+    TT_GTE,
+    TT_COMMA,
+    TT_ARROW,
+    TT_NEWLINE,
+    TT_EOF,
+]
+
 KEYWORDS = [
     'VAR',
     'AND',
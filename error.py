@@ -31,3 +31,15 @@ class InvalidSyntaxError(Error):
     def __init__(self, pos_start, pos_end, details=''):
         super().__init__(pos_start, pos_end, 'Invalid Syntax', details)
 
+
+class RTError(Error):
+    # Raised while a program runs. The intermediate code has no positions, so
+    # its errors give the instruction that failed instead.
+    def __init__(self, details, instruction=None, pos_start=None, pos_end=None):
+        super().__init__(pos_start, pos_end, 'Runtime Error', details)
+        self.instruction = instruction
+
+    def as_string(self):
+        if self.pos_start is not None:
+            return super().as_string()
+        return f'{self.error_name}: {self.details}\nAt: {self.instruction}\n'
@@ -0,0 +1,782 @@
+import operator
+import sys
+import threading
+from ast_nodes import *
+from error import RTError
+from vm import MAX_CALL_DEPTH
+
+"""
+    This document contains the following:
+    1. Function class
+    2. TreeWalker class, which evaluates the tree node by node
+    3. ClosureCompiler class, which compiles the tree to closures
+    4. walk_program and run_closures functions
+    5. run_deep function, which gives them as deep a call stack as the
+       register machine
+
+    Both evaluators follow the semantics of the intermediate code, so that a
+    program ends with the same variables whichever way it runs. Comparisons
+    and AND, OR and NOT give 1 or 0, division always gives a float, and a
+    FOR loop computes its end and step once and runs while its variable is
+    not past the end. The arguments of a function are local to its call,
+    the other variables are shared by all the functions. A BREAK or a
+    CONTINUE out of any loop does nothing, and a RETURN out of any function
+    ends the program.
+
+    The values are those of the intermediate code too. A list or a block of
+    statements gives the value of its last element, an IF the value of the
+    case it runs, or null when it runs none or a block, a loop gives null, a
+    function definition the function, and a RETURN without a value null.
+"""
+
+
+# ===============================================================================
+# VALUES
+# ===============================================================================
+"""Function class
+
+    Description:
+        The value of a function definition.
+
+    Arguments:
+        name (str): The name of the function, None when it is anonymous
+        invoke (function): Runs the function on a list of arguments and
+            gives its result
+
+    Returns:
+        Function: A Function object
+"""
+
+
+class Function:
+    __slots__ = ('name', 'invoke')
+
+    def __init__(self, name, invoke):
+        self.name = name
+        self.invoke = invoke
+
+    def __repr__(self):
+        return f'<function {self.name or "anonymous"}>'
+
+
+# BREAK, CONTINUE and RETURN leave the closures and the visits they are in
+class BreakLoop(Exception):
+    pass
+
+
+class ContinueLoop(Exception):
+    pass
+
+
+class ReturnValue(Exception):
+    def __init__(self, value):
+        self.value = value
+
+
+# An operation failed at the node of the error
+class MiniRuntimeError(Exception):
+    def __init__(self, error):
+        self.error = error
+
+
+# The Python errors an operation of a Mini program can raise
+OPERATION_ERRORS = (ArithmeticError, TypeError, ValueError)
+
+
+def operation_error(exception, node):
+    return MiniRuntimeError(RTError(str(exception), pos_start=node.pos_start,
+                                    pos_end=node.pos_end))
+
+
+def logical_operator(node):
+    # 'AND', 'OR' or 'NOT', or None for the other operators
+    if is_logical(node):
+        return node.op_tok.value
+    return None
+
+
+# ===============================================================================
+# CALL DEPTH
+# ===============================================================================
+# The Python frames a Mini call takes, with room for the expressions it is
+# nested in, on the evaluators here and on the Python backend
+EVALUATOR_FRAMES_PER_CALL = 24
+PYTHON_FRAMES_PER_CALL = 4
+
+# The C stack a Python frame may take, on the versions that do not inline
+# the calls between Python functions
+STACK_BYTES_PER_FRAME = 512
+
+
+def run_deep(function, frames_per_call=EVALUATOR_FRAMES_PER_CALL):
+    # Runs function on a thread whose stack and recursion limit allow
+    # MAX_CALL_DEPTH nested Mini calls, like the register machine, and
+    # gives its result. The recursion limit of the process is put back
+    # afterwards. The evaluators also count their calls, so a program that
+    # recurses forever stops at MAX_CALL_DEPTH calls on them too.
+    frames = MAX_CALL_DEPTH * frames_per_call
+    outcome = []
+
+    def target():
+        try:
+            outcome.append((function(), None))
+        except BaseException as exception:
+            outcome.append((None, exception))
+
+    recursion_limit = sys.getrecursionlimit()
+    stack_size = threading.stack_size(frames * STACK_BYTES_PER_FRAME)
+    sys.setrecursionlimit(max(recursion_limit, frames))
+    try:
+        thread = threading.Thread(target=target)
+        thread.start()
+        thread.join()
+    finally:
+        sys.setrecursionlimit(recursion_limit)
+        threading.stack_size(stack_size)
+
+    result, exception = outcome[0]
+    if exception is not None:
+        raise exception
+    return result
+
+
+# ===============================================================================
+# TREE WALKER
+# ===============================================================================
+"""TreeWalker class
+
+    Description:
+        Evaluates a program by visiting its nodes, looking every method,
+        operator and variable up by name as it goes. Simple and slow, it is
+        the reference the closure compiler is checked against.
+
+    Attributes:
+        variables (dict): The variables shared by all the functions, by name
+
+    Returns:
+        TreeWalker: A TreeWalker object
+"""
+
+
+class TreeWalker:
+    def __init__(self):
+        self.variables = {}
+        # The loops the running function is in
+        self.loop_depth = 0
+        # The calls that have not returned yet
+        self.call_depth = 0
+
+    def visit(self, node, local):
+        method = getattr(self, f'visit_{type(node).__name__}')
+        return method(node, local)
+
+    def run(self, ast):
+        try:
+            self.visit(ast, None)
+        except ReturnValue:
+            pass
+        except MiniRuntimeError as exception:
+            return None, exception.error
+        except RecursionError:
+            return None, RTError('Maximum call depth exceeded', pos_start=ast.pos_start,
+                                 pos_end=ast.pos_end)
+        return {name: value for name, value in self.variables.items()
+                if value is not None}, None
+
+    def load(self, name, local):
+        if local is not None and name in local:
+            return local[name]
+        return self.variables.get(name)
+
+    def store(self, name, value, local):
+        if local is not None and name in local:
+            local[name] = value
+        else:
+            self.variables[name] = value
+
+    def visit_NumberNode(self, node, local):
+        return node.tok.value
+
+    def visit_StringNode(self, node, local):
+        return node.tok.value
+
+    def visit_ListNode(self, node, local):
+        value = None
+        for element in node.element_nodes:
+            value = self.visit(element, local)
+        return value
+
+    def visit_VarAccessNode(self, node, local):
+        return self.load(node.var_name_tok.value, local)
+
+    def visit_VarAssignNode(self, node, local):
+        value = self.visit(node.value_node, local)
+        self.store(node.var_name_tok.value, value, local)
+        return value
+
+    def visit_BinOpNode(self, node, local):
+        operator = logical_operator(node)
+        if operator == 'AND':
+            return 1 if self.visit(node.left_node, local) \
+                and self.visit(node.right_node, local) else 0
+        if operator == 'OR':
+            return 1 if self.visit(node.left_node, local) \
+                or self.visit(node.right_node, local) else 0
+
+        left = self.visit(node.left_node, local)
+        right = self.visit(node.right_node, local)
+        symbol = node.op_symbol_converter()
+        try:
+            if symbol == '+':
+                return left + right
+            elif symbol == '-':
+                return left - right
+            elif symbol == '*':
+                return left * right
+            elif symbol == '/':
+                return left / right
+            elif symbol == '^':
+                return left ** right
+            elif symbol == '==':
+                return 1 if left == right else 0
+            elif symbol == '!=':
+                return 1 if left != right else 0
+            elif symbol == '<':
+                return 1 if left < right else 0
+            elif symbol == '>':
+                return 1 if left > right else 0
+            elif symbol == '<=':
+                return 1 if left <= right else 0
+            else:
+                return 1 if left >= right else 0
+        except OPERATION_ERRORS as exception:
+            raise operation_error(exception, node) from None
+
+    def visit_UnaryOpNode(self, node, local):
+        value = self.visit(node.node, local)
+        if logical_operator(node) == 'NOT':
+            return 0 if value else 1
+        try:
+            return -value if node.op_tok.type == TT_MINUS else +value
+        except OPERATION_ERRORS as exception:
+            raise operation_error(exception, node) from None
+
+    def visit_IfNode(self, node, local):
+        for condition, body, should_return_null in node.cases:
+            if self.visit(condition, local):
+                value = self.visit(body, local)
+                return None if should_return_null else value
+        if node.else_case is not None:
+            body, should_return_null = node.else_case
+            value = self.visit(body, local)
+            return None if should_return_null else value
+        return None
+
+    def visit_ForNode(self, node, local):
+        name = node.var_name_tok.value
+        start = self.visit(node.start_value_node, local)
+        end = self.visit(node.end_value_node, local)
+        step = self.visit(node.step_value_node, local) if node.step_value_node else 1
+
+        self.store(name, start, local)
+        try:
+            if start > end:
+                return None
+            while True:
+                self.loop_depth += 1
+                try:
+                    self.visit(node.body_node, local)
+                except ContinueLoop:
+                    pass
+                except BreakLoop:
+                    return None
+                finally:
+                    self.loop_depth -= 1
+                value = self.load(name, local) + step
+                self.store(name, value, local)
+                if not value <= end:
+                    return None
+        except OPERATION_ERRORS as exception:
+            raise operation_error(exception, node) from None
+
+    def visit_WhileNode(self, node, local):
+        while self.visit(node.condition_node, local):
+            self.loop_depth += 1
+            try:
+                self.visit(node.body_node, local)
+            except ContinueLoop:
+                pass
+            except BreakLoop:
+                break
+            finally:
+                self.loop_depth -= 1
+        return None
+
+    def visit_FuncDefNode(self, node, local):
+        name = node.var_name_tok.value if node.var_name_tok else None
+
+        def invoke(args):
+            frame = {}
+            for idx, arg_name_tok in enumerate(node.arg_name_toks):
+                frame[arg_name_tok.value] = args[idx] if idx < len(args) else None
+            if self.call_depth >= MAX_CALL_DEPTH:
+                raise RecursionError()
+            loop_depth = self.loop_depth
+            self.loop_depth = 0
+            self.call_depth += 1
+            try:
+                value = self.visit(node.body_node, frame)
+            except ReturnValue as returned:
+                return returned.value
+            finally:
+                self.loop_depth = loop_depth
+                self.call_depth -= 1
+            return value if node.should_auto_return else None
+
+        function = Function(name, invoke)
+        if name is not None:
+            self.store(name, function, local)
+        return function
+
+    def visit_CallNode(self, node, local):
+        args = [self.visit(arg_node, local) for arg_node in node.arg_nodes]
+        function = self.visit(node.node_to_call, local)
+        if not isinstance(function, Function):
+            raise MiniRuntimeError(RTError(f'{function!r} is not a function',
+                                           pos_start=node.pos_start, pos_end=node.pos_end))
+        return function.invoke(args)
+
+    def visit_ReturnNode(self, node, local):
+        value = self.visit(node.node_to_return, local) if node.node_to_return else None
+        raise ReturnValue(value)
+
+    def visit_ContinueNode(self, node, local):
+        if self.loop_depth:
+            raise ContinueLoop()
+        return None
+
+    def visit_BreakNode(self, node, local):
+        if self.loop_depth:
+            raise BreakLoop()
+        return None
+
+
+def walk_program(ast):
+    return run_deep(lambda: TreeWalker().run(ast))
+
+
+# ===============================================================================
+# CLOSURE COMPILER
+# ===============================================================================
+# Every node becomes a function of the frame of the running call: a list
+# holding the arguments of the function, in the order they are declared.
+# The operators are bound when the closure is made, and the variables to
+# their index in the list of variables or in the frame. An operator that
+# can fail catches its own error, so that it is reported at its node like
+# on the tree walker; a try costs nothing until something is raised.
+def operator_closure(function, constant=False, comparison=False):
+    # Builds the closure of an operator that can fail from the closures of
+    # its operands, or with constant from the closure of its left operand
+    # and the value of its right one. A comparison gives 1 or 0.
+    def make(node, left, right):
+        if comparison and constant:
+            def operation(frame):
+                try:
+                    return 1 if function(left(frame), right) else 0
+                except OPERATION_ERRORS as exception:
+                    raise operation_error(exception, node) from None
+        elif comparison:
+            def operation(frame):
+                try:
+                    return 1 if function(left(frame), right(frame)) else 0
+                except OPERATION_ERRORS as exception:
+                    raise operation_error(exception, node) from None
+        elif constant:
+            def operation(frame):
+                try:
+                    return function(left(frame), right)
+                except OPERATION_ERRORS as exception:
+                    raise operation_error(exception, node) from None
+        else:
+            def operation(frame):
+                try:
+                    return function(left(frame), right(frame))
+                except OPERATION_ERRORS as exception:
+                    raise operation_error(exception, node) from None
+        return operation
+    return make
+
+
+ARITHMETIC_FUNCTIONS = {
+    TT_PLUS: operator.add,
+    TT_MINUS: operator.sub,
+    TT_MUL: operator.mul,
+    TT_DIV: operator.truediv,
+    TT_POW: operator.pow,
+}
+
+COMPARISON_FUNCTIONS = {
+    TT_LT: operator.lt,
+    TT_GT: operator.gt,
+    TT_LTE: operator.le,
+    TT_GTE: operator.ge,
+}
+
+# Comparing values for equality cannot fail
+BINARY_CLOSURES = {
+    TT_EE: lambda node, left, right: lambda frame: 1 if left(frame) == right(frame) else 0,
+    TT_NE: lambda node, left, right: lambda frame: 1 if left(frame) != right(frame) else 0,
+    **{op: operator_closure(function)
+       for op, function in ARITHMETIC_FUNCTIONS.items()},
+    **{op: operator_closure(function, comparison=True)
+       for op, function in COMPARISON_FUNCTIONS.items()},
+}
+
+# The same, with a constant right operand
+CONSTANT_CLOSURES = {
+    TT_EE: lambda node, left, right: lambda frame: 1 if left(frame) == right else 0,
+    TT_NE: lambda node, left, right: lambda frame: 1 if left(frame) != right else 0,
+    **{op: operator_closure(function, constant=True)
+       for op, function in ARITHMETIC_FUNCTIONS.items()},
+    **{op: operator_closure(function, constant=True, comparison=True)
+       for op, function in COMPARISON_FUNCTIONS.items()},
+}
+
+
+"""ClosureCompiler class
+
+    Description:
+        Compiles a tree to closures once, so that running it does no lookup
+        by name and no dispatch on the type of the nodes. The tree is
+        compiled recursively, one Python call per level.
+
+    Attributes:
+        variables (list): The values of the variables shared by all the
+            functions
+        names (dict): The index of every variable in variables, by name
+
+    Returns:
+        ClosureCompiler: A ClosureCompiler object
+"""
+
+
+class ClosureCompiler:
+    def __init__(self):
+        self.variables = []
+        self.names = {}
+        # The loops the function being compiled is in
+        self.loop_depth = 0
+        # The calls that have not returned yet, in a list the closures share
+        self.call_depth = [0]
+
+    def compile(self, node, scope):
+        # scope gives the slot in the frame of the arguments of the function
+        # being compiled
+        method = getattr(self, f'compile_{type(node).__name__}')
+        return method(node, scope)
+
+    def variable(self, name):
+        idx = self.names.get(name)
+        if idx is None:
+            idx = self.names[name] = len(self.variables)
+            self.variables.append(None)
+        return idx
+
+    def compile_program(self, ast):
+        # Returns the function that runs the program and gives its variables
+        body = self.compile(ast, {})
+        variables = self.variables
+        names = list(self.names)
+
+        def run_body():
+            variables[:] = [None] * len(variables)
+            try:
+                body([])
+            except ReturnValue:
+                pass
+            except MiniRuntimeError as exception:
+                return None, exception.error
+            except RecursionError:
+                return None, RTError('Maximum call depth exceeded',
+                                     pos_start=ast.pos_start, pos_end=ast.pos_end)
+            return {name: value for name, value in zip(names, variables)
+                    if value is not None}, None
+        return lambda: run_deep(run_body)
+
+    def compile_NumberNode(self, node, scope):
+        value = node.tok.value
+        return lambda frame: value
+
+    def compile_StringNode(self, node, scope):
+        value = node.tok.value
+        return lambda frame: value
+
+    def compile_ListNode(self, node, scope):
+        statements = tuple(self.compile(element, scope) for element in node.element_nodes)
+        if not statements:
+            return lambda frame: None
+
+        def block(frame):
+            value = None
+            for statement in statements:
+                value = statement(frame)
+            return value
+        return block
+
+    def compile_VarAccessNode(self, node, scope):
+        name = node.var_name_tok.value
+        if name in scope:
+            slot = scope[name]
+            return lambda frame: frame[slot]
+        variables = self.variables
+        idx = self.variable(name)
+        return lambda frame: variables[idx]
+
+    def compile_VarAssignNode(self, node, scope):
+        name = node.var_name_tok.value
+        value_closure = self.compile(node.value_node, scope)
+        if name in scope:
+            slot = scope[name]
+
+            def assign_local(frame):
+                frame[slot] = value = value_closure(frame)
+                return value
+            return assign_local
+
+        variables = self.variables
+        idx = self.variable(name)
+
+        def assign(frame):
+            variables[idx] = value = value_closure(frame)
+            return value
+        return assign
+
+    def compile_BinOpNode(self, node, scope):
+        left = self.compile(node.left_node, scope)
+        right_node = node.right_node
+        right = self.compile(right_node, scope)
+
+        operator = logical_operator(node)
+        if operator == 'AND':
+            return lambda frame: 1 if left(frame) and right(frame) else 0
+        if operator == 'OR':
+            return lambda frame: 1 if left(frame) or right(frame) else 0
+
+        if isinstance(right_node, (NumberNode, StringNode)):
+            return CONSTANT_CLOSURES[node.op_tok.type](node, left, right_node.tok.value)
+        return BINARY_CLOSURES[node.op_tok.type](node, left, right)
+
+    def compile_UnaryOpNode(self, node, scope):
+        operand = self.compile(node.node, scope)
+        if logical_operator(node) == 'NOT':
+            return lambda frame: 0 if operand(frame) else 1
+        if node.op_tok.type == TT_MINUS:
+            def negate(frame):
+                try:
+                    return -operand(frame)
+                except OPERATION_ERRORS as exception:
+                    raise operation_error(exception, node) from None
+            return negate
+
+        def plus(frame):
+            try:
+                return +operand(frame)
+            except OPERATION_ERRORS as exception:
+                raise operation_error(exception, node) from None
+        return plus
+
+    def compile_IfNode(self, node, scope):
+        cases = tuple((self.compile(condition, scope), self.compile(body, scope),
+                       should_return_null)
+                      for condition, body, should_return_null in node.cases)
+        if node.else_case is not None:
+            else_body = self.compile(node.else_case[0], scope)
+            else_returns_null = node.else_case[1]
+        else:
+            else_body = None
+            else_returns_null = True
+
+        if len(cases) == 1 and else_body is None:
+            (condition, body, should_return_null), = cases
+
+            def if_then(frame):
+                if condition(frame):
+                    value = body(frame)
+                    return None if should_return_null else value
+                return None
+            return if_then
+
+        def if_ladder(frame):
+            for condition, body, should_return_null in cases:
+                if condition(frame):
+                    value = body(frame)
+                    return None if should_return_null else value
+            if else_body is not None:
+                value = else_body(frame)
+                return None if else_returns_null else value
+            return None
+        return if_ladder
+
+    def compile_ForNode(self, node, scope):
+        start_closure = self.compile(node.start_value_node, scope)
+        end_closure = self.compile(node.end_value_node, scope)
+        step_closure = (self.compile(node.step_value_node, scope)
+                        if node.step_value_node else lambda frame: 1)
+        self.loop_depth += 1
+        body = self.compile(node.body_node, scope)
+        self.loop_depth -= 1
+
+        # The variable is an argument of the function, in the frame, or one
+        # of the shared variables
+        name = node.var_name_tok.value
+        local = name in scope
+        idx = scope[name] if local else self.variable(name)
+        variables = self.variables
+
+        def for_loop(frame):
+            start = start_closure(frame)
+            end = end_closure(frame)
+            step = step_closure(frame)
+            target = frame if local else variables
+            target[idx] = start
+            try:
+                if start > end:
+                    return None
+                while True:
+                    try:
+                        body(frame)
+                    except ContinueLoop:
+                        pass
+                    except BreakLoop:
+                        return None
+                    value = target[idx] + step
+                    target[idx] = value
+                    if not value <= end:
+                        return None
+            except OPERATION_ERRORS as exception:
+                raise operation_error(exception, node) from None
+        return for_loop
+
+    def compile_WhileNode(self, node, scope):
+        condition = self.compile(node.condition_node, scope)
+        self.loop_depth += 1
+        body = self.compile(node.body_node, scope)
+        self.loop_depth -= 1
+
+        def while_loop(frame):
+            while condition(frame):
+                try:
+                    body(frame)
+                except ContinueLoop:
+                    pass
+                except BreakLoop:
+                    break
+            return None
+        return while_loop
+
+    def compile_FuncDefNode(self, node, scope):
+        name = node.var_name_tok.value if node.var_name_tok else None
+        arity = len(node.arg_name_toks)
+        function_scope = {}
+        for arg_name_tok in node.arg_name_toks:
+            function_scope[arg_name_tok.value] = len(function_scope)
+        slots = len(function_scope)
+        # With an argument named twice, the last argument given is kept
+        slot_of = [function_scope[arg_name_tok.value] for arg_name_tok in node.arg_name_toks]
+        loop_depth = self.loop_depth
+        self.loop_depth = 0
+        body = self.compile(node.body_node, function_scope)
+        self.loop_depth = loop_depth
+        should_auto_return = node.should_auto_return
+        call_depth = self.call_depth
+
+        def invoke(args):
+            if call_depth[0] >= MAX_CALL_DEPTH:
+                raise RecursionError()
+            if len(args) == arity and slots == arity:
+                frame = args
+            else:
+                frame = [None] * slots
+                for idx, slot in enumerate(slot_of):
+                    frame[slot] = args[idx] if idx < len(args) else None
+            call_depth[0] += 1
+            try:
+                value = body(frame)
+            except ReturnValue as returned:
+                return returned.value
+            finally:
+                call_depth[0] -= 1
+            return value if should_auto_return else None
+
+        function = Function(name, invoke)
+        if name is None:
+            return lambda frame: function
+        if name in scope:
+            slot = scope[name]
+
+            def define_local(frame):
+                frame[slot] = function
+                return function
+            return define_local
+
+        variables = self.variables
+        idx = self.variable(name)
+
+        def define(frame):
+            variables[idx] = function
+            return function
+        return define
+
+    def compile_CallNode(self, node, scope):
+        args = tuple(self.compile(arg_node, scope) for arg_node in node.arg_nodes)
+        callee = self.compile(node.node_to_call, scope)
+
+        def call(frame):
+            values = [arg(frame) for arg in args]
+            function = callee(frame)
+            if function.__class__ is not Function:
+                raise MiniRuntimeError(RTError(f'{function!r} is not a function',
+                                               pos_start=node.pos_start, pos_end=node.pos_end))
+            return function.invoke(values)
+        return call
+
+    def compile_ReturnNode(self, node, scope):
+        value_closure = (self.compile(node.node_to_return, scope)
+                         if node.node_to_return else lambda frame: None)
+
+        def return_value(frame):
+            raise ReturnValue(value_closure(frame))
+        return return_value
+
+    def compile_ContinueNode(self, node, scope):
+        if not self.loop_depth:
+            return lambda frame: None
+
+        def continue_loop(frame):
+            raise ContinueLoop()
+        return continue_loop
+
+    def compile_BreakNode(self, node, scope):
+        if not self.loop_depth:
+            return lambda frame: None
+
+        def break_loop(frame):
+            raise BreakLoop()
+        return break_loop
+
+
+def compile_closures(ast):
+    # The function that runs the program, compiled once and run any number
+    # of times. It gives the variables the program ends with, by name.
+    try:
+        return ClosureCompiler().compile_program(ast), None
+    except RecursionError:
+        return None, RTError('The program is nested too deeply to be compiled to closures',
+                             pos_start=ast.pos_start, pos_end=ast.pos_end)
+
+
+def run_closures(ast):
+    run, error = compile_closures(ast)
+    if error:
+        return None, error
+    return run()
@@ -0,0 +1,463 @@
+from array import array
+from bisect import bisect_left
+
+"""
+    This document contains the following:
+    1. The opcodes, operands and SWITCH tables of the three address code
+    2. Program class
+    3. IRBuilder class
+    4. The printer of the three address code
+
+    An instruction is a quadruple (opcode, dest, arg1, arg2). Operands are
+    integers tagged with the namespace they belong to: temporaries, variables,
+    constants or labels. Variables and constants are indexes into the pools
+    of the program, temporaries and labels are their number.
+"""
+
+
+# OPCODES
+
+OP_MOVE = 0             # dest = arg1
+OP_ADD = 1              # dest = arg1 + arg2
+OP_SUB = 2
+OP_MUL = 3
+OP_DIV = 4
+OP_POW = 5
+OP_EQ = 6
+OP_NE = 7
+OP_LT = 8
+OP_GT = 9
+OP_LTE = 10
+OP_GTE = 11
+OP_NEG = 12             # dest = -arg1
+OP_POS = 13             # dest = +arg1
+OP_LABEL = 14           # dest:
+OP_GOTO = 15            # goto dest
+OP_IF_FALSE = 16        # if !arg1 goto dest
+OP_IF_GREATER = 17      # if arg1 > arg2 goto dest
+OP_FUNC_START = 18      # func_start arg1, arg1 is NONE for anonymous functions
+OP_ARG = 19             # arg arg1
+OP_FUNC_END = 20        # func_end
+OP_PARAM = 21           # an argument of the CALL that follows the PARAMs
+OP_CALL = 22            # dest = CALL arg1 with the preceding PARAMs
+OP_RETURN = 23          # RETURN arg1
+OP_IF_TRUE = 24         # if arg1 goto dest
+OP_SWITCH = 25          # goto the label of arg1 in the table arg2, else dest
+
+OPCODE_NAMES = [
+    'MOVE', 'ADD', 'SUB', 'MUL', 'DIV', 'POW', 'EQ', 'NE', 'LT', 'GT', 'LTE',
+    'GTE', 'NEG', 'POS', 'LABEL', 'GOTO', 'IF_FALSE', 'IF_GREATER',
+    'FUNC_START', 'ARG', 'FUNC_END', 'PARAM', 'CALL', 'RETURN', 'IF_TRUE',
+    'SWITCH',
+]
+
+BINARY_OPCODES = {
+    '+': OP_ADD,
+    '-': OP_SUB,
+    '*': OP_MUL,
+    '/': OP_DIV,
+    '^': OP_POW,
+    '==': OP_EQ,
+    '!=': OP_NE,
+    '<': OP_LT,
+    '>': OP_GT,
+    '<=': OP_LTE,
+    '>=': OP_GTE,
+}
+
+OPCODE_SYMBOLS = {opcode: symbol for symbol, opcode in BINARY_OPCODES.items()}
+OPCODE_SYMBOLS[OP_NEG] = '-'
+OPCODE_SYMBOLS[OP_POS] = '+'
+
+JUMP_OPCODES = frozenset([OP_GOTO, OP_IF_FALSE, OP_IF_GREATER, OP_IF_TRUE,
+                          OP_SWITCH])
+
+
+# OPERANDS
+
+KIND_TEMP = 0
+KIND_VAR = 1
+KIND_CONST = 2
+KIND_LABEL = 3
+
+NONE = -1
+
+
+def temp(number):
+    return number << 2 | KIND_TEMP
+
+
+def label(number):
+    return number << 2 | KIND_LABEL
+
+
+def operand_kind(operand):
+    return operand & 3
+
+
+def operand_index(operand):
+    return operand >> 2
+
+
+# SWITCH TABLES
+# The table of a SWITCH is a constant: a tuple of (value, label) pairs,
+# sorted by their integer values. A value equal to one of them, as with ==,
+# goes to its label, any other value to the dest of the SWITCH.
+
+# The tables with fewer values than this per slot between their lowest and
+# highest value are searched instead of indexed
+MIN_TABLE_DENSITY = 0.5
+
+
+def switch_lookup(table):
+    # A function giving the label a value goes to in the table, or None. A
+    # dense table is indexed, a sparse one binary searched.
+    values = [value for value, label in table]
+    low = values[0]
+    high = values[-1]
+
+    if len(values) >= MIN_TABLE_DENSITY * (high - low + 1):
+        slots = [None] * (high - low + 1)
+        for value, label in table:
+            slots[value - low] = label
+
+        def find(value):
+            if value.__class__ is int or value.__class__ is float:
+                if low <= value <= high and value == int(value):
+                    return slots[int(value) - low]
+            return None
+    else:
+        labels = [label for value, label in table]
+
+        def find(value):
+            if value.__class__ is int or value.__class__ is float:
+                idx = bisect_left(values, value)
+                if idx < len(values) and values[idx] == value:
+                    return labels[idx]
+            return None
+    return find
+
+
+# LAYOUT
+# Only read by the printer, so that the code generated for each node keeps
+# the spacing it always had. The blank lines after an instruction are
+# counted in the bits above the flags.
+
+SPACE_BEFORE = 1
+SPACE_AFTER = 2
+BARE_LABEL = 4
+LINE_BEFORE = 8
+LINES_AFTER_SHIFT = 4
+LAYOUT_FLAGS = (1 << LINES_AFTER_SHIFT) - 1
+
+MAX_LINES_AFTER = 15
+
+
+def add_blank_lines(layout, count):
+    lines = min((layout >> LINES_AFTER_SHIFT) + count, MAX_LINES_AFTER)
+    return layout & LAYOUT_FLAGS | lines << LINES_AFTER_SHIFT
+
+
+# Stands for a blank line in the code built by the nodes
+BLANK_LINE = None
+
+# The variable an anonymous function is stored in when its value is used.
+# Mini cannot spell it, so it never clashes with a variable of the program.
+ANONYMOUS_FUNCTION_VARIABLE = '<anonymous>'
+
+# Completes the instruction tuples of the nodes, which leave out the
+# trailing operands they do not use
+PADDING = [(), (NONE, NONE, NONE, 0), (NONE, NONE, 0), (NONE, 0), (0,), ()]
+
+
+"""Program class
+
+    Description:
+        The instructions of a program in parallel arrays, one entry per
+        instruction, along with the pools of variable names and constants
+        their operands refer to.
+
+    Attributes:
+        opcodes (array): The opcode of each instruction
+        dests (array): The dest operand of each instruction
+        arg1s (array): The first argument of each instruction
+        arg2s (array): The second argument of each instruction
+        layouts (array): How each instruction is printed
+        names (list): Variable names, indexed by the VAR operands
+        constants (list): Constant values, indexed by the CONST operands
+        number_count (int): Temporaries and labels numbered so far
+        stack_base (int): The first temporary that is a stack slot, printed
+            s0, s1 and so on, or None
+
+    Returns:
+        Program: A Program object
+"""
+
+
+class Program:
+    def __init__(self):
+        self.opcodes = array('B')
+        self.dests = array('q')
+        self.arg1s = array('q')
+        self.arg2s = array('q')
+        self.layouts = array('B')
+
+        self.names = []
+        self.name_ids = {}
+        self.constants = []
+        self.constant_ids = {}
+        self.number_count = 0
+        self.stack_base = None
+
+    def __len__(self):
+        return len(self.opcodes)
+
+    def derive(self):
+        # An empty program sharing the pools and the numbering of this one,
+        # for the passes that rewrite it
+        program = Program()
+        program.names = self.names
+        program.name_ids = self.name_ids
+        program.constants = self.constants
+        program.constant_ids = self.constant_ids
+        program.number_count = self.number_count
+        return program
+
+    def new_number(self):
+        self.number_count += 1
+        return self.number_count - 1
+
+    def var(self, name):
+        idx = self.name_ids.get(name)
+        if idx is None:
+            idx = self.name_ids[name] = len(self.names)
+            self.names.append(name)
+        return idx << 2 | KIND_VAR
+
+    def const(self, value):
+        # 1 and 1.0 are equal, but not the same constant. Neither are 0.0
+        # and -0.0, which only their repr tells apart.
+        key = (float, repr(value)) if type(value) is float else (type(value), value)
+        idx = self.constant_ids.get(key)
+        if idx is None:
+            idx = self.constant_ids[key] = len(self.constants)
+            self.constants.append(value)
+        return idx << 2 | KIND_CONST
+
+    def append(self, opcode, dest=NONE, arg1=NONE, arg2=NONE, layout=0):
+        self.opcodes.append(opcode)
+        self.dests.append(dest)
+        self.arg1s.append(arg1)
+        self.arg2s.append(arg2)
+        self.layouts.append(layout)
+
+    def extend_code(self, code):
+        # code is an instruction tuple, a BLANK_LINE or a list of code.
+        # The instructions are gathered first and added column by column.
+        instructions = []
+        stack = [code]
+
+        while stack:
+            part = stack.pop()
+            if part.__class__ is tuple:
+                instructions.append(part + PADDING[len(part)])
+            elif part is BLANK_LINE:
+                if instructions:
+                    last = instructions[-1]
+                    instructions[-1] = last[:4] + \
+                        (add_blank_lines(last[4], 1),)
+                else:
+                    self.add_blank_lines(1)
+            else:
+                stack.extend(reversed(part))
+
+        if instructions:
+            opcodes, dests, arg1s, arg2s, layouts = zip(*instructions)
+            self.opcodes.extend(opcodes)
+            self.dests.extend(dests)
+            self.arg1s.extend(arg1s)
+            self.arg2s.extend(arg2s)
+            self.layouts.extend(layouts)
+
+    def add_blank_lines(self, count):
+        # After the last instruction, if there is one
+        if count and self.layouts:
+            self.layouts[-1] = add_blank_lines(self.layouts[-1], count)
+
+    def instruction(self, idx):
+        return (self.opcodes[idx], self.dests[idx], self.arg1s[idx], self.arg2s[idx])
+
+    def clear(self):
+        # The pools are kept, so the operands already handed out stay valid
+        del self.opcodes[:]
+        del self.dests[:]
+        del self.arg1s[:]
+        del self.arg2s[:]
+        del self.layouts[:]
+
+    def __repr__(self):
+        return '\n'.join(
+            f'{idx}: {OPCODE_NAMES[self.opcodes[idx]]} '
+            f'{self.format_operand(self.dests[idx])}, '
+            f'{self.format_operand(self.arg1s[idx])}, '
+            f'{self.format_operand(self.arg2s[idx])}'
+            for idx in range(len(self)))
+
+    def format_operand(self, operand, bare_label=False):
+        if operand == NONE:
+            return '_'
+
+        kind = operand & 3
+        idx = operand >> 2
+        if kind == KIND_TEMP:
+            if self.stack_base is not None and idx >= self.stack_base:
+                return f's{idx - self.stack_base}'
+            return f't{idx}'
+        if kind == KIND_VAR:
+            return self.names[idx]
+        if kind == KIND_CONST:
+            value = self.constants[idx]
+            if value is None:
+                return 'null'
+            return f'"{value}"' if isinstance(value, str) else f'{value}'
+        return f'{idx}' if bare_label else f'L{idx}'
+
+
+"""IRBuilder class
+
+    Description:
+        Hands out the operands the nodes of the AST need while they build
+        their code. Temporaries and labels are numbered from the single
+        counter of the program, in the order the nodes ask for them.
+
+    Arguments:
+        program (Program): The program the operands belong to
+        jump_tables (bool): Whether an IF/ELIF ladder over one variable
+            becomes a SWITCH
+
+    Attributes:
+        loops (list): The (continue label, break label) of the loops the
+            node being built is in, innermost last. A function body starts
+            with None, as BREAK and CONTINUE do not leave the function.
+
+    Returns:
+        IRBuilder: An IRBuilder object
+"""
+
+
+class IRBuilder:
+    def __init__(self, program, jump_tables=True):
+        self.program = program
+        self.jump_tables = jump_tables
+        self.next_number = program.new_number
+        self.var = program.var
+        self.const = program.const
+        self.loops = []
+        # Whether the node being generated must leave its value in the last
+        # temporary, see generate_ir
+        self.value_wanted = False
+
+    def new_temp(self):
+        return temp(self.next_number())
+
+    def new_label(self):
+        return label(self.next_number())
+
+    def current_temp(self):
+        return temp(self.program.number_count - 1)
+
+
+# PRINTER
+# The fields are the dest, arg1 and arg2 operands, then the PARAMs of a CALL
+
+FORMATS = {
+    OP_MOVE: '{0} = {1}',
+    OP_NEG: '{0} = -{1}',
+    OP_POS: '{0} = +{1}',
+    OP_LABEL: '{0}:',
+    OP_GOTO: 'goto {0}',
+    OP_IF_FALSE: 'if !{1} goto {0}',
+    OP_IF_GREATER: 'if {1} > {2} goto {0}',
+    OP_IF_TRUE: 'if {1} goto {0}',
+    OP_SWITCH: 'switch {1} [{2}] else {0}',
+    OP_FUNC_START: '\n\nfunc_start {1}',
+    OP_ARG: 'arg {1}',
+    OP_FUNC_END: 'func_end\n\n',
+    OP_CALL: '{0} = CALL {1} {3}',
+    OP_RETURN: 'RETURN {1}',
+}
+
+for symbol, opcode in BINARY_OPCODES.items():
+    FORMATS[opcode] = '{0} = {1} ' + symbol + ' {2}'
+
+SYMBOLS = [OPCODE_SYMBOLS.get(opcode) for opcode in range(len(OPCODE_NAMES))]
+
+
+def write_program(program, write, start=0, end=None):
+    # Writes the instructions from start on, up to end, in the text format
+    # of the intermediate code
+    constants = program.constants
+    opcodes = program.opcodes
+    dests = program.dests
+    arg1s = program.arg1s
+    arg2s = program.arg2s
+    layouts = program.layouts
+    stack_base = program.stack_base
+    text = program.format_operand
+    params = []
+
+    for idx in range(start, len(opcodes) if end is None else end):
+        opcode = opcodes[idx]
+        layout = layouts[idx]
+
+        # Moves and operations between temporaries make up most programs
+        if opcode <= OP_GTE and not layout and stack_base is None:
+            dest = dests[idx]
+            arg1 = arg1s[idx]
+            dest = f't{dest >> 2}' if dest & 3 == KIND_TEMP else text(dest, False)
+            arg1 = f't{arg1 >> 2}' if arg1 & 3 == KIND_TEMP else text(arg1, False)
+            if opcode == OP_MOVE:
+                write(f'{dest} = {arg1}\n')
+            else:
+                arg2 = arg2s[idx]
+                arg2 = f't{arg2 >> 2}' if arg2 & 3 == KIND_TEMP else text(arg2, False)
+                write(f'{dest} = {arg1} {SYMBOLS[opcode]} {arg2}\n')
+            continue
+
+        if opcode == OP_PARAM:
+            params.append(text(arg1s[idx], False))
+            continue
+
+        bare_label = layout & BARE_LABEL
+        if opcode == OP_FUNC_START and arg1s[idx] == NONE:
+            line = '\n\nfunc_start'
+        elif opcode == OP_RETURN and arg1s[idx] == NONE:
+            line = 'RETURN'
+        elif opcode == OP_CALL:
+            line = FORMATS[opcode].format(
+                text(dests[idx], False), text(arg1s[idx], False), '_',
+                ', '.join(params))
+            params = []
+        elif opcode == OP_SWITCH:
+            table = ', '.join(f'{value}: {text(label, bare_label)}'
+                              for value, label in constants[arg2s[idx] >> 2])
+            line = FORMATS[opcode].format(
+                text(dests[idx], bare_label), text(arg1s[idx], bare_label), table)
+        else:
+            line = FORMATS[opcode].format(
+                text(dests[idx], bare_label), text(arg1s[idx], bare_label),
+                text(arg2s[idx], bare_label))
+
+        if layout & SPACE_BEFORE:
+            line = ' ' + line
+        if layout & SPACE_AFTER:
+            line += ' '
+        if layout & LINE_BEFORE:
+            line = '\n' + line
+        write(line + '\n' * (1 + (layout >> LINES_AFTER_SHIFT)))
+
+
+def format_program(program, start=0):
+    lines = []
+    write_program(program, lines.append, start)
+    return ''.join(lines)
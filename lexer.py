@@ -1,11 +1,15 @@
 from position import *
 from constants import *
 from error import *
+from array import array
+import re
 
 """
     This file contains the following:
     1. Token class
     2. Lexer class
+    3. RegexLexer class
+    4. TokenStream class
 """
 
 
@@ -13,6 +17,8 @@ from error import *
         
     Description:
         This class is used to represent a token.
+        The token only keeps the offsets of its first and last character in
+        the source file; pos_start and pos_end are built when asked for.
         
     Arguments:
         type_ (_type_): The type of the token.
@@ -26,17 +32,45 @@ from error import *
 
 
 class Token:
+    __slots__ = ('type', 'value', 'idx_start', 'idx_end', 'src')
+
     def __init__(self, type_, value=None, pos_start=None, pos_end=None):
         self.type = type_
         self.value = value
+        self.idx_start = None
+        self.idx_end = None
+        self.src = None
 
         if pos_start:
-            self.pos_start = pos_start.copy()
-            self.pos_end = pos_start.copy()
-            self.pos_end.advance()
+            self.idx_start = pos_start.idx
+            self.idx_end = pos_start.idx + 1
+            self.src = pos_start.src
 
         if pos_end:
-            self.pos_end = pos_end.copy()
+            self.idx_end = pos_end.idx
+
+    @classmethod
+    def from_offsets(cls, type_, value, idx_start, idx_end, src):
+        token = cls.__new__(cls)
+        token.type = type_
+        token.value = value
+        token.idx_start = idx_start
+        token.idx_end = idx_end
+        token.src = src
+        return token
+
+    @property
+    def pos_start(self):
+        if self.src is None:
+            return None
+        return Position(self.idx_start, self.src)
+
+    @property
+    def pos_end(self):
+        if self.src is None:
+            return None
+        # The end of a token is on the line of its last character
+        return Position(self.idx_end, self.src, self.idx_end - 1)
 
     def matches(self, type_, value):
         return self.type == type_ and self.value == value
@@ -65,7 +99,8 @@ class Lexer:
     def __init__(self, fn, text):
         self.fn = fn
         self.text = text
-        self.pos = Position(-1, 0, -1, fn, text)
+        self.src = SourceFile(fn, text)
+        self.pos = Position(-1, self.src)
         self.current_char = None
         self.advance()
 
@@ -140,6 +175,12 @@ class Lexer:
         tokens.append(Token(TT_EOF, pos_start=self.pos))
         return tokens, None
 
+    def make_token_stream(self):
+        tokens, error = self.make_tokens()
+        if error:
+            return None, error
+        return TokenStream.from_tokens(self.src, tokens), None
+
     def make_number(self):
         num_str = ''
         dot_count = 0
@@ -257,3 +298,265 @@ class Lexer:
             self.advance()
 
         self.advance()
+
+
+"""RegexLexer class
+
+    Description:
+        A drop-in replacement for the Lexer class. Instead of walking the input
+        one character at a time, it matches every token with a single compiled
+        alternation pattern. The token stream, positions and errors are the
+        same as the ones produced by the Lexer class.
+
+        The only intended difference is a comment on the last line without a
+        trailing newline, which the Lexer class never finishes scanning.
+
+    Arguments:
+        fn (str): The file name.
+        text (str): The input string.
+
+    Returns:
+        RegexLexer: A lexer object.
+"""
+
+
+class RegexLexer:
+    # The group numbers below are the order of the groups in the pattern
+    WHITESPACE, COMMENT, NEWLINE, NUMBER, IDENTIFIER, STRING, OPERATOR, NOT_EQUALS, ILLEGAL = range(
+        1, 10)
+
+    pattern = re.compile(r'''
+        ([ \t]+)
+      | (\#[^\n]*\n?)
+      | ([;\n])
+      | ([0-9]+(?:\.[0-9]*)?)
+      | ([A-Za-z][A-Za-z0-9_]*)
+      | ("[^"]*"?)
+      | (->|==|<=|>=|!=|[-+*/^()\[\],=<>])
+      | (!)
+      | (.)
+    ''', re.VERBOSE | re.DOTALL)
+
+    operators = {
+        '+': TT_PLUS,
+        '-': TT_MINUS,
+        '*': TT_MUL,
+        '/': TT_DIV,
+        '^': TT_POW,
+        '(': TT_LPAREN,
+        ')': TT_RPAREN,
+        '[': TT_LSQUARE,
+        ']': TT_RSQUARE,
+        ',': TT_COMMA,
+        '=': TT_EQ,
+        '<': TT_LT,
+        '>': TT_GT,
+        '->': TT_ARROW,
+        '==': TT_EE,
+        '!=': TT_NE,
+        '<=': TT_LTE,
+        '>=': TT_GTE,
+    }
+
+    # The same tokens, matched directly in the bytes of a mapped file
+    byte_pattern = re.compile(pattern.pattern.encode(), pattern.flags & ~re.UNICODE)
+    byte_operators = {op.encode(): tok_type for op, tok_type in operators.items()}
+
+    keywords = frozenset(KEYWORDS)
+
+    def __init__(self, fn, text, src=None):
+        self.fn = fn
+        self.text = text
+        self.src = src or SourceFile(fn, text)
+        self.error = None
+
+    def scan(self):
+        # Yields (type, value, idx_start, idx_end) for every token, ending
+        # with EOF. On an error self.error is set and the scan stops early.
+        text = self.text
+        src = self.src
+        keywords = self.keywords
+        eof_idx = len(text)
+
+        if isinstance(text, str):
+            pattern = self.pattern
+            operators = self.operators
+            decode = str
+        else:
+            pattern = self.byte_pattern
+            operators = self.byte_operators
+            decode = self.decode
+
+        for match in pattern.finditer(text):
+            kind = match.lastindex
+            if kind == self.WHITESPACE or kind == self.COMMENT:
+                continue
+
+            idx, end = match.span()
+
+            if kind == self.IDENTIFIER:
+                id_str = decode(match.group(kind))
+                yield (TT_KEYWORD if id_str in keywords else TT_IDENTIFIER), id_str, idx, end
+            elif kind == self.OPERATOR:
+                yield operators[match.group(kind)], None, idx, end
+            elif kind == self.NUMBER:
+                num_str = decode(match.group(kind))
+                if '.' in num_str:
+                    yield TT_FLOAT, float(num_str), idx, end
+                else:
+                    yield TT_INT, int(num_str), idx, end
+            elif kind == self.NEWLINE:
+                yield TT_NEWLINE, None, idx, end
+            elif kind == self.STRING:
+                string = decode(match.group(kind))
+                if string[-1] == '"' and len(string) > 1:
+                    string = string[1:-1]
+                else:
+                    # An unterminated string also skips past the end of the text
+                    string = string[1:]
+                    end += 1
+                    eof_idx = end
+                yield TT_STRING, string.replace('\\', ''), idx, end
+            elif kind == self.NOT_EQUALS:
+                # The character after '!' is skipped along with it
+                self.error = ExpectedCharError(
+                    Position(idx, src), Position(end + 1, src), "'=' (after '!')")
+                return
+            else:
+                char = match.group(kind)
+                if not isinstance(char, str):
+                    # A character outside ASCII takes several bytes
+                    char, end = self.decode_char(text, idx)
+                self.error = IllegalCharError(
+                    Position(idx, src), Position(end, src, idx), "'" + char + "'")
+                return
+
+        yield TT_EOF, None, eof_idx, eof_idx + 1
+
+    @staticmethod
+    def decode(data):
+        return data.decode('utf-8', errors='replace')
+
+    @staticmethod
+    def decode_char(data, idx):
+        # The character that starts at idx in UTF-8 bytes, and the offset
+        # after it
+        for end in range(idx + 1, min(idx + 4, len(data)) + 1):
+            try:
+                return data[idx:end].decode('utf-8'), end
+            except UnicodeDecodeError:
+                pass
+        return '\ufffd', idx + 1
+
+    def iter_tokens(self):
+        src = self.src
+        make_token = Token.from_offsets
+        for type_, value, idx_start, idx_end in self.scan():
+            yield make_token(type_, value, idx_start, idx_end, src)
+
+    def make_tokens(self):
+        src = self.src
+        make_token = Token.from_offsets
+        tokens = [make_token(type_, value, idx_start, idx_end, src)
+                  for type_, value, idx_start, idx_end in self.scan()]
+        if self.error:
+            return [], self.error
+        return tokens, None
+
+    def make_token_stream(self):
+        stream = TokenStream(self.src)
+        stream.extend(self.scan())
+        if self.error:
+            return None, self.error
+        return stream, None
+
+
+"""TokenStream class
+
+    Description:
+        A compact replacement for the list of tokens returned by make_tokens.
+        Tokens are stored column by column in arrays: the type code, the start
+        and end offsets, and an index into a table of the distinct values.
+        Indexing the stream builds a Token, so the Parser can read it exactly
+        like a list of tokens.
+
+    Arguments:
+        src (SourceFile): The source file the tokens were read from.
+
+    Returns:
+        TokenStream: A token stream object.
+"""
+
+
+class TokenStream:
+    type_codes = {type_: code for code, type_ in enumerate(TOKEN_TYPES)}
+
+    def __init__(self, src):
+        self.src = src
+        self.types = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.value_ids = array('I')
+
+        # Values are interned per token type, so INT 1 and FLOAT 1.0 stay apart
+        self.values = [None]
+        self.value_index = {}
+
+    @classmethod
+    def from_tokens(cls, src, tokens):
+        stream = cls(src)
+        stream.extend((tok.type, tok.value, tok.idx_start, tok.idx_end)
+                      for tok in tokens)
+        return stream
+
+    def append(self, type_, value, idx_start, idx_end):
+        self.extend(((type_, value, idx_start, idx_end), ))
+
+    def extend(self, raw_tokens):
+        type_codes = self.type_codes
+        values = self.values
+        value_index = self.value_index
+        append_type = self.types.append
+        append_start = self.starts.append
+        append_end = self.ends.append
+        append_value_id = self.value_ids.append
+
+        for type_, value, idx_start, idx_end in raw_tokens:
+            if value is None:
+                value_id = 0
+            else:
+                key = (type_, value)
+                value_id = value_index.get(key)
+                if value_id is None:
+                    value_id = value_index[key] = len(values)
+                    values.append(value)
+
+            append_type(type_codes[type_])
+            append_start(idx_start)
+            append_end(idx_end)
+            append_value_id(value_id)
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, idx):
+        return Token.from_offsets(
+            TOKEN_TYPES[self.types[idx]],
+            self.values[self.value_ids[idx]],
+            self.starts[idx],
+            self.ends[idx],
+            self.src
+        )
+
+    def __iter__(self):
+        for idx in range(len(self.types)):
+            yield self[idx]
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+LEXERS = {
+    'classic': Lexer,
+    'regex': RegexLexer,
+}
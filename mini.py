@@ -3,16 +3,27 @@ from position import *
 from constants import *
 from lexer import *
 from parser import *
+from optimizer import optimize, allocate_temps, MAX_OPTIMIZATION_LEVEL
+from vm import load_program, execute
+from evaluator import walk_program, compile_closures
+from backend import compile_python, execute_python
+from cache import CompileCache, cache_for, CACHE_DIRECTORY
+import time
 
 """Mini
         Description:
             This is the main file of the Mini programming language.
             It puts together the lexer, parser, and intermediate code generator.
             It contains the following:
-                1. IntermediateCodeGenerator class
-                2. run_lexer function
-                3. run_parser function
-                4. run_intermediate_code_generator function
+                1. CodeBuffer class
+                2. IntermediateCodeGenerator class
+                3. CompileSession class
+                4. run_lexer function
+                5. run_parser function
+                6. run_intermediate_code_generator function
+                7. run_program function
+                8. stream_intermediate_code function
+                9. write_intermediate_code function
 
 """
 
@@ -20,22 +31,387 @@ from parser import *
 # ===============================================================================
 # INTERMEDIATE CODE GENERATOR
 # ===============================================================================
+"""CodeBuffer class
+
+    Description:
+        Collects the fragments of the intermediate code in a list and joins
+        them once, when the code is asked for. Any object with a write
+        method, such as an open text file, can be used in its place.
+
+    Returns:
+        CodeBuffer: A CodeBuffer object
+"""
+
+
+class CodeBuffer:
+    def __init__(self):
+        self.fragments = []
+        self.write = self.fragments.append
+
+    def getvalue(self):
+        return ''.join(self.fragments)
+
+
+"""IntermediateCodeGenerator class
+
+    Description:
+        Builds the three address code of an AST into a Program, and prints it
+        in the text format of the intermediate code.
+
+    Arguments:
+        ast: The root node of the AST, or None.
+        jump_tables (bool): Whether IF/ELIF ladders over one variable
+            become SWITCH instructions.
+
+    Attributes:
+        program (Program): The instructions built so far.
+
+    Returns:
+        IntermediateCodeGenerator: An IntermediateCodeGenerator object
+"""
+
+
 class IntermediateCodeGenerator:
-    def __init__(self, ast):
-        self.temp_counter = 0
+    def __init__(self, ast, jump_tables=True):
         self.ast = ast
+        self.program = Program()
+        self.builder = IRBuilder(self.program, jump_tables)
 
     def get_next_temp_var(self):
-        self.temp_counter += 1
-        return self.temp_counter - 1
+        return self.builder.next_number()
 
     def get_current_temp(self):
-        return self.temp_counter - 1
+        return self.program.number_count - 1
 
-    def generate_intermediate_code(self):
+    def statements(self):
         if self.ast == None:
-            return ''
-        return self.ast.get_ic(self.get_next_temp_var, self.get_current_temp)
+            return []
+        if isinstance(self.ast, ListNode):
+            return self.ast.element_nodes
+        return [self.ast]
+
+    def generate_ir(self):
+        for node in self.statements():
+            self.generate_node_ir(node)
+        return self.program
+
+    def generate_node_ir(self, node):
+        # Temporaries keep counting up across calls, so the code of the
+        # statements of a program can be generated one at a time
+        self.program.extend_code(generate_ir(node, self.builder))
+
+    def generate_intermediate_code(self):
+        buffer = CodeBuffer()
+        self.emit_intermediate_code(buffer)
+        return buffer.getvalue()
+
+    def emit_intermediate_code(self, out):
+        # The code of each top level statement is written as soon as it is
+        # generated, so the text of a program is never held in memory
+        for node in self.statements():
+            self.emit_node_code(node, out)
+
+    def generate_node_code(self, node):
+        start = len(self.program)
+        self.generate_node_ir(node)
+        return format_program(self.program, start)
+
+    def emit_node_code(self, node, out):
+        start = len(self.program)
+        self.generate_node_ir(node)
+        write_program(self.program, out.write, start)
+
+    def generate_statement_ir(self, node, opt_level=0):
+        # The code of a single statement, in a program of its own that is
+        # optimized on its own. The numbering carries on from the statements
+        # before it, but the names and constants start over, so neither
+        # self.program nor its pools grow with the file.
+        program = Program()
+        program.number_count = self.program.number_count
+        program.extend_code(generate_ir(node, IRBuilder(program, self.builder.jump_tables)))
+        program = optimize(program, opt_level)
+        self.program.number_count = program.number_count
+        return program
+
+
+# ===============================================================================
+# COMPILE SESSION
+# ===============================================================================
+PHASE_LEXER = 'lexer'
+PHASE_PARSER = 'parser'
+PHASE_ICG = 'icg'
+
+PHASES = [PHASE_LEXER, PHASE_PARSER, PHASE_ICG]
+
+# Timed, but not phases the compiler can stop after
+PHASE_OPTIMIZER = 'optimizer'
+PHASE_CACHE = 'cache'
+
+# What a session keeps in its cache, each with the options it depends on
+ARTIFACT_TOKENS = 'tokens'
+ARTIFACT_AST = 'ast'
+ARTIFACT_IR = 'ir'
+
+# The ways to run a program, timed as phases of their own. The register
+# machine runs the intermediate code, the others the tree.
+ENGINE_VM = 'vm'
+ENGINE_CLOSURES = 'closures'
+ENGINE_TREE = 'tree'
+ENGINE_PYTHON = 'python'
+
+ENGINES = [ENGINE_VM, ENGINE_CLOSURES, ENGINE_TREE, ENGINE_PYTHON]
+
+
+"""PhaseTiming class
+
+    Description:
+        Wall clock and CPU time spent in a single compiler phase, in nanoseconds.
+
+    Attributes:
+        phase (str): The name of the phase.
+        wall_ns (int): Elapsed time measured with time.perf_counter_ns.
+        cpu_ns (int): Process CPU time measured with time.process_time_ns.
+"""
+
+
+class PhaseTiming:
+    def __init__(self, phase, wall_ns, cpu_ns):
+        self.phase = phase
+        self.wall_ns = wall_ns
+        self.cpu_ns = cpu_ns
+
+    def __repr__(self):
+        return f'{self.phase}: wall {self.wall_ns / 1e6:.3f} ms, cpu {self.cpu_ns / 1e6:.3f} ms'
+
+
+"""CompileSession class
+
+    Description:
+        Runs the compiler phases over a single source text. The source is read
+        once, and every phase is fed from the result of the previous one, so
+        the tokens and the AST are produced exactly once per session.
+        Each phase is timed on its own and the timings are kept in the
+        timings dictionary.
+
+    Arguments:
+        fn (str): The file name.
+        text (str): The source text. When omitted the file is read once.
+        lexer (str): The lexer engine, one of the keys of LEXERS.
+        compact_tokens (bool): Keep the tokens in a TokenStream instead of a list.
+        expr_engine (str): The expression parser, one of EXPR_ENGINES.
+        opt_level (int): The optimization level, from 0 (none) to
+            MAX_OPTIMIZATION_LEVEL.
+        reuse_temps (bool): Rename the temporaries of the optimized code to
+            as few slots as their liveness allows.
+        max_temps (int): With reuse_temps, the most temporaries a function
+            may use; the other values go to stack slots.
+        cache (CompileCache): Where the tokens, the AST and the intermediate
+            code are looked up before they are made, and stored after. True
+            is the cache next to the file, None compiles without one.
+
+    Returns:
+        CompileSession: A compile session object.
+"""
+
+
+class CompileSession:
+    def __init__(self, fn, text=None, lexer='regex', compact_tokens=False, expr_engine='pratt',
+                 opt_level=0, reuse_temps=False, max_temps=None, cache=None):
+        self.fn = fn
+        self.lexer = lexer
+        self.lexer_class = LEXERS[lexer]
+        self.compact_tokens = compact_tokens
+        self.expr_engine = expr_engine
+        self.opt_level = opt_level
+        self.reuse_temps = reuse_temps
+        self.max_temps = max_temps
+        if text is None:
+            with open(fn, 'r') as file:
+                text = file.read()
+        self.text = text
+        self.cache = cache_for(fn) if cache is True else cache
+        self.caching = False
+
+        self.tokens = None
+        self.ast = None
+        self.ir = None
+        self.intermediate_code = None
+        self.error = None
+        self.timings = {}
+        # What allocate_temps reports, once the temporaries are reused
+        self.allocation = {}
+        # What the register machine reports, once the program is executed
+        self.execution = {}
+
+    def timed(self, phase, func):
+        # A phase that runs in several steps is timed as a whole
+        wall_start = time.perf_counter_ns()
+        cpu_start = time.process_time_ns()
+        result = func()
+        wall_ns = time.perf_counter_ns() - wall_start
+        cpu_ns = time.process_time_ns() - cpu_start
+
+        timing = self.timings.get(phase)
+        if timing:
+            timing.wall_ns += wall_ns
+            timing.cpu_ns += cpu_ns
+        else:
+            self.timings[phase] = PhaseTiming(phase, wall_ns, cpu_ns)
+        return result
+
+    def cached(self, artifact, make):
+        # The (result, error) of make, from the cache when the session has
+        # one. The key covers every option the artifact depends on, and the
+        # file name its positions refer to. Only the artifact asked for is
+        # cached, not the ones make needs on the way.
+        if self.cache is None or self.caching:
+            return make()
+
+        options = [self.fn, self.lexer]
+        if artifact == ARTIFACT_TOKENS:
+            options.append(self.compact_tokens)
+        else:
+            options.append(self.expr_engine)
+        if artifact == ARTIFACT_IR:
+            options += [self.opt_level, self.reuse_temps, self.max_temps]
+        key = self.cache.key(self.text, artifact, options)
+
+        entry = self.timed(PHASE_CACHE, lambda: self.cache.load(key))
+        if entry is None:
+            self.caching = True
+            try:
+                entry = make()
+            finally:
+                self.caching = False
+            self.timed(PHASE_CACHE, lambda: self.cache.store(key, entry))
+        return entry
+
+    def lex(self):
+        if self.tokens is None and not self.error:
+            self.tokens, self.error = self.cached(ARTIFACT_TOKENS, self.make_tokens)
+        return self.tokens, self.error
+
+    def make_tokens(self):
+        lexer = self.lexer_class(self.fn, self.text)
+        make_tokens = lexer.make_token_stream if self.compact_tokens else lexer.make_tokens
+        return self.timed(PHASE_LEXER, make_tokens)
+
+    def parse(self):
+        if self.ast is None and not self.error:
+            self.ast, self.error = self.cached(ARTIFACT_AST, self.make_ast)
+        return self.ast, self.error
+
+    def make_ast(self):
+        tokens, error = self.lex()
+        if error:
+            return None, error
+
+        parser = Parser(tokens, self.expr_engine)
+        res = self.timed(PHASE_PARSER, parser.parse)
+        return res.node, res.error
+
+    def generate_intermediate_code(self):
+        if self.intermediate_code is None and not self.error:
+            # The cache keeps the code as a Program, which is printed here
+            if self.opt_level or self.reuse_temps or self.cache:
+                program, error = self.generate_ir()
+                if error:
+                    return None, error
+                self.intermediate_code = self.timed(
+                    PHASE_ICG, lambda: format_program(program))
+                return self.intermediate_code, None
+
+            ast, error = self.parse()
+            if error:
+                return None, error
+
+            icg = IntermediateCodeGenerator(ast)
+            self.intermediate_code = self.timed(
+                PHASE_ICG, icg.generate_intermediate_code)
+            self.ir = icg.program
+        return self.intermediate_code, self.error
+
+    def generate_ir(self):
+        # The code of the program, optimized at the level of the session
+        if self.ir is None and not self.error:
+            result, self.error = self.cached(ARTIFACT_IR, self.make_ir)
+            if result:
+                self.ir, allocation = result
+                self.allocation.update(allocation)
+        return self.ir, self.error
+
+    def make_ir(self):
+        # The program along with what allocate_temps reported about it
+        ast, error = self.parse()
+        if error:
+            return None, error
+
+        icg = IntermediateCodeGenerator(ast)
+        program = self.timed(PHASE_ICG, icg.generate_ir)
+        program = self.timed(
+            PHASE_OPTIMIZER, lambda: optimize(program, self.opt_level))
+        if self.reuse_temps:
+            allocation = {}
+            program = self.timed(PHASE_OPTIMIZER, lambda: allocate_temps(
+                program, self.max_temps, allocation))
+            return (program, allocation), None
+        return (program, {}), None
+
+    def execute(self, engine=ENGINE_VM):
+        # Runs the program with the engine. Returns the variables the program
+        # ends with, by name.
+        if engine != ENGINE_VM:
+            ast, error = self.parse()
+            if error:
+                return None, error
+            if engine == ENGINE_TREE:
+                return self.timed(engine, lambda: walk_program(ast))
+            if engine == ENGINE_PYTHON:
+                compiled, error = self.timed(engine, lambda: compile_python(ast, self.fn))
+                if error:
+                    return None, error
+                return self.timed(engine, lambda: execute_python(compiled, self.fn, ast))
+
+            run, error = self.timed(engine, lambda: compile_closures(ast))
+            if error:
+                return None, error
+            return self.timed(engine, run)
+
+        program, error = self.generate_ir()
+        if error:
+            return None, error
+
+        executable = self.timed(engine, lambda: load_program(program))
+        registers, error = self.timed(
+            engine, lambda: execute(executable, self.execution))
+        if error:
+            return None, error
+        return executable.variables(registers), None
+
+    def write_intermediate_code(self, out):
+        # Like generate_intermediate_code, but the code goes to out as it is
+        # generated and is not kept in the session
+        if self.opt_level or self.reuse_temps or self.cache:
+            program, error = self.generate_ir()
+            if error:
+                return None, error
+            self.timed(PHASE_ICG, lambda: write_program(program, out.write))
+            return None, None
+
+        ast, error = self.parse()
+        if error:
+            return None, error
+
+        icg = IntermediateCodeGenerator(ast)
+        self.timed(PHASE_ICG, lambda: icg.emit_intermediate_code(out))
+        return None, None
+
+    def run(self, stop_after=PHASE_ICG):
+        if stop_after == PHASE_LEXER:
+            return self.lex()
+        if stop_after == PHASE_PARSER:
+            return self.parse()
+        return self.generate_intermediate_code()
 
 
 # ===============================================================================
@@ -43,43 +419,83 @@ class IntermediateCodeGenerator:
 # ===============================================================================
 
 
-def run_lexer(fn, text):
-    # Generate tokens
-    lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    return tokens, error
+# The run functions compile without a cache unless cache is True, for the
+# cache next to the file (see cache_for), or a CompileCache
+
+
+def run_lexer(fn, text, cache=None):
+    return CompileSession(fn, text, cache=cache).lex()
+
+
+def run_parser(fn, text, cache=None):
+    return CompileSession(fn, text, cache=cache).parse()
+
+
+def run_intermediate_code_generator(fn, text, opt_level=0, cache=None):
+    return CompileSession(
+        fn, text, opt_level=opt_level, cache=cache).generate_intermediate_code()
+
+
+def run_program(fn, text, opt_level=0, engine=ENGINE_VM, cache=None):
+    return CompileSession(fn, text, opt_level=opt_level, cache=cache).execute(engine)
 
 
-def run_parser(fn, text):
-    # Generate tokens
-    lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    if error:
-        return None, error
+def stream_statements(fn, expr_engine='pratt'):
+    # Yields every top level statement as soon as it is parsed, or a single
+    # error. The file is memory-mapped and the tokens of each statement are
+    # released once it is parsed, so memory does not grow with the size of
+    # the file. The file is unmapped when the generator finishes or is
+    # closed.
+    with MappedSourceFile(fn) as src:
+        lexer = RegexLexer(fn, src.data, src)
+        tokens = lexer.iter_tokens()
+        statements = StreamingParser(tokens, expr_engine).parse_statements()
 
-    # Generate AST
-    parser = Parser(tokens)
-    ast = parser.parse()
-    return ast.node, ast.error
+        try:
+            for node, error in statements:
+                if error:
+                    # Like the other run functions, report a lexer error
+                    # further down the file before a syntax error
+                    for _ in tokens:
+                        pass
+                # A lexer error ends the tokens early, which the parser only
+                # sees as EOF
+                if lexer.error:
+                    yield None, src.decoded_error(lexer.error)
+                    return
+                if error:
+                    yield None, src.decoded_error(error)
+                    return
+                yield node, None
 
+            if lexer.error:
+                yield None, src.decoded_error(lexer.error)
+        finally:
+            # The scan of the tokens holds on to the mapped file
+            statements.close()
+            tokens.close()
 
-def run_intermediate_code_generator(fn, text):
-    # Generate tokens
-    lexer = Lexer(fn, text)
-    tokens, error = lexer.make_tokens()
-    if error:
-        return None, error
 
-    # Generate AST
-    parser = Parser(tokens)
-    ast = parser.parse()
-    if ast.error:
-        return None, ast.error
+def stream_intermediate_code(fn, expr_engine='pratt', opt_level=0):
+    # Yields the code of every top level statement as soon as it is parsed,
+    # or a single error. Each statement is optimized on its own.
+    icg = IntermediateCodeGenerator(None)
 
-    # Generate Intermediate Code
-    icg = IntermediateCodeGenerator(ast.node)
+    for node, error in stream_statements(fn, expr_engine):
+        if error:
+            yield None, error
+            return
+        yield format_program(icg.generate_statement_ir(node, opt_level)), None
 
-    return icg.generate_intermediate_code(), ast.error
 
+def write_intermediate_code(fn, out, expr_engine='pratt', opt_level=0):
+    # Writes the code of every top level statement to out as soon as it is
+    # parsed. Returns the error that stopped the compilation, if any; the
+    # code of the statements before it has already been written.
+    icg = IntermediateCodeGenerator(None)
 
-# TODO: Fix FOR statement in the ICG
+    for node, error in stream_statements(fn, expr_engine):
+        if error:
+            return error
+        write_program(icg.generate_statement_ir(node, opt_level), out.write)
+    return None
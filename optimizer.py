@@ -0,0 +1,1215 @@
+import operator
+from heapq import heapify, heappop, heappush
+from itertools import count
+from ir import *
+from cfg import load, control_flow, split_blocks, function_of, build_graphs, EXIT
+from ssa import reverse_postorder, dominators
+
+"""
+    This document contains the passes that rewrite the three address code of
+    a Program. Every pass takes a Program and returns a new one, which shares
+    the pools and the numbering of the one it was given.
+
+    1. fold_constants function
+    2. eliminate_dead_code function
+    3. number_values function
+    4. hoist_invariants function
+    5. simplify_algebra function
+    6. reduce_induction_variables function
+    7. allocate_temps function
+    8. optimize function, which runs the passes of an optimization level
+"""
+
+
+# Mini operations on numbers. Comparisons give 1 or 0, division always
+# gives a float.
+NUMBER_OPERATIONS = {
+    OP_ADD: operator.add,
+    OP_SUB: operator.sub,
+    OP_MUL: operator.mul,
+    OP_DIV: operator.truediv,
+    OP_POW: operator.pow,
+    OP_EQ: lambda left, right: int(left == right),
+    OP_NE: lambda left, right: int(left != right),
+    OP_LT: lambda left, right: int(left < right),
+    OP_GT: lambda left, right: int(left > right),
+    OP_LTE: lambda left, right: int(left <= right),
+    OP_GTE: lambda left, right: int(left >= right),
+    OP_NEG: operator.neg,
+    OP_POS: operator.pos,
+}
+
+# Larger powers are left to run time rather than computed while compiling
+MAX_FOLDED_EXPONENT = 64
+
+
+def is_number(value):
+    return type(value) is int or type(value) is float
+
+
+def evaluate(opcode, left, right=None):
+    # Returns the value of a foldable operation, or None when it has to be
+    # left to run time: the operands are not numbers, or it would fail
+    unary = opcode in (OP_NEG, OP_POS)
+    if not is_number(left) or (not unary and not is_number(right)):
+        return None
+    if opcode == OP_POW and abs(right) > MAX_FOLDED_EXPONENT:
+        return None
+
+    try:
+        if unary:
+            value = NUMBER_OPERATIONS[opcode](left)
+        else:
+            value = NUMBER_OPERATIONS[opcode](left, right)
+    except ArithmeticError:
+        return None
+
+    # A negative number to a fractional power is complex
+    return value if is_number(value) else None
+
+
+def jump_labels(constants, opcode, dest, arg2):
+    # The labels a jump may go to: its dest, and the table of a SWITCH
+    if opcode == OP_SWITCH:
+        return [dest] + [label for value, label in constants[arg2 >> 2]]
+    return [dest]
+
+
+def fold_constants(program):
+    # Folds the operations on constants and propagates the constants held by
+    # temporaries and variables through straight-line code. What is known is
+    # forgotten at every label that is still jumped to, at function
+    # boundaries and, for variables, at every CALL.
+    # A conditional jump on constants becomes a goto or is dropped, and the
+    # temporaries that are no longer read once their constant has been
+    # propagated are dropped too.
+    constants = program.constants
+    known = {}
+    # The code around a function definition does not run it, so what was
+    # known before the definition still holds after it
+    outer_known = []
+    instructions = []
+
+    jumps_to = {}
+    for idx in range(len(program)):
+        if program.opcodes[idx] in JUMP_OPCODES:
+            for target in jump_labels(constants, program.opcodes[idx],
+                                      program.dests[idx], program.arg2s[idx]):
+                jumps_to[target] = jumps_to.get(target, 0) + 1
+
+    for idx in range(len(program)):
+        opcode, dest, arg1, arg2 = program.instruction(idx)
+        layout = program.layouts[idx]
+
+        if opcode == OP_LABEL:
+            if jumps_to.get(dest):
+                known.clear()
+        elif opcode == OP_FUNC_START:
+            # A named function is stored in its variable, before and after
+            # its body is skipped
+            if arg1 >= 0:
+                known.pop(arg1, None)
+            outer_known.append(known)
+            known = {}
+        elif opcode == OP_FUNC_END and outer_known:
+            known = outer_known.pop()
+
+        arg1 = known.get(arg1, arg1)
+        arg2 = known.get(arg2, arg2)
+        const1 = arg1 >= 0 and arg1 & 3 == KIND_CONST
+        const2 = arg2 >= 0 and arg2 & 3 == KIND_CONST
+
+        if OP_ADD <= opcode <= OP_GTE and const1 and const2:
+            value = evaluate(
+                opcode, constants[arg1 >> 2], constants[arg2 >> 2])
+            if value is not None:
+                opcode, arg1, arg2 = OP_MOVE, program.const(value), NONE
+        elif (opcode == OP_NEG or opcode == OP_POS) and const1:
+            value = evaluate(opcode, constants[arg1 >> 2])
+            if value is not None:
+                opcode, arg1 = OP_MOVE, program.const(value)
+        elif (opcode == OP_IF_FALSE or opcode == OP_IF_TRUE) and const1 \
+                and is_number(constants[arg1 >> 2]):
+            if bool(constants[arg1 >> 2]) == (opcode == OP_IF_FALSE):
+                opcode = None
+                jumps_to[dest] -= 1
+            else:
+                opcode, arg1 = OP_GOTO, NONE
+        elif opcode == OP_SWITCH and const1 and is_number(constants[arg1 >> 2]):
+            target = switch_lookup(constants[arg2 >> 2])(constants[arg1 >> 2])
+            for label in jump_labels(constants, opcode, dest, arg2):
+                jumps_to[label] -= 1
+            opcode, dest, arg1, arg2 = OP_GOTO, dest if target is None else target, NONE, NONE
+            jumps_to[dest] += 1
+        elif opcode == OP_IF_GREATER and const1 and const2:
+            value = evaluate(OP_GT, constants[arg1 >> 2], constants[arg2 >> 2])
+            if value == 0:
+                opcode = None
+                jumps_to[dest] -= 1
+            elif value == 1:
+                opcode, arg1, arg2 = OP_GOTO, NONE, NONE
+
+        if opcode == OP_CALL:
+            # The function may change any variable
+            for operand in list(known):
+                if operand & 3 == KIND_VAR:
+                    del known[operand]
+
+        if opcode == OP_ARG:
+            known.pop(arg1, None)
+        elif dest >= 0 and dest & 3 != KIND_LABEL:
+            if opcode == OP_MOVE and arg1 >= 0 and arg1 & 3 == KIND_CONST:
+                known[dest] = arg1
+            else:
+                known.pop(dest, None)
+
+        instructions.append((opcode, dest, arg1, arg2, layout))
+
+    # The temporaries still read after propagation
+    read = set()
+    for opcode, dest, arg1, arg2, layout in instructions:
+        read.add(arg1)
+        read.add(arg2)
+
+    result = program.derive()
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if opcode is None or (opcode == OP_MOVE and dest & 3 == KIND_TEMP
+                              and dest not in read and arg1 & 3 == KIND_CONST):
+            # The blank lines after a dropped instruction are kept
+            result.add_blank_lines(layout >> LINES_AFTER_SHIFT)
+        else:
+            result.append(opcode, dest, arg1, arg2, layout)
+    return result
+
+
+# ===============================================================================
+# DEAD CODE
+# ===============================================================================
+# The instructions that only compute their dest
+PURE_OPCODES = frozenset(range(OP_MOVE, OP_POS + 1))
+
+
+def store(program, instructions):
+    result = program.derive()
+    for instruction in instructions:
+        result.append(*instruction)
+    return result
+
+
+def without(instructions, removed):
+    # The blank lines after a removed instruction are kept
+    kept = []
+    for idx, instruction in enumerate(instructions):
+        if idx not in removed:
+            kept.append(instruction)
+        elif kept and instruction[4] >> LINES_AFTER_SHIFT:
+            last = kept[-1]
+            kept[-1] = last[:4] + \
+                (add_blank_lines(last[4], instruction[4] >> LINES_AFTER_SHIFT),)
+    return kept
+
+
+def unreachable(instructions, successors, ends):
+    # The instructions that cannot be reached from the start of the program,
+    # or from the body of a function whose definition is reachable
+    reachable = bytearray(len(instructions))
+    stack = [0] if instructions else []
+
+    while stack:
+        idx = stack.pop()
+        if idx == EXIT or reachable[idx]:
+            continue
+        reachable[idx] = 1
+        stack.extend(successors[idx])
+        if instructions[idx][0] == OP_FUNC_START:
+            stack.append(idx + 1 if idx + 1 < len(instructions) else EXIT)
+            if idx in ends:
+                reachable[ends[idx]] = 1
+
+    return {idx for idx in range(len(instructions)) if not reachable[idx]}
+
+
+def is_name(operand):
+    # Temporaries and variables, the operands liveness is about
+    return operand >= 0 and operand & 3 <= KIND_VAR
+
+
+def dead_stores(instructions, successors, failing=()):
+    # The instructions that only compute a value nobody reads, but the ones
+    # in failing, which may fail at run time and so are kept. Variables are
+    # live wherever the code leaves a function or the program, and a CALL
+    # reads them all, since the function may. Across blocks, liveness is
+    # only tracked for the variables and for the temporaries read in a block
+    # before they are written in it: no other temporary outlives its block.
+    # Sets of these names are kept as bits of an int.
+    bounds, block_of = split_blocks(instructions, successors)
+
+    global_ids = {}
+    for start, end in bounds:
+        defined = set()
+        for opcode, dest, arg1, arg2, layout in instructions[start:end]:
+            for operand in (arg1, arg2, dest):
+                if is_name(operand) and (operand & 3 == KIND_VAR or
+                                         (operand != dest and operand not in defined)):
+                    global_ids.setdefault(operand, len(global_ids))
+            defined.add(dest)
+
+    all_vars = 0
+    for operand, gid in global_ids.items():
+        if operand & 3 == KIND_VAR:
+            all_vars |= 1 << gid
+
+    uses = []
+    kills = []
+    for start, end in bounds:
+        use = 0
+        kill = 0
+        for opcode, dest, arg1, arg2, layout in instructions[start:end]:
+            for operand in (arg1, arg2):
+                if operand in global_ids:
+                    use |= 1 << global_ids[operand] & ~kill
+            if opcode == OP_CALL:
+                use |= all_vars & ~kill
+            if dest in global_ids:
+                kill |= 1 << global_ids[dest]
+        uses.append(use)
+        kills.append(kill)
+
+    block_count = len(bounds)
+    block_successors = []
+    predecessors = [[] for _ in range(block_count)]
+    exits = bytearray(block_count)
+    for block, (start, end) in enumerate(bounds):
+        targets = []
+        for target in successors[end - 1]:
+            if target == EXIT:
+                exits[block] = 1
+            else:
+                targets.append(block_of[target])
+                predecessors[block_of[target]].append(block)
+        block_successors.append(targets)
+
+    live_in = [0] * block_count
+    live_out = [0] * block_count
+    worklist = list(range(block_count))
+    queued = bytearray([1]) * block_count
+    while worklist:
+        block = worklist.pop()
+        queued[block] = 0
+        out = all_vars if exits[block] else 0
+        for target in block_successors[block]:
+            out |= live_in[target]
+        live_out[block] = out
+        new_in = uses[block] | out & ~kills[block]
+        if new_in != live_in[block]:
+            live_in[block] = new_in
+            for predecessor in predecessors[block]:
+                if not queued[predecessor]:
+                    queued[predecessor] = 1
+                    worklist.append(predecessor)
+
+    dead = set()
+    for block, (start, end) in enumerate(bounds):
+        live_bits = live_out[block]
+        live_locals = set()
+        for idx in range(end - 1, start - 1, -1):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            if is_name(dest):
+                gid = global_ids.get(dest)
+                if gid is None:
+                    live = dest in live_locals
+                    live_locals.discard(dest)
+                else:
+                    live = live_bits >> gid & 1
+                    live_bits &= ~(1 << gid)
+                if not live and opcode in PURE_OPCODES and idx not in failing:
+                    dead.add(idx)
+                    continue
+            if opcode == OP_CALL:
+                live_bits |= all_vars
+            for operand in (arg1, arg2):
+                if is_name(operand):
+                    gid = global_ids.get(operand)
+                    if gid is None:
+                        live_locals.add(operand)
+                    else:
+                        live_bits |= 1 << gid
+    return dead
+
+
+def useless_jumps(instructions, constants):
+    # Jumps to the labels right after them, and labels nothing jumps to
+    jumped_to = set()
+    useless = set()
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if opcode == OP_SWITCH:
+            jumped_to.update(jump_labels(constants, opcode, dest, arg2))
+        elif opcode in JUMP_OPCODES:
+            following = idx + 1
+            while following < len(instructions) and instructions[following][0] == OP_LABEL:
+                if instructions[following][1] == dest:
+                    useless.add(idx)
+                    break
+                following += 1
+            else:
+                jumped_to.add(dest)
+
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if opcode == OP_LABEL and dest not in jumped_to:
+            useless.add(idx)
+    return useless
+
+
+def may_fail(program, types, instruction):
+    # Whether an operation may fail at run time, given the types known
+    # before it. Copies and equality tests never do. The other operations
+    # fail on values that are not numbers, and a mix of a large int and a
+    # float overflows, so arithmetic is only safe on ints. A division may
+    # always fail, and a power is safe for an int to a natural constant.
+    opcode, dest, arg1, arg2, layout = instruction
+    if opcode == OP_MOVE or opcode == OP_EQ or opcode == OP_NE:
+        return False
+    left = number_type(program, types, arg1)
+    if opcode == OP_NEG or opcode == OP_POS:
+        return left is None
+    right = number_type(program, types, arg2)
+    if left is None or right is None or opcode == OP_DIV:
+        return True
+    if OP_LT <= opcode <= OP_GTE:
+        return False
+    if left != VALUE_INT or right != VALUE_INT:
+        return True
+    if opcode == OP_POW:
+        return arg2 & 3 != KIND_CONST or program.constants[arg2 >> 2] < 0
+    return False
+
+
+def failing_operations(program, instructions):
+    # The indexes of the operations that may fail at run time
+    entries = number_types(program, instructions)
+    types = {}
+    failing = set()
+    for idx, instruction in enumerate(instructions):
+        if idx in entries:
+            types = dict(entries[idx])
+        if instruction[0] in PURE_OPCODES and may_fail(program, types, instruction):
+            failing.add(idx)
+        step_number_types(program, types, instruction)
+    return failing
+
+
+def eliminate_dead_code(program):
+    # Removes unreachable code, dead stores and useless jumps and labels,
+    # until there is nothing left to remove. A dead computation that may
+    # fail is kept, so the program fails as it does without the pass.
+    # Removing code tells nothing new of the types of the code that is
+    # left, so the operations that may fail are found once.
+    instructions = load(program)
+    failing = failing_operations(program, instructions)
+
+    while True:
+        successors, ends = control_flow(instructions, program.constants)
+        removed = unreachable(instructions, successors, ends)
+        if not removed:
+            removed = dead_stores(instructions, successors, failing)
+        if not removed:
+            removed = useless_jumps(instructions, program.constants)
+        if not removed:
+            return store(program, instructions)
+        kept = [idx for idx in range(len(instructions)) if idx not in removed]
+        failing = {new_idx for new_idx, idx in enumerate(kept) if idx in failing}
+        instructions = without(instructions, removed)
+
+
+# ===============================================================================
+# VALUE NUMBERING
+# ===============================================================================
+def number_values(program, eliminated=None):
+    # Local value numbering. Within each basic block, an operation or a
+    # variable load that gives a value already held by a temporary or a
+    # constant reuses it. The temporary it defined is replaced by the earlier
+    # one in the rest of the block, or becomes a copy of it when it is also
+    # read in other blocks. Storing to a variable gives it a new value, and a
+    # CALL forgets the values of all the variables.
+    #
+    # Temporaries written more than once, like the 1 or 0 of an AND, are
+    # left alone. If eliminated is a dict, it gets the number of
+    # computations reused in each function.
+    instructions = load(program)
+    successors, _ = control_flow(instructions, program.constants)
+    bounds, _ = split_blocks(instructions, successors)
+    functions = function_of(program, instructions)
+
+    written = set()
+    written_twice = set()
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if dest >= 0 and dest & 3 == KIND_TEMP:
+            if dest in written:
+                written_twice.add(dest)
+            written.add(dest)
+
+    # The temporaries read in a block before they are written in it
+    read_outside = set()
+    for start, end in bounds:
+        defined = set()
+        for opcode, dest, arg1, arg2, layout in instructions[start:end]:
+            for operand in (arg1, arg2):
+                if operand >= 0 and operand & 3 == KIND_TEMP and operand not in defined:
+                    read_outside.add(operand)
+            defined.add(dest)
+
+    result = []
+    removed = set()
+    for start, end in bounds:
+        value_of = {}       # operand -> value number
+        holder = {}         # value number -> operand that holds it
+        expressions = {}    # (opcode, value numbers) -> value number
+        replaced = {}       # temporary -> operand used in its place
+        numbers = count()
+
+        def value(operand):
+            number = value_of.get(operand)
+            if number is None:
+                number = value_of[operand] = next(numbers)
+                if operand & 3 != KIND_VAR and operand not in written_twice:
+                    holder[number] = operand
+            return number
+
+        for idx in range(start, end):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            arg1 = replaced.get(arg1, arg1)
+            arg2 = replaced.get(arg2, arg2)
+
+            number = None
+            if opcode == OP_MOVE:
+                number = value(arg1)
+            elif opcode in PURE_OPCODES:
+                key = (opcode, value(arg1), value(arg2) if arg2 >= 0 else NONE)
+                number = expressions.get(key)
+                if number is None:
+                    number = expressions[key] = next(numbers)
+            elif opcode == OP_CALL:
+                for operand in list(value_of):
+                    if operand & 3 == KIND_VAR:
+                        del value_of[operand]
+            elif opcode == OP_ARG:
+                value_of.pop(arg1, None)
+
+            if dest < 0 or dest & 3 == KIND_LABEL:
+                result.append((opcode, dest, arg1, arg2, layout))
+                continue
+            if number is None:
+                number = next(numbers)
+            value_of[dest] = number
+
+            earlier = holder.get(number)
+            if (dest & 3 == KIND_TEMP and dest not in written_twice
+                    and earlier is not None and earlier != dest):
+                if dest not in read_outside:
+                    replaced[dest] = earlier
+                    removed.add(len(result))
+                elif opcode != OP_MOVE or arg1 != earlier:
+                    opcode, arg1, arg2 = OP_MOVE, earlier, NONE
+                else:
+                    result.append((opcode, dest, arg1, arg2, layout))
+                    continue
+                if eliminated is not None:
+                    function = functions[idx]
+                    eliminated[function] = eliminated.get(function, 0) + 1
+            elif dest & 3 == KIND_TEMP and dest not in written_twice:
+                holder[number] = dest
+            result.append((opcode, dest, arg1, arg2, layout))
+
+    return store(program, without(result, removed))
+
+
+# ===============================================================================
+# LOOPS
+# ===============================================================================
+def dominates(idom, block, other):
+    while other != block:
+        if other == idom[other]:
+            return False
+        other = idom[other]
+    return True
+
+
+def natural_loops(graph, idom, order):
+    # The blocks of the loop of every header: the header, and the blocks
+    # that reach one of its back edges without going through it
+    loops = {}
+    position = {block: number for number, block in enumerate(order)}
+    for block in order:
+        for header in graph.blocks[block].successors:
+            if header == EXIT or position[header] > position[block] \
+                    or not dominates(idom, header, block):
+                continue
+            body = loops.setdefault(header, {header})
+            stack = [block]
+            while stack:
+                member = stack.pop()
+                if member in body:
+                    continue
+                body.add(member)
+                stack.extend(predecessor for predecessor in graph.blocks[member].predecessors
+                             if idom[predecessor] is not None)
+    return loops
+
+
+def has_preheader(instructions, blocks, header, body):
+    # Whether code put right before the label of the header only runs on
+    # the way into the loop: the block before it falls through to it, and
+    # the loop is entered from nowhere else
+    start = blocks[header].start
+    before = header - 1
+    return before >= 0 and blocks[before].end == start and before not in body \
+        and instructions[start - 1][0] not in (OP_GOTO, OP_RETURN) \
+        and all(predecessor in body or predecessor == before
+                for predecessor in blocks[header].predecessors)
+
+
+def hoist_invariants(program, hoisted=None):
+    # Loop invariant code motion. The loops are found from the back edges
+    # of the dominator tree of every function, and the innermost ones are
+    # done first. An operation moves to the preheader of a loop when its
+    # operands are constants, variables the loop does not store to, or
+    # temporaries computed outside of it, and it is the only assignment of
+    # its temporary. The preheader is the code right before the label of
+    # the header, which only the code before the loop falls through to.
+    #
+    # An operation that can fail, anything but a copy, only moves if it
+    # runs on every way out of the loop. If hoisted is a dict, it gets the
+    # number of instructions taken out of each loop, by the index of its
+    # header in the program.
+    instructions = load(program)
+
+    assignments = {}
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if dest >= 0 and dest & 3 == KIND_TEMP:
+            assignments[dest] = assignments.get(dest, 0) + 1
+
+    target = {}         # instruction -> the header it moves before
+    moved_to = {}       # header -> the instructions moved before it
+
+    for graph in build_graphs(program):
+        blocks = graph.blocks
+        order = reverse_postorder(graph)
+        idom = dominators(graph, order)
+        loops = natural_loops(graph, idom, order)
+
+        # The instructions in every block, as they are moved around
+        code = [list(range(block.start, block.end)) for block in blocks]
+
+        for header, body in sorted(loops.items(), key=lambda loop: len(loop[1])):
+            start = blocks[header].start
+            before = header - 1
+            if not has_preheader(instructions, blocks, header, body):
+                continue
+
+            stored = set()
+            defined = set()
+            calls = False
+            for block in body:
+                for idx in code[block]:
+                    opcode, dest, arg1, arg2, layout = instructions[idx]
+                    if opcode == OP_CALL:
+                        calls = True
+                    elif opcode == OP_FUNC_START and arg1 >= 0:
+                        stored.add(arg1)
+                    if dest >= 0 and dest & 3 == KIND_VAR:
+                        stored.add(dest)
+                    elif dest >= 0 and dest & 3 == KIND_TEMP:
+                        defined.add(dest)
+            exits = [block for block in body
+                     if any(successor == EXIT or successor not in body
+                            for successor in blocks[block].successors)]
+
+            def invariant(operand):
+                kind = operand & 3
+                if operand < 0 or kind == KIND_CONST:
+                    return True
+                if kind == KIND_VAR:
+                    return not calls and operand not in stored
+                return operand not in defined
+
+            moved = []
+            changed = True
+            while changed:
+                changed = False
+                for block in sorted(body):
+                    kept = []
+                    for idx in code[block]:
+                        opcode, dest, arg1, arg2, layout = instructions[idx]
+                        if opcode in PURE_OPCODES and dest & 3 == KIND_TEMP \
+                                and assignments[dest] == 1 \
+                                and invariant(arg1) and invariant(arg2) \
+                                and (opcode == OP_MOVE or all(
+                                    dominates(idom, block, exit) for exit in exits)):
+                            moved.append(idx)
+                            defined.discard(dest)
+                            changed = True
+                        else:
+                            kept.append(idx)
+                    code[block] = kept
+
+            if moved:
+                code[before].extend(moved)
+                moved_to[start] = moved
+                for idx in moved:
+                    target[idx] = start
+                if hoisted is not None:
+                    hoisted[start] = len(moved)
+
+    result = []
+    removed = set()
+    for idx, instruction in enumerate(instructions):
+        for moved in moved_to.get(idx, ()):
+            if target[moved] == idx:
+                opcode, dest, arg1, arg2, layout = instructions[moved]
+                result.append((opcode, dest, arg1, arg2, layout & LAYOUT_FLAGS))
+        if idx in target:
+            removed.add(len(result))
+        result.append(instruction)
+
+    return store(program, without(result, removed))
+
+
+# ===============================================================================
+# ALGEBRA
+# ===============================================================================
+# Powers up to this one become multiplications
+MAX_EXPANDED_EXPONENT = 4
+
+
+def is_int_constant(program, operand, value):
+    # 1.0 is left alone, x * 1.0 is a float even when x is not
+    if operand < 0 or operand & 3 != KIND_CONST:
+        return False
+    constant = program.constants[operand >> 2]
+    return type(constant) is int and constant == value
+
+
+# What is known of a value: an int, or a number that may be a float. The
+# values that may be neither, like strings, functions or the None of an
+# unassigned variable, are left out of the maps of the types.
+VALUE_INT = 0
+VALUE_NUMBER = 1
+
+
+def number_type(program, types, operand):
+    if operand >= 0 and operand & 3 == KIND_CONST:
+        value = program.constants[operand >> 2]
+        if type(value) is int:
+            return VALUE_INT
+        return VALUE_NUMBER if type(value) is float else None
+    return types.get(operand)
+
+
+def result_number_type(program, opcode, left, right, arg2):
+    if OP_EQ <= opcode <= OP_GTE:
+        return VALUE_INT
+    if opcode == OP_MOVE or opcode == OP_NEG or opcode == OP_POS:
+        return left
+    if left is None or right is None:
+        return None
+    if opcode == OP_DIV:
+        return VALUE_NUMBER
+    if opcode == OP_POW:
+        # An int to a negative power is a float, and a negative float to a
+        # fractional one is a complex
+        if left != VALUE_INT or right != VALUE_INT:
+            return None
+        natural = arg2 & 3 == KIND_CONST and program.constants[arg2 >> 2] >= 0
+        return VALUE_INT if natural else VALUE_NUMBER
+    return max(left, right)
+
+
+def step_number_types(program, types, instruction):
+    opcode, dest, arg1, arg2, layout = instruction
+    if opcode in PURE_OPCODES:
+        value_type = result_number_type(
+            program, opcode, number_type(program, types, arg1),
+            number_type(program, types, arg2), arg2)
+        if value_type is None:
+            types.pop(dest, None)
+        else:
+            types[dest] = value_type
+    elif opcode == OP_CALL:
+        # The function may store anything in any variable
+        for operand in list(types):
+            if operand & 3 == KIND_VAR:
+                del types[operand]
+        types.pop(dest, None)
+    elif opcode == OP_ARG or opcode == OP_FUNC_START:
+        types.pop(arg1, None)
+
+
+def typed_liveness(graph, instructions, order):
+    # The names whose type may be read after the end of every block, as the
+    # bits of an int, and the bit of every name. Unlike for dead_stores, a
+    # CALL sets all the variables, since it forgets their types, and the
+    # code that leaves the graph reads none.
+    ids = {}
+    all_vars = 0
+    for block in graph.blocks:
+        for idx in range(block.start, block.end):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            for operand in (dest, arg1, arg2):
+                if is_name(operand) and operand not in ids:
+                    ids[operand] = len(ids)
+                    if operand & 3 == KIND_VAR:
+                        all_vars |= 1 << ids[operand]
+
+    uses = []
+    kills = []
+    for block in graph.blocks:
+        use = 0
+        kill = 0
+        for idx in range(block.start, block.end):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            if opcode == OP_ARG or opcode == OP_FUNC_START:
+                if arg1 >= 0:
+                    kill |= 1 << ids[arg1]
+                continue
+            for operand in (arg1, arg2):
+                if is_name(operand):
+                    use |= 1 << ids[operand] & ~kill
+            if opcode == OP_CALL:
+                kill |= all_vars
+            if is_name(dest):
+                kill |= 1 << ids[dest]
+        uses.append(use)
+        kills.append(kill)
+
+    live_in = [0] * len(graph.blocks)
+    live_out = [0] * len(graph.blocks)
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(order):
+            out = 0
+            for successor in graph.blocks[block].successors:
+                if successor != EXIT:
+                    out |= live_in[successor]
+            live_out[block] = out
+            new_in = uses[block] | out & ~kills[block]
+            if new_in != live_in[block]:
+                live_in[block] = new_in
+                changed = True
+    return ids, live_out
+
+
+def number_types(program, instructions):
+    # The types known at the start of every block, by the index of its first
+    # instruction. A value has a type at a block when it has it at the end
+    # of all its predecessors. Nothing is known at the entry of a graph,
+    # where the variables may be unassigned or set by any caller.
+    #
+    # Only the types of the names live at the end of a block are carried to
+    # the blocks after it, or every block would check every name of the
+    # code before it.
+    entries = {}
+    for graph in build_graphs(program):
+        blocks = graph.blocks
+        order = reverse_postorder(graph)
+        ids, live_out = typed_liveness(graph, instructions, order)
+
+        states = {order[0]: {}} if order else {}
+        changed = True
+        while changed:
+            changed = False
+            for block in order:
+                types = dict(states[block])
+                for idx in range(blocks[block].start, blocks[block].end):
+                    step_number_types(program, types, instructions[idx])
+                live = live_out[block]
+                types = {operand: value_type for operand, value_type in types.items()
+                         if live >> ids[operand] & 1}
+                for successor in blocks[block].successors:
+                    if successor == EXIT:
+                        continue
+                    state = states.get(successor)
+                    if state is not None:
+                        types_in = {operand: max(value_type, types[operand])
+                                    for operand, value_type in state.items()
+                                    if operand in types}
+                        if types_in == state:
+                            continue
+                    else:
+                        types_in = dict(types)
+                    states[successor] = types_in
+                    changed = True
+        # The blocks that are never reached are left with nothing known
+        for block in blocks:
+            entries[block.start] = states.get(block.index, {})
+    return entries
+
+
+def expand_power(result, dest, base, exponent, layout):
+    # Left to right binary exponentiation: for every bit of the exponent
+    # after the first one the value is squared, then multiplied by the base
+    # if the bit is set. The last multiplication gives dest.
+    factors = []
+    for bit in bin(exponent)[3:]:
+        factors.append(None)
+        if bit == '1':
+            factors.append(base)
+
+    value = base
+    for idx, factor in enumerate(factors):
+        product = dest if idx == len(factors) - 1 else temp(result.new_number())
+        result.append(OP_MUL, product, value, value if factor is None else factor,
+                      layout if product == dest else 0)
+        value = product
+
+
+def simplify_algebra(program, simplified=None):
+    # Rewrites operations whose result does not need them:
+    #   x + 0, 0 + x, x - 0, x * 1, 1 * x, x ^ 1  ->  x
+    #   x - x  ->  0
+    #   x * 2, 2 * x  ->  x + x
+    #   x ^ n, for 2 <= n <= MAX_EXPANDED_EXPONENT  ->  multiplications
+    # Only the integer constants are taken, as 1.0 or 0.0 would change the
+    # type of the result, and x must be known to be a number: a string
+    # keeps its error, or its own meaning of * and ^. Where x may be a
+    # float, x + 0 is left for -0.0, x - x for inf and nan, and the powers
+    # for their rounding and overflow. The zero of x - x is used in place of
+    # its temporary by the operations after it. If simplified is a dict, it
+    # counts the rewrites of every opcode.
+    instructions = load(program)
+    result = program.derive()
+    entries = number_types(program, instructions)
+    types = {}
+
+    assignments = {}
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if dest >= 0 and dest & 3 == KIND_TEMP:
+            assignments[dest] = assignments.get(dest, 0) + 1
+
+    zero = result.const(0)
+    zeros = set()
+    for idx, instruction in enumerate(instructions):
+        opcode, dest, arg1, arg2, layout = instruction
+        if idx in entries:
+            types = dict(entries[idx])
+        type1 = number_type(program, types, arg1)
+        type2 = number_type(program, types, arg2)
+        step_number_types(program, types, instruction)
+
+        if opcode not in PURE_OPCODES:
+            result.append(opcode, dest, arg1, arg2, layout)
+            continue
+        if arg1 in zeros:
+            arg1 = zero
+        if arg2 in zeros:
+            arg2 = zero
+
+        rewritten = True
+        if opcode == OP_ADD and type1 == VALUE_INT and is_int_constant(program, arg2, 0) \
+                or type1 is not None and (
+                    opcode == OP_SUB and is_int_constant(program, arg2, 0)
+                    or opcode == OP_MUL and is_int_constant(program, arg2, 1)
+                    or opcode == OP_POW and is_int_constant(program, arg2, 1)):
+            result.append(OP_MOVE, dest, arg1, NONE, layout)
+        elif opcode == OP_ADD and type2 == VALUE_INT and is_int_constant(program, arg1, 0) \
+                or opcode == OP_MUL and type2 is not None \
+                and is_int_constant(program, arg1, 1):
+            result.append(OP_MOVE, dest, arg2, NONE, layout)
+        elif opcode == OP_SUB and arg1 == arg2 and type1 == VALUE_INT \
+                and arg1 & 3 != KIND_CONST:
+            result.append(OP_MOVE, dest, zero, NONE, layout)
+            if assignments.get(dest) == 1:
+                zeros.add(dest)
+        elif opcode == OP_MUL and type1 is not None and is_int_constant(program, arg2, 2):
+            result.append(OP_ADD, dest, arg1, arg1, layout)
+        elif opcode == OP_MUL and type2 is not None and is_int_constant(program, arg1, 2):
+            result.append(OP_ADD, dest, arg2, arg2, layout)
+        elif opcode == OP_POW and type1 == VALUE_INT and arg2 & 3 == KIND_CONST \
+                and any(is_int_constant(program, arg2, exponent)
+                        for exponent in range(2, MAX_EXPANDED_EXPONENT + 1)):
+            expand_power(result, dest, arg1, program.constants[arg2 >> 2], layout)
+        else:
+            rewritten = False
+            result.append(opcode, dest, arg1, arg2, layout)
+
+        if rewritten and simplified is not None:
+            name = OPCODE_NAMES[opcode]
+            simplified[name] = simplified.get(name, 0) + 1
+    return result
+
+
+def reduce_induction_variables(program, reduced=None):
+    # In a loop whose only store to a variable is v = v + c, as in a FOR
+    # loop, v * k becomes a temporary set to v * k before the loop and
+    # increased by c * k right after v. The constants are integers, so the
+    # sums give the same values as the products. The multiplication may use
+    # v itself, or a temporary it was loaded into in the same block since
+    # the last store. v must be an int when the loop is entered, as the
+    # sums of floats round other than their products. If reduced is a dict,
+    # it gets the number of multiplications replaced in each loop, by the
+    # index of its header.
+    instructions = load(program)
+    result = program.derive()
+    entries = number_types(program, instructions)
+
+    assignments = {}
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if dest >= 0 and dest & 3 == KIND_TEMP:
+            assignments[dest] = assignments.get(dest, 0) + 1
+
+    before = {}         # instruction index -> instructions added before it
+    after = {}          # instruction index -> instructions added after it
+    replaced = {}       # instruction index -> the instruction in its place
+
+    for graph in build_graphs(program):
+        blocks = graph.blocks
+        order = reverse_postorder(graph)
+        idom = dominators(graph, order)
+
+        for header, body in natural_loops(graph, idom, order).items():
+            start = blocks[header].start
+            if not has_preheader(instructions, blocks, header, body):
+                continue
+
+            # The variables stored once in the loop, by v = v + c
+            stores = {}
+            calls = False
+            for block in body:
+                for idx in range(blocks[block].start, blocks[block].end):
+                    opcode, dest, arg1, arg2, layout = instructions[idx]
+                    if opcode == OP_CALL or opcode == OP_FUNC_START:
+                        calls = True
+                    if dest >= 0 and dest & 3 == KIND_VAR:
+                        stores.setdefault(dest, []).append(idx)
+            if calls:
+                continue
+            steps = {}
+            for variable, indexes in stores.items():
+                opcode, dest, arg1, arg2, layout = instructions[indexes[0]]
+                if len(indexes) == 1 and opcode == OP_ADD and arg1 == variable \
+                        and arg2 & 3 == KIND_CONST \
+                        and type(program.constants[arg2 >> 2]) is int \
+                        and entries[start].get(variable) == VALUE_INT:
+                    steps[variable] = (indexes[0], program.constants[arg2 >> 2])
+
+            reductions = {}     # (variable, factor) -> temporary
+            multiplications = 0
+            for block in sorted(body):
+                loaded = {}     # temporary -> the variable it holds
+                for idx in range(blocks[block].start, blocks[block].end):
+                    opcode, dest, arg1, arg2, layout = instructions[idx]
+                    if opcode == OP_MOVE and arg1 in steps and assignments.get(dest) == 1:
+                        loaded[dest] = arg1
+                    elif dest in steps:
+                        loaded = {}
+                    if opcode != OP_MUL or assignments.get(dest) != 1:
+                        continue
+
+                    for variable, factor in ((arg1, arg2), (arg2, arg1)):
+                        variable = loaded.get(variable, variable)
+                        if variable in steps and factor & 3 == KIND_CONST \
+                                and type(program.constants[factor >> 2]) is int:
+                            break
+                    else:
+                        continue
+
+                    key = (variable, factor)
+                    if key not in reductions:
+                        reduction = reductions[key] = temp(result.new_number())
+                        step_idx, step = steps[variable]
+                        increment = result.const(step * program.constants[factor >> 2])
+                        before.setdefault(start, []).append(
+                            (OP_MUL, reduction, variable, factor, 0))
+                        after.setdefault(step_idx, []).append(
+                            (OP_ADD, reduction, reduction, increment, 0))
+                    replaced[idx] = (OP_MOVE, dest, reductions[key], NONE, layout)
+                    multiplications += 1
+
+            if multiplications and reduced is not None:
+                reduced[start] = multiplications
+
+    for idx, instruction in enumerate(instructions):
+        for added in before.get(idx, ()):
+            result.append(*added)
+        opcode, dest, arg1, arg2, layout = replaced.get(idx, instruction)
+        if idx in after:
+            # The blank lines go after the instructions added
+            result.append(opcode, dest, arg1, arg2, layout & LAYOUT_FLAGS)
+            for added in after[idx]:
+                result.append(*added)
+            result.add_blank_lines(layout >> LINES_AFTER_SHIFT)
+        else:
+            result.append(opcode, dest, arg1, arg2, layout)
+    return result
+
+
+# ===============================================================================
+# TEMPORARIES
+# ===============================================================================
+def temp_intervals(graph, instructions):
+    # The live interval of every temporary of a function, as the (first,
+    # last) positions where it is live. The reads of instruction idx are at
+    # position 2 * idx and its write at 2 * idx + 1, so a temporary read for
+    # the last time can give its slot to the one written by the same
+    # instruction. An interval covers the holes in the liveness of its
+    # temporary, which linear scan does not look at.
+    blocks = graph.blocks
+    uses = []
+    defs = []
+    for block in blocks:
+        used = set()
+        defined = set()
+        for idx in range(block.start, block.end):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            for operand in (arg1, arg2):
+                if operand >= 0 and operand & 3 == KIND_TEMP and operand not in defined:
+                    used.add(operand)
+            if dest >= 0 and dest & 3 == KIND_TEMP:
+                defined.add(dest)
+        uses.append(used)
+        defs.append(defined)
+
+    # Backward dataflow, visiting the blocks last to first until nothing
+    # changes
+    live_in = [set(used) for used in uses]
+    live_out = [set() for block in blocks]
+    changed = True
+    while changed:
+        changed = False
+        for block in reversed(blocks):
+            out = live_out[block.index]
+            for successor in block.successors:
+                if successor != EXIT:
+                    out |= live_in[successor]
+            live = uses[block.index] | (out - defs[block.index])
+            if len(live) != len(live_in[block.index]):
+                live_in[block.index] = live
+                changed = True
+
+    intervals = {}
+
+    def extend(operand, position):
+        interval = intervals.get(operand)
+        if interval is None:
+            intervals[operand] = (position, position)
+        elif position < interval[0]:
+            intervals[operand] = (position, interval[1])
+        elif position > interval[1]:
+            intervals[operand] = (interval[0], position)
+
+    for block in blocks:
+        for operand in live_in[block.index]:
+            extend(operand, 2 * block.start)
+        for operand in live_out[block.index]:
+            extend(operand, 2 * block.end - 1)
+        for idx in range(block.start, block.end):
+            opcode, dest, arg1, arg2, layout = instructions[idx]
+            for operand in (arg1, arg2):
+                if operand >= 0 and operand & 3 == KIND_TEMP:
+                    extend(operand, 2 * idx)
+            if dest >= 0 and dest & 3 == KIND_TEMP:
+                extend(dest, 2 * idx + 1)
+    return intervals
+
+
+def linear_scan(intervals, max_slots=None):
+    # Gives every interval the lowest slot free at its start. With
+    # max_slots, when all of them are taken, the interval that ends last
+    # is spilled: it goes to a stack slot, handed out the same way among
+    # the spilled intervals. Returns the slot of every temporary and the
+    # stack slot of every spilled one.
+    slots = {}
+    spilled = []
+    active = []         # (end, temporary), a heap of the intervals in a slot
+    free = []
+    used = 0
+    for operand, (start, end) in sorted(intervals.items(), key=lambda item: item[1][0]):
+        while active and active[0][0] < start:
+            heappush(free, slots[heappop(active)[1]])
+        if free:
+            slots[operand] = heappop(free)
+        elif max_slots is None or used < max_slots:
+            slots[operand] = used
+            used += 1
+        else:
+            last_end, last = max(active)
+            if last_end > end:
+                active.remove((last_end, last))
+                heapify(active)
+                slots[operand] = slots.pop(last)
+                spilled.append(last)
+            else:
+                spilled.append(operand)
+                continue
+        heappush(active, (end, operand))
+
+    stack_slots = {}
+    if spilled:
+        stack_slots, _ = linear_scan({operand: intervals[operand] for operand in spilled})
+    return slots, stack_slots
+
+
+def allocate_temps(program, max_temps=None, allocation=None):
+    # Renames the temporaries of every function to as few slots as the
+    # liveness of their values allows, t0, t1 and so on, reused once the
+    # value they hold is no longer read. The functions run in frames of
+    # their own, so each one starts again from t0. With max_temps, the
+    # values that do not fit are kept in stack slots, printed s0, s1 and so
+    # on. Meant to run last: the passes above expect one assignment per
+    # temporary. If allocation is a dict, it gets the number of temporaries
+    # of the program before, the most values live at once in a function,
+    # and the most temporaries and stack slots a function uses after.
+    instructions = load(program)
+    stack_base = max_temps if max_temps is not None else 0
+
+    renamed = {}
+    stats = {'temps': 0, 'peak': 0, 'slots': 0, 'stack slots': 0}
+    for graph in build_graphs(program):
+        intervals = temp_intervals(graph, instructions)
+        slots, stack_slots = linear_scan(intervals, max_temps)
+        for operand, slot in slots.items():
+            renamed[operand] = temp(slot)
+        for operand, slot in stack_slots.items():
+            renamed[operand] = temp(stack_base + slot)
+
+        # The most values live at once, from the ends of the intervals
+        events = sorted([(start, 1) for start, end in intervals.values()]
+                        + [(end + 1, -1) for start, end in intervals.values()])
+        live = peak = 0
+        for position, change in events:
+            live += change
+            peak = max(peak, live)
+        stats['temps'] += len(intervals)
+        stats['peak'] = max(stats['peak'], peak)
+        stats['slots'] = max(stats['slots'], len(set(slots.values())))
+        stats['stack slots'] = max(stats['stack slots'], len(set(stack_slots.values())))
+
+    result = program.derive()
+    result.stack_base = max_temps
+    for opcode, dest, arg1, arg2, layout in instructions:
+        result.append(opcode, renamed.get(dest, dest), renamed.get(arg1, arg1),
+                      renamed.get(arg2, arg2), layout)
+    if allocation is not None:
+        allocation.update(stats)
+    return result
+
+
+# ===============================================================================
+# OPTIMIZATION LEVELS
+# ===============================================================================
+OPTIMIZATION_LEVELS = [
+    [],
+    [fold_constants],
+    # Value numbering shows which operands are the same to simplify_algebra,
+    # then reuses the squares of the powers it expands
+    [fold_constants, number_values, simplify_algebra, number_values,
+     hoist_invariants, reduce_induction_variables, eliminate_dead_code],
+]
+
+MAX_OPTIMIZATION_LEVEL = len(OPTIMIZATION_LEVELS) - 1
+
+
+def optimize(program, level):
+    for optimization_pass in OPTIMIZATION_LEVELS[min(level, MAX_OPTIMIZATION_LEVEL)]:
+        program = optimization_pass(program)
+    return program
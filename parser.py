@@ -6,10 +6,83 @@ from error import *
     This document contains the following:
     1. ParseResult class
     2. Parser class
+    3. TokenWindow class
+    4. StreamingParser class
 
 """
 
 
+# Binding power of the binary operators used by Parser.pratt_expr.
+# Keywords are keyed by (type, value), the other tokens by their type.
+AND_OR_PRECEDENCE = 1
+COMPARISON_PRECEDENCE = 2
+ARITH_PRECEDENCE = 3
+TERM_PRECEDENCE = 4
+POWER_PRECEDENCE = 5
+
+BINARY_PRECEDENCE = {
+    (TT_KEYWORD, 'AND'): AND_OR_PRECEDENCE,
+    (TT_KEYWORD, 'OR'): AND_OR_PRECEDENCE,
+    TT_EE: COMPARISON_PRECEDENCE,
+    TT_NE: COMPARISON_PRECEDENCE,
+    TT_LT: COMPARISON_PRECEDENCE,
+    TT_GT: COMPARISON_PRECEDENCE,
+    TT_LTE: COMPARISON_PRECEDENCE,
+    TT_GTE: COMPARISON_PRECEDENCE,
+    TT_PLUS: ARITH_PRECEDENCE,
+    TT_MINUS: ARITH_PRECEDENCE,
+    TT_MUL: TERM_PRECEDENCE,
+    TT_DIV: TERM_PRECEDENCE,
+    TT_POW: POWER_PRECEDENCE,
+}
+
+EXPR_ENGINES = ['classic', 'pratt', 'stack']
+
+# Pending constructs on the stack of Parser.stack_expr
+FRAME_UNARY = 0
+FRAME_BINARY = 1
+FRAME_PAREN = 2
+FRAME_VAR = 3
+
+
+# The first symbols of every alternative of the grammar, as parsed by the
+# methods of the same name. Lowercase names are rules, the rest are tokens.
+GRAMMAR_STARTS = {
+    'statement': [(TT_KEYWORD, 'RETURN'), (TT_KEYWORD, 'CONTINUE'), (TT_KEYWORD, 'BREAK'), 'expr'],
+    'expr': [(TT_KEYWORD, 'VAR'), 'comp_expr'],
+    'comp_expr': [(TT_KEYWORD, 'NOT'), 'arith_expr'],
+    'arith_expr': ['term'],
+    'term': ['factor'],
+    'factor': [TT_PLUS, TT_MINUS, 'power'],
+    'power': ['call'],
+    'call': ['atom'],
+    'atom': [TT_INT, TT_FLOAT, TT_STRING, TT_IDENTIFIER, TT_LPAREN, 'list_expr',
+             'if_then', 'for_expr', 'while_expr', 'func_def'],
+    'list_expr': [TT_LSQUARE],
+    'if_then': [(TT_KEYWORD, 'IF')],
+    'for_expr': [(TT_KEYWORD, 'FOR')],
+    'while_expr': [(TT_KEYWORD, 'WHILE')],
+    'func_def': [(TT_KEYWORD, 'FUN')],
+}
+
+
+def first_sets(grammar):
+    first = {rule: set() for rule in grammar}
+    changed = True
+    while changed:
+        changed = False
+        for rule, starts in grammar.items():
+            for symbol in starts:
+                new = first[symbol] if symbol in grammar else {symbol}
+                if not new <= first[rule]:
+                    first[rule] |= new
+                    changed = True
+    return {rule: frozenset(symbols) for rule, symbols in first.items()}
+
+
+FIRST = first_sets(GRAMMAR_STARTS)
+
+
 """ParseResult class
     
     Description:
@@ -69,10 +142,27 @@ class ParseResult:
     Description:
         This class is used to parse the tokens that were generated by the lexer.
     
+        The binary operators of an expression are either parsed by the
+        classic descent through comp_expr, arith_expr, term, factor and power,
+        or by pratt_expr, which climbs the BINARY_PRECEDENCE table and builds
+        the same nodes. stack_expr_steps parses whole expressions, parentheses
+        and VAR included, with an explicit stack instead of recursion, for very
+        deeply nested expressions. expr_engine selects one of EXPR_ENGINES.
+
+        The rules that blocks and lists nest through, from statements down to
+        atom and the IF, FOR, WHILE and FUN blocks, are *_steps generators
+        that yield the steps of the rules they need and are sent back their
+        ParseResult. run_steps runs them on an explicit stack, so with the
+        stack engine no part of a program, however deeply nested, recurses.
+
     Attributes:
         tokens (TYPE): Description
         tok_idx (int): Description
         current_tok (TYPE): Description
+        expr_engine (str): 'classic', 'pratt' or 'stack'
+        predict (bool): Whether statement lists use the FIRST sets to decide
+            whether another statement follows, instead of trying to parse one
+        reverse_count (int): The number of times the parser went back
 
     Returns:
         TYPE: Description        
@@ -80,9 +170,13 @@ class ParseResult:
 
 
 class Parser:
-    def __init__(self, tokens):
+    def __init__(self, tokens, expr_engine='classic', predict=True):
         self.tokens = tokens
         self.tok_idx = -1
+        self.expr_engine = expr_engine
+        self.replaying = False
+        self.predict = predict
+        self.reverse_count = 0
         self.advance()
 
     def advance(self):
@@ -90,7 +184,15 @@ class Parser:
         self.update_current_tok()
         return self.current_tok
 
+    def starts(self, rule):
+        # Whether the current token can start the rule
+        tok = self.current_tok
+        if tok.type == TT_KEYWORD:
+            return (TT_KEYWORD, tok.value) in FIRST[rule]
+        return tok.type in FIRST[rule]
+
     def reverse(self, amount=1):
+        self.reverse_count += 1
         self.tok_idx -= amount
         self.update_current_tok()
         return self.current_tok
@@ -99,8 +201,17 @@ class Parser:
         if self.tok_idx >= 0 and self.tok_idx < len(self.tokens):
             self.current_tok = self.tokens[self.tok_idx]
 
+    def next_type(self):
+        # The type of the token after the current one
+        if self.tok_idx + 1 < len(self.tokens):
+            return self.tokens[self.tok_idx + 1].type
+        return None
+
     def parse(self):
-        res = self.statements()
+        try:
+            res = self.statements()
+        except RecursionError:
+            return ParseResult().failure(self.nesting_error())
         if not res.error and self.current_tok.type != TT_EOF:
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
@@ -108,18 +219,55 @@ class Parser:
             ))
         return res
 
+    def nesting_error(self):
+        # The stack engine parses programs of any depth, but the expressions
+        # of the other engines are parsed by recursive descent, which runs
+        # out of Python stack a hundred or so blocks deep
+        return InvalidSyntaxError(
+            self.current_tok.pos_start, self.current_tok.pos_end,
+            "Blocks are nested too deeply"
+        )
+
+    def run_steps(self, steps):
+        # Runs the steps of a rule, and of the rules they yield, on an
+        # explicit stack. Each is sent the ParseResult of the rule it
+        # yielded; a rule parsed without steps yields its ParseResult.
+        stack = [steps]
+        res = None
+
+        while True:
+            try:
+                child = stack[-1].send(res)
+            except StopIteration as stop:
+                stack.pop()
+                res = stop.value
+                if not stack:
+                    return res
+                continue
+            if child.__class__ is ParseResult:
+                res = child
+            else:
+                stack.append(child)
+                res = None
+
     ###################################
 
     def statements(self):
+        return self.run_steps(self.statements_steps())
+
+    def statement(self):
+        return self.run_steps(self.statement_steps())
+
+    def statements_steps(self):
         res = ParseResult()
         statements = []
-        pos_start = self.current_tok.pos_start.copy()
+        pos_start = self.current_tok.pos_start
 
         while self.current_tok.type == TT_NEWLINE:
             res.register_advancement()
             self.advance()
 
-        statement = res.register(self.statement())
+        statement = res.register((yield self.statement_steps()))
         if res.error:
             return res
         statements.append(statement)
@@ -137,7 +285,10 @@ class Parser:
 
             if not more_statements:
                 break
-            statement = res.try_register(self.statement())
+            if self.predict and not self.starts('statement'):
+                # END, ELIF, ELSE or EOF, the list ends here
+                break
+            statement = res.try_register((yield self.statement_steps()))
             if not statement:
                 self.reverse(res.to_reverse_count)
                 more_statements = False
@@ -147,33 +298,37 @@ class Parser:
         return res.success(ListNode(
             statements,
             pos_start,
-            self.current_tok.pos_end.copy()
+            self.current_tok.pos_end
         ))
 
-    def statement(self):
+    def statement_steps(self):
         res = ParseResult()
-        pos_start = self.current_tok.pos_start.copy()
 
         if self.current_tok.matches(TT_KEYWORD, 'RETURN'):
+            pos_start = self.current_tok.pos_start
             res.register_advancement()
             self.advance()
 
-            expr = res.try_register(self.expr())
-            if not expr:
-                self.reverse(res.to_reverse_count)
-            return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start.copy()))
+            expr = None
+            if not self.predict or self.starts('expr'):
+                expr = res.try_register((yield self.expr_steps()))
+                if not expr:
+                    self.reverse(res.to_reverse_count)
+            return res.success(ReturnNode(expr, pos_start, self.current_tok.pos_start))
 
         if self.current_tok.matches(TT_KEYWORD, 'CONTINUE'):
+            pos_start = self.current_tok.pos_start
             res.register_advancement()
             self.advance()
-            return res.success(ContinueNode(pos_start, self.current_tok.pos_start.copy()))
+            return res.success(ContinueNode(pos_start, self.current_tok.pos_start))
 
         if self.current_tok.matches(TT_KEYWORD, 'BREAK'):
+            pos_start = self.current_tok.pos_start
             res.register_advancement()
             self.advance()
-            return res.success(BreakNode(pos_start, self.current_tok.pos_start.copy()))
+            return res.success(BreakNode(pos_start, self.current_tok.pos_start))
 
-        expr = res.register(self.expr())
+        expr = res.register((yield self.expr_steps()))
         if res.error:
             return res.failure(InvalidSyntaxError(
                 self.current_tok.pos_start, self.current_tok.pos_end,
@@ -181,7 +336,16 @@ class Parser:
             ))
         return res.success(expr)
 
+    def expr_steps(self):
+        if self.expr_engine == 'stack' and not self.replaying:
+            return self.stack_expr_or_replay_steps()
+        # The other engines parse the operators by recursive descent
+        return self.expr()
+
     def expr(self):
+        if self.expr_engine == 'stack' and not self.replaying:
+            return self.run_steps(self.stack_expr_or_replay_steps())
+
         res = ParseResult()
 
         if self.current_tok.matches(TT_KEYWORD, 'VAR'):
@@ -211,8 +375,7 @@ class Parser:
                 return res
             return res.success(VarAssignNode(var_name, expr))
 
-        node = res.register(self.bin_op(
-            self.comp_expr, ((TT_KEYWORD, 'AND'), (TT_KEYWORD, 'OR'))))
+        node = res.register(self.operator_expr())
 
         if res.error:
             return res.failure(InvalidSyntaxError(
@@ -222,6 +385,197 @@ class Parser:
 
         return res.success(node)
 
+    def operator_expr(self):
+        if self.expr_engine == 'pratt' and not self.replaying:
+            tok_idx = self.tok_idx
+            res = self.pratt_expr(AND_OR_PRECEDENCE)
+            if not res.error:
+                return res
+
+            # The classic descent is replayed to report exactly the same error
+            self.tok_idx = tok_idx
+            self.update_current_tok()
+            self.replaying = True
+            try:
+                return self.bin_op(self.comp_expr, ((TT_KEYWORD, 'AND'), (TT_KEYWORD, 'OR')))
+            finally:
+                self.replaying = False
+
+        return self.bin_op(self.comp_expr, ((TT_KEYWORD, 'AND'), (TT_KEYWORD, 'OR')))
+
+    def pratt_expr(self, min_precedence):
+        res = ParseResult()
+        tok = self.current_tok
+
+        # Prefix operators: '+' and '-' start a factor, 'NOT' a comp_expr
+        if tok.type in (TT_PLUS, TT_MINUS):
+            res.register_advancement()
+            self.advance()
+            node = res.register(self.pratt_expr(POWER_PRECEDENCE))
+            if res.error:
+                return res
+            left = UnaryOpNode(tok, node)
+        elif min_precedence <= COMPARISON_PRECEDENCE and tok.matches(TT_KEYWORD, 'NOT'):
+            res.register_advancement()
+            self.advance()
+            node = res.register(self.pratt_expr(COMPARISON_PRECEDENCE))
+            if res.error:
+                return res
+            left = UnaryOpNode(tok, node)
+        else:
+            left = res.register(self.call())
+            if res.error:
+                return res
+
+        while True:
+            op_tok = self.current_tok
+            if op_tok.type == TT_KEYWORD:
+                precedence = BINARY_PRECEDENCE.get((TT_KEYWORD, op_tok.value))
+            else:
+                precedence = BINARY_PRECEDENCE.get(op_tok.type)
+            if precedence is None or precedence < min_precedence:
+                break
+
+            res.register_advancement()
+            self.advance()
+
+            # '^' is right associative, the other operators left associative
+            if precedence == POWER_PRECEDENCE:
+                right = res.register(self.pratt_expr(POWER_PRECEDENCE))
+            else:
+                right = res.register(self.pratt_expr(precedence + 1))
+            if res.error:
+                return res
+            left = BinOpNode(left, op_tok, right)
+
+        return res.success(left)
+
+    def stack_expr_or_replay_steps(self):
+        tok_idx = self.tok_idx
+        res = yield self.stack_expr_steps()
+        if not res.error:
+            return res
+
+        # The classic descent is replayed to report exactly the same error,
+        # unless the expression is too deep for it
+        end_tok_idx = self.tok_idx
+        self.tok_idx = tok_idx
+        self.update_current_tok()
+        self.replaying = True
+        try:
+            return self.expr()
+        except RecursionError:
+            self.tok_idx = end_tok_idx
+            self.update_current_tok()
+            return res
+        finally:
+            self.replaying = False
+
+    def stack_expr_steps(self):
+        res = ParseResult()
+        stack = []
+        min_precedence = AND_OR_PRECEDENCE
+        # 'VAR' can only appear where a whole expr starts
+        at_expr_start = True
+
+        while True:
+            # Operand: prefix operators, '(' and 'VAR' are pushed as frames
+            tok = self.current_tok
+
+            if at_expr_start and tok.matches(TT_KEYWORD, 'VAR'):
+                res.register_advancement()
+                self.advance()
+
+                if self.current_tok.type != TT_IDENTIFIER:
+                    return res.failure(InvalidSyntaxError(
+                        self.current_tok.pos_start, self.current_tok.pos_end,
+                        "Expected identifier"
+                    ))
+
+                var_name = self.current_tok
+                res.register_advancement()
+                self.advance()
+
+                if self.current_tok.type != TT_EQ:
+                    return res.failure(InvalidSyntaxError(
+                        self.current_tok.pos_start, self.current_tok.pos_end,
+                        "Expected '='"
+                    ))
+
+                res.register_advancement()
+                self.advance()
+                stack.append((FRAME_VAR, var_name, min_precedence))
+                continue
+
+            at_expr_start = False
+
+            if tok.type in (TT_PLUS, TT_MINUS):
+                stack.append((FRAME_UNARY, tok, min_precedence))
+                min_precedence = POWER_PRECEDENCE
+                res.register_advancement()
+                self.advance()
+                continue
+
+            if min_precedence <= COMPARISON_PRECEDENCE and tok.matches(TT_KEYWORD, 'NOT'):
+                stack.append((FRAME_UNARY, tok, min_precedence))
+                min_precedence = COMPARISON_PRECEDENCE
+                res.register_advancement()
+                self.advance()
+                continue
+
+            if tok.type == TT_LPAREN:
+                stack.append((FRAME_PAREN, tok, min_precedence))
+                min_precedence = AND_OR_PRECEDENCE
+                at_expr_start = True
+                res.register_advancement()
+                self.advance()
+                continue
+
+            left = res.register(self.simple_call() or (yield self.call_steps()))
+            if res.error:
+                return res
+
+            # Binary operators push a frame and go back for their right
+            # operand, otherwise the frames that are complete are closed
+            while True:
+                op_tok = self.current_tok
+                if op_tok.type == TT_KEYWORD:
+                    precedence = BINARY_PRECEDENCE.get((TT_KEYWORD, op_tok.value))
+                else:
+                    precedence = BINARY_PRECEDENCE.get(op_tok.type)
+
+                if precedence is not None and precedence >= min_precedence:
+                    stack.append((FRAME_BINARY, (left, op_tok), min_precedence))
+                    if precedence != POWER_PRECEDENCE:
+                        precedence += 1
+                    min_precedence = precedence
+                    res.register_advancement()
+                    self.advance()
+                    break
+
+                if not stack:
+                    return res.success(left)
+
+                frame, data, min_precedence = stack.pop()
+                if frame == FRAME_UNARY:
+                    left = UnaryOpNode(data, left)
+                elif frame == FRAME_BINARY:
+                    left = BinOpNode(data[0], data[1], left)
+                elif frame == FRAME_VAR:
+                    left = VarAssignNode(data, left)
+                else:
+                    if self.current_tok.type != TT_RPAREN:
+                        return res.failure(InvalidSyntaxError(
+                            self.current_tok.pos_start, self.current_tok.pos_end,
+                            "Expected ')'"
+                        ))
+                    res.register_advancement()
+                    self.advance()
+
+                    left = res.register((yield self.call_args_steps(ParseResult(), left)))
+                    if res.error:
+                        return res
+
     def comp_expr(self):
         res = ParseResult()
 
@@ -270,11 +624,39 @@ class Parser:
         return self.bin_op(self.call, (TT_POW, ), self.factor)
 
     def call(self):
+        return self.simple_call() or self.run_steps(self.call_steps())
+
+    def simple_call(self):
+        # A number, string or identifier that is not called, the most
+        # common operand, is parsed without running any steps. None for
+        # the other operands.
+        tok = self.current_tok
+        if tok.type == TT_IDENTIFIER:
+            node_class = VarAccessNode
+        elif tok.type == TT_INT or tok.type == TT_FLOAT:
+            node_class = NumberNode
+        elif tok.type == TT_STRING:
+            node_class = StringNode
+        else:
+            return None
+        if self.next_type() == TT_LPAREN:
+            return None
+
+        res = ParseResult()
+        res.register_advancement()
+        self.advance()
+        return res.success(node_class(tok))
+
+    def call_steps(self):
         res = ParseResult()
-        atom = res.register(self.atom())
+        atom = res.register((yield self.atom_steps()))
         if res.error:
             return res
+        if self.current_tok.type != TT_LPAREN:
+            return res.success(atom)
+        return (yield self.call_args_steps(res, atom))
 
+    def call_args_steps(self, res, atom):
         if self.current_tok.type == TT_LPAREN:
             res.register_advancement()
             self.advance()
@@ -284,7 +666,7 @@ class Parser:
                 res.register_advancement()
                 self.advance()
             else:
-                arg_nodes.append(res.register(self.expr()))
+                arg_nodes.append(res.register((yield self.expr_steps())))
                 if res.error:
                     return res.failure(InvalidSyntaxError(
                         self.current_tok.pos_start, self.current_tok.pos_end,
@@ -295,7 +677,7 @@ class Parser:
                     res.register_advancement()
                     self.advance()
 
-                    arg_nodes.append(res.register(self.expr()))
+                    arg_nodes.append(res.register((yield self.expr_steps())))
                     if res.error:
                         return res
 
@@ -310,7 +692,7 @@ class Parser:
             return res.success(CallNode(atom, arg_nodes))
         return res.success(atom)
 
-    def atom(self):
+    def atom_steps(self):
         res = ParseResult()
         tok = self.current_tok
 
@@ -332,7 +714,7 @@ class Parser:
         elif tok.type == TT_LPAREN:
             res.register_advancement()
             self.advance()
-            expr = res.register(self.expr())
+            expr = res.register((yield self.expr_steps()))
             if res.error:
                 return res
             if self.current_tok.type == TT_RPAREN:
@@ -346,31 +728,31 @@ class Parser:
                 ))
 
         elif tok.type == TT_LSQUARE:
-            list_expr = res.register(self.list_expr())
+            list_expr = res.register((yield self.list_expr_steps()))
             if res.error:
                 return res
             return res.success(list_expr)
 
         elif tok.matches(TT_KEYWORD, 'IF'):
-            if_then = res.register(self.if_then())
+            if_then = res.register((yield self.if_then_steps()))
             if res.error:
                 return res
             return res.success(if_then)
 
         elif tok.matches(TT_KEYWORD, 'FOR'):
-            for_expr = res.register(self.for_expr())
+            for_expr = res.register((yield self.for_expr_steps()))
             if res.error:
                 return res
             return res.success(for_expr)
 
         elif tok.matches(TT_KEYWORD, 'WHILE'):
-            while_expr = res.register(self.while_expr())
+            while_expr = res.register((yield self.while_expr_steps()))
             if res.error:
                 return res
             return res.success(while_expr)
 
         elif tok.matches(TT_KEYWORD, 'FUN'):
-            func_def = res.register(self.func_def())
+            func_def = res.register((yield self.func_def_steps()))
             if res.error:
                 return res
             return res.success(func_def)
@@ -380,10 +762,10 @@ class Parser:
             "Expected int, float, identifier, '+', '-', '(', '[', IF', 'FOR', 'WHILE', 'FUN'"
         ))
 
-    def list_expr(self):
+    def list_expr_steps(self):
         res = ParseResult()
         element_nodes = []
-        pos_start = self.current_tok.pos_start.copy()
+        pos_start = self.current_tok.pos_start
 
         if self.current_tok.type != TT_LSQUARE:
             return res.failure(InvalidSyntaxError(
@@ -398,7 +780,7 @@ class Parser:
             res.register_advancement()
             self.advance()
         else:
-            element_nodes.append(res.register(self.expr()))
+            element_nodes.append(res.register((yield self.expr_steps())))
             if res.error:
                 return res.failure(InvalidSyntaxError(
                     self.current_tok.pos_start, self.current_tok.pos_end,
@@ -409,7 +791,7 @@ class Parser:
                 res.register_advancement()
                 self.advance()
 
-                element_nodes.append(res.register(self.expr()))
+                element_nodes.append(res.register((yield self.expr_steps())))
                 if res.error:
                     return res
 
@@ -425,21 +807,18 @@ class Parser:
         return res.success(ListNode(
             element_nodes,
             pos_start,
-            self.current_tok.pos_end.copy()
+            self.current_tok.pos_end
         ))
 
-    def if_then(self):
+    def if_then_steps(self):
         res = ParseResult()
-        all_cases = res.register(self.if_expr_cases('IF'))
+        all_cases = res.register((yield self.if_expr_cases_steps('IF')))
         if res.error:
             return res
         cases, else_case = all_cases
         return res.success(IfNode(cases, else_case))
 
-    def else_if(self):
-        return self.if_expr_cases('ELIF')
-
-    def else_block(self):
+    def else_block_steps(self):
         res = ParseResult()
         else_case = None
 
@@ -451,7 +830,7 @@ class Parser:
                 res.register_advancement()
                 self.advance()
 
-                statements = res.register(self.statements())
+                statements = res.register((yield self.statements_steps()))
                 if res.error:
                     return res
                 else_case = (statements, True)
@@ -465,32 +844,35 @@ class Parser:
                         "Expected 'END'"
                     ))
             else:
-                expr = res.register(self.statement())
+                expr = res.register((yield self.statement_steps()))
                 if res.error:
                     return res
                 else_case = (expr, False)
 
         return res.success(else_case)
 
-    def elsif_or_else_block(self):
+    def elsif_or_else_block_steps(self, cases):
         res = ParseResult()
-        cases, else_case = [], None
+        else_case = None
 
         if self.current_tok.matches(TT_KEYWORD, 'ELIF'):
-            all_cases = res.register(self.else_if())
+            all_cases = res.register((yield self.if_expr_cases_steps('ELIF', cases)))
             if res.error:
                 return res
             cases, else_case = all_cases
         else:
-            else_case = res.register(self.else_block())
+            else_case = res.register((yield self.else_block_steps()))
             if res.error:
                 return res
 
         return res.success((cases, else_case))
 
-    def if_expr_cases(self, case_keyword):
+    def if_expr_cases_steps(self, case_keyword, cases=None):
+        # The cases of an ELIF are added to the list of the IF, rather than
+        # copied into it, so a long ladder is parsed in linear time
         res = ParseResult()
-        cases = []
+        if cases is None:
+            cases = []
         else_case = None
 
         if not self.current_tok.matches(TT_KEYWORD, case_keyword):
@@ -502,7 +884,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        condition = res.register(self.expr())
+        condition = res.register((yield self.expr_steps()))
         if res.error:
             return res
 
@@ -519,7 +901,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-            statements = res.register(self.statements())
+            statements = res.register((yield self.statements_steps()))
             if res.error:
                 return res
             cases.append((condition, statements, True))
@@ -528,26 +910,24 @@ class Parser:
                 res.register_advancement()
                 self.advance()
             else:
-                all_cases = res.register(self.elsif_or_else_block())
+                all_cases = res.register((yield self.elsif_or_else_block_steps(cases)))
                 if res.error:
                     return res
-                new_cases, else_case = all_cases
-                cases.extend(new_cases)
+                cases, else_case = all_cases
         else:
-            expr = res.register(self.statement())
+            expr = res.register((yield self.statement_steps()))
             if res.error:
                 return res
             cases.append((condition, expr, False))
 
-            all_cases = res.register(self.elsif_or_else_block())
+            all_cases = res.register((yield self.elsif_or_else_block_steps(cases)))
             if res.error:
                 return res
-            new_cases, else_case = all_cases
-            cases.extend(new_cases)
+            cases, else_case = all_cases
 
         return res.success((cases, else_case))
 
-    def for_expr(self):
+    def for_expr_steps(self):
         res = ParseResult()
 
         if not self.current_tok.matches(TT_KEYWORD, 'FOR'):
@@ -578,7 +958,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        start_value = res.register(self.expr())
+        start_value = res.register((yield self.expr_steps()))
         if res.error:
             return res
 
@@ -591,7 +971,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        end_value = res.register(self.expr())
+        end_value = res.register((yield self.expr_steps()))
         if res.error:
             return res
 
@@ -599,7 +979,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-            step_value = res.register(self.expr())
+            step_value = res.register((yield self.expr_steps()))
             if res.error:
                 return res
         else:
@@ -618,7 +998,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-            body = res.register(self.statements())
+            body = res.register((yield self.statements_steps()))
             if res.error:
                 return res
 
@@ -633,13 +1013,13 @@ class Parser:
 
             return res.success(ForNode(var_name, start_value, end_value, step_value, body, True))
 
-        body = res.register(self.statement())
+        body = res.register((yield self.statement_steps()))
         if res.error:
             return res
 
         return res.success(ForNode(var_name, start_value, end_value, step_value, body, False))
 
-    def while_expr(self):
+    def while_expr_steps(self):
         res = ParseResult()
 
         if not self.current_tok.matches(TT_KEYWORD, 'WHILE'):
@@ -651,7 +1031,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        condition = res.register(self.expr())
+        condition = res.register((yield self.expr_steps()))
         if res.error:
             return res
 
@@ -668,7 +1048,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-            body = res.register(self.statements())
+            body = res.register((yield self.statements_steps()))
             if res.error:
                 return res
 
@@ -683,13 +1063,13 @@ class Parser:
 
             return res.success(WhileNode(condition, body, True))
 
-        body = res.register(self.statement())
+        body = res.register((yield self.statement_steps()))
         if res.error:
             return res
 
         return res.success(WhileNode(condition, body, False))
 
-    def func_def(self):
+    def func_def_steps(self):
         res = ParseResult()
 
         if not self.current_tok.matches(TT_KEYWORD, 'FUN'):
@@ -760,7 +1140,7 @@ class Parser:
             res.register_advancement()
             self.advance()
 
-            body = res.register(self.expr())
+            body = res.register((yield self.expr_steps()))
             if res.error:
                 return res
 
@@ -780,7 +1160,7 @@ class Parser:
         res.register_advancement()
         self.advance()
 
-        body = res.register(self.statements())
+        body = res.register((yield self.statements_steps()))
         if res.error:
             return res
 
@@ -821,3 +1201,117 @@ class Parser:
             left = BinOpNode(left, op_tok, right)
 
         return res.success(left)
+
+
+"""TokenWindow class
+
+    Description:
+        Reads tokens lazily from an iterator and keeps only the ones that the
+        parser may still go back to. Tokens before the last released index
+        are dropped, so the window stays as small as the statement being parsed.
+
+    Attributes:
+        tokens (iterator): The tokens still to be read
+        buffer (list): The tokens kept in the window
+        offset (int): The index of the first token in the buffer
+        at_eof (bool): Whether the EOF token was read
+
+    Returns:
+        TokenWindow: A TokenWindow object
+"""
+
+
+class TokenWindow:
+    def __init__(self, tokens):
+        self.tokens = iter(tokens)
+        self.buffer = []
+        self.offset = 0
+        self.at_eof = False
+
+    def get(self, idx):
+        buffer_idx = idx - self.offset
+        if buffer_idx < 0:
+            raise IndexError('token was released from the window')
+
+        while buffer_idx >= len(self.buffer) and not self.at_eof:
+            # When the lexer stops on an error the parser sees the end
+            tok = next(self.tokens, None) or Token(TT_EOF)
+            self.buffer.append(tok)
+            self.at_eof = tok.type == TT_EOF
+
+        if buffer_idx < len(self.buffer):
+            return self.buffer[buffer_idx]
+        return None
+
+    def release(self, idx):
+        del self.buffer[:idx - self.offset]
+        self.offset = idx
+
+
+"""StreamingParser class
+
+    Description:
+        A parser that reads its tokens from a TokenWindow and hands out the
+        top level statements one at a time, releasing the tokens of every
+        statement once it is parsed. The results and errors are the same as
+        the ones of Parser.parse.
+
+    Attributes:
+        tokens (TokenWindow): The window over the tokens
+
+    Returns:
+        StreamingParser: A StreamingParser object
+"""
+
+
+class StreamingParser(Parser):
+    def __init__(self, tokens, expr_engine='classic', predict=True):
+        super().__init__(TokenWindow(tokens), expr_engine, predict)
+
+    def update_current_tok(self):
+        if self.tok_idx >= 0:
+            tok = self.tokens.get(self.tok_idx)
+            if tok:
+                self.current_tok = tok
+
+    def next_type(self):
+        tok = self.tokens.get(self.tok_idx + 1)
+        return tok.type if tok else None
+
+    def parse_statements(self):
+        # Yields (node, error) pairs, stopping after the first error
+        first = True
+
+        while True:
+            newline_count = 0
+            while self.current_tok.type == TT_NEWLINE:
+                self.advance()
+                newline_count += 1
+
+            if not first and (newline_count == 0 or self.current_tok.type == TT_EOF):
+                break
+            if not first and self.predict and not self.starts('statement'):
+                break
+
+            self.tokens.release(self.tok_idx)
+            try:
+                res = self.statement()
+            except RecursionError:
+                yield None, self.nesting_error()
+                return
+            if res.error:
+                if first:
+                    yield None, res.error
+                    return
+                # Parser.statements would have stopped before this statement
+                self.reverse(res.advance_count)
+                break
+
+            yield res.node, None
+            first = False
+
+        if self.current_tok.type != TT_EOF:
+            yield None, InvalidSyntaxError(
+                self.current_tok.pos_start, self.current_tok.pos_end,
+                "Token cannot appear after previous tokens"
+            )
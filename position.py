@@ -1,13 +1,153 @@
+from bisect import bisect_right
+import mmap
+
+"""SourceFile class
+
+    Description:
+        Holds the name and the text of a source file, along with a table of
+        the offsets at which each line starts. The table is built the first
+        time a line number is needed, so files without errors never pay for it.
+
+    Attributes:
+        fn (str): File name
+        ftxt (str): File text
+
+    Returns:
+        SourceFile: A SourceFile object
+"""
+
+
+class SourceFile:
+    __slots__ = ('fn', 'ftxt', 'line_starts')
+
+    def __init__(self, fn, ftxt):
+        self.fn = fn
+        self.ftxt = ftxt
+        self.line_starts = None
+
+    def lines(self):
+        # The offset at which each line starts
+        if self.line_starts is None:
+            line_starts = [0]
+            text = self.ftxt
+            idx_newline = text.find('\n')
+            while idx_newline >= 0:
+                line_starts.append(idx_newline + 1)
+                idx_newline = text.find('\n', idx_newline + 1)
+            self.line_starts = line_starts
+        return self.line_starts
+
+    def line_of(self, idx):
+        return max(bisect_right(self.lines(), idx) - 1, 0)
+
+    def line_start(self, ln):
+        return self.lines()[ln]
+
+
+"""MappedSourceFile class
+
+    Description:
+        A SourceFile whose text stays in a memory-mapped file. Offsets are byte
+        offsets, so the text is only decoded when an error message needs it,
+        and the positions of the error are moved to the decoded text. Closing
+        it, or leaving its with block, unmaps the file.
+
+    Arguments:
+        fn (str): File name
+
+    Returns:
+        MappedSourceFile: A MappedSourceFile object
+"""
+
+
+class MappedSourceFile(SourceFile):
+    __slots__ = ('data', 'decoded')
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.line_starts = None
+        self.decoded = None
+
+        with open(fn, 'rb') as file:
+            try:
+                self.data = mmap.mmap(
+                    file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # Empty files cannot be mapped
+                self.data = b''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    def lines(self):
+        # The byte offset at which each line starts
+        if self.line_starts is None:
+            line_starts = [0]
+            data = self.data
+            idx_newline = data.find(b'\n')
+            while idx_newline >= 0:
+                line_starts.append(idx_newline + 1)
+                idx_newline = data.find(b'\n', idx_newline + 1)
+            self.line_starts = line_starts
+        return self.line_starts
+
+    @property
+    def ftxt(self):
+        return self.decoded_source().ftxt
+
+    def decoded_source(self):
+        # The text of the file decoded as UTF-8, in a SourceFile
+        if self.decoded is None:
+            self.decoded = SourceFile(
+                self.fn, self.data[:].decode('utf-8', errors='replace'))
+        return self.decoded
+
+    def decoded_position(self, pos):
+        # The same position in the decoded text. An offset past the end of
+        # the file stays as far past the end of the text.
+        data = self.data
+
+        def offset(idx):
+            return len(data[:idx].decode('utf-8', errors='replace')) \
+                + max(idx - len(data), 0)
+
+        return Position(offset(pos.idx), self.decoded_source(), offset(pos.line_idx))
+
+    def decoded_error(self, error):
+        # Moves the positions of an error to the decoded text, where its
+        # message can be printed once the file is closed
+        if error.pos_start is not None and error.pos_start.src is self:
+            error.pos_start = self.decoded_position(error.pos_start)
+        if error.pos_end is not None and error.pos_end.src is self:
+            error.pos_end = self.decoded_position(error.pos_end)
+        return error
+
+
 """Position class
-    
+
     Tracks the position of the current character in the input string.
-    
+    Only offsets are stored; the line and column are looked up in the
+    SourceFile when they are asked for.
+
+    The line is the one of line_idx, which is idx unless the position was
+    advanced past a character without being told it was a newline. Such a
+    position stays on the previous line, one column past its end.
+
     Attributes:
         idx (int): Index of the current character
+        src (SourceFile): The source file
+        line_idx (int): An index on the line of the current character
         ln (int): Line number of the current character
         col (int): Column number of the current character
         fn (str): File name
-        ftxt (str): File text    
+        ftxt (str): File text
 
     Returns:
         Position: A Position object
@@ -15,22 +155,42 @@
 
 
 class Position:
-    def __init__(self, idx, ln, col, fn, ftxt):
+    __slots__ = ('idx', 'src', 'line_idx')
+
+    def __init__(self, idx, src, line_idx=None):
         self.idx = idx
-        self.ln = ln
-        self.col = col
-        self.fn = fn
-        self.ftxt = ftxt
+        self.src = src
+        self.line_idx = idx if line_idx is None else line_idx
+
+    @property
+    def ln(self):
+        return self.src.line_of(self.line_idx)
+
+    @property
+    def col(self):
+        return self.idx - self.src.line_start(self.ln)
+
+    def line_col(self):
+        # The line and the column, looking the line up once
+        line_starts = self.src.lines()
+        ln = max(bisect_right(line_starts, self.line_idx) - 1, 0)
+        return ln, self.idx - line_starts[ln]
+
+    @property
+    def fn(self):
+        return self.src.fn
+
+    @property
+    def ftxt(self):
+        return self.src.ftxt
 
     def advance(self, current_char=None):
         self.idx += 1
-        self.col += 1
 
         if current_char == '\n':
-            self.ln += 1
-            self.col = 0
+            self.line_idx = self.idx
 
         return self
 
     def copy(self):
-        return Position(self.idx, self.ln, self.col, self.fn, self.ftxt)
+        return Position(self.idx, self.src, self.line_idx)
@@ -1,93 +1,199 @@
-import mini
-import time
+import argparse
+import os
 import sys
+import time
+import cfg
+import mini
 
-file_name = 'rand.mini'
+"""Run
+        Description:
+            Command line entry point of the Mini compiler.
+            The source file is read once and compiled in a single session,
+            stopping after the requested phase. The output of the last phase
+            is printed, followed by the time spent in every phase that ran.
+
+        Usage:
+            python3 run.py rand.mini
+            python3 run.py ex.mini --phase parser
+            python3 run.py ex.mini --lexer classic
+            python3 run.py big.mini --stream
+            python3 run.py big.mini --stream --output big.tac
+            python3 run.py tac.mini -O 2
+            python3 run.py tac.mini --dot tac.dot
+            python3 run.py tac.mini -O 2 --reuse-temps 4
+            python3 run.py ex.mini -O 2 --execute
+            python3 run.py ex.mini --execute closures
+            python3 run.py ex.mini --execute python
+            python3 run.py ex.mini -O 2 --cache
+"""
+
+
+def parse_arguments():
+    arg_parser = argparse.ArgumentParser(description='Mini compiler')
+    arg_parser.add_argument('file_name', help='the .mini source file')
+    arg_parser.add_argument(
+        '--phase', choices=mini.PHASES, default=mini.PHASE_ICG,
+        help='stop after this phase (default: icg)')
+    arg_parser.add_argument(
+        '--lexer', choices=list(mini.LEXERS), default='regex',
+        help='lexer engine (default: regex)')
+    arg_parser.add_argument(
+        '--expr-engine', choices=mini.EXPR_ENGINES, default='pratt',
+        help='expression parser (default: pratt)')
+    arg_parser.add_argument(
+        '--compact-tokens', action='store_true',
+        help='keep the tokens in a compact TokenStream')
+    arg_parser.add_argument(
+        '--stream', action='store_true',
+        help='generate the intermediate code one statement at a time '
+             'from a memory-mapped file')
+    arg_parser.add_argument(
+        '-O', '--opt-level', type=int, default=0,
+        choices=range(mini.MAX_OPTIMIZATION_LEVEL + 1),
+        help='optimization level of the intermediate code (default: 0)')
+    arg_parser.add_argument(
+        '--reuse-temps', metavar='MAX', type=int, nargs='?', const=0,
+        help='rename the temporaries to as few as their liveness allows, '
+             'at most MAX per function with the others in stack slots')
+    arg_parser.add_argument(
+        '--output', metavar='FILE',
+        help='write the intermediate code to FILE as it is generated')
+    arg_parser.add_argument(
+        '--dot', metavar='FILE',
+        help='write the control flow graphs of the intermediate code to '
+             'FILE in the Graphviz dot format')
+    arg_parser.add_argument(
+        '--execute', metavar='ENGINE', nargs='?', const=mini.ENGINE_VM,
+        choices=mini.ENGINES,
+        help='run the program and print the variables it ends with, on the '
+             'register machine (the default), as closures, with a tree walker '
+             'or compiled to Python')
+    arg_parser.add_argument(
+        '--cache', action='store_true',
+        help='reuse the tokens, AST and intermediate code of an unchanged '
+             'file from the ' + mini.CACHE_DIRECTORY + ' directory next to it')
+    arg_parser.add_argument(
+        '--quiet', action='store_true',
+        help='only print the phase timings')
+    return arg_parser.parse_args()
+
+
+def stream(file_name, expr_engine, opt_level, quiet, output):
+    wall_start = time.perf_counter_ns()
+    cpu_start = time.process_time_ns()
+
+    if output or quiet:
+        with open(output or os.devnull, 'w') as out:
+            error = mini.write_intermediate_code(
+                file_name, out, expr_engine, opt_level)
+    else:
+        error = mini.write_intermediate_code(
+            file_name, sys.stdout, expr_engine, opt_level)
+    if error:
+        print(error.as_string())
 
-# get the file name from the user as a command line argument
-#file_name = sys.argv[1]
-if file_name == None:
-    print("No file name provided")
-    exit()
-if file_name[-5:] != ".mini":
-    print("Invalid file name. File name must end with .mini")
-    exit()
+    print("=====================================================================")
+    print(file_name, "Mini streaming compile runs in:",
+          (time.perf_counter_ns() - wall_start) / 1e9, "seconds (cpu:",
+          (time.process_time_ns() - cpu_start) / 1e9, "seconds)")
 
+    if error:
+        exit(1)
 
 
+def main():
+    args = parse_arguments()
+    file_name = args.file_name
 
-def run_lexer():
-    text = ""
-    with open(file_name, 'r') as file:
-        text = file.read()
+    if file_name[-5:] != ".mini":
+        print("Invalid file name. File name must end with .mini")
+        exit(1)
 
-    if text.strip() == "":
-        return
-    result, error = mini.run_lexer(file_name, text)
+    if (args.stream or args.output or args.dot) and args.phase != mini.PHASE_ICG:
+        print("--stream, --output and --dot only support the icg phase")
+        exit(1)
 
-    if error:
-        print(error.as_string())
-    else:
-        print(result)
+    if args.stream and args.dot:
+        print("--dot needs the whole program, it cannot be used with --stream")
+        exit(1)
 
+    if args.stream and args.cache:
+        print("--cache needs the whole program, it cannot be used with --stream")
+        exit(1)
 
-def run_parser():
-    text = ""
-    with open(file_name, 'r') as file:
-        text = file.read()
+    if args.stream and (args.lexer != 'regex' or args.compact_tokens):
+        print("--stream reads the file with the regex lexer, it cannot be used "
+              "with --lexer classic or --compact-tokens")
+        exit(1)
 
-    if text.strip() == "":
-        return
-    result, error = mini.run_parser(file_name, text)
+    if args.stream and args.reuse_temps is not None:
+        print("--reuse-temps needs the whole program, it cannot be used with --stream")
+        exit(1)
 
-    if error:
-        print(error.as_string())
-    else:
-        print(result)
-        
-def run_icg():
-    text = ""
-    with open(file_name, 'r') as file:
-        text = file.read()
+    if args.execute and (args.stream or args.phase != mini.PHASE_ICG):
+        print("--execute needs the whole intermediate code, it cannot be used "
+              "with --stream or an earlier phase")
+        exit(1)
 
-    if text.strip() == "":
+    if args.stream:
+        stream(file_name, args.expr_engine, args.opt_level, args.quiet,
+               args.output)
         return
-    result, error = mini.run_intermediate_code_generator(file_name, text)
-
-    if error:
-        print(error.as_string())
-    else:
-        print(result)
-
 
-# Calculate Run Time
-lexer_start_time = time.time()
-
-run_lexer()
-
-lexer_finish_time = time.time()
+    session = mini.CompileSession(
+        file_name, lexer=args.lexer, compact_tokens=args.compact_tokens,
+        expr_engine=args.expr_engine, opt_level=args.opt_level,
+        reuse_temps=args.reuse_temps is not None,
+        max_temps=args.reuse_temps or None, cache=args.cache or None)
+    if session.text.strip() == "":
+        return
 
-lexer_total_run_time = lexer_finish_time - lexer_start_time
-print("=====================================================================")
-print("\n", file_name, "Mini Lexer runs in:",
-      lexer_total_run_time, "seconds\n\n")
+    if args.output:
+        with open(args.output, 'w') as out:
+            result, error = session.write_intermediate_code(out)
+    else:
+        result, error = session.run(args.phase)
 
-parser_start_time = time.time()
+    if args.dot and not error:
+        program, error = session.generate_ir()
+        with open(args.dot, 'w') as out:
+            cfg.write_dot(cfg.build_graphs(program), out.write)
 
-run_parser()
+    variables = None
+    if args.execute and not error:
+        variables, error = session.execute(args.execute)
 
-parser_finish_time = time.time()
+    if error:
+        print(error.as_string())
+    elif not args.quiet and not args.output:
+        print(result)
 
-parser_total_run_time = parser_finish_time - parser_start_time
-print("=====================================================================")
-print("\n", file_name, "Mini Parser runs in:",
-      parser_total_run_time, "seconds\n\n")
+    if variables is not None and not args.quiet:
+        print("=====================================================================")
+        for name, value in variables.items():
+            print(name, '=', value)
+
+    # Calculate Run Time
+    print("=====================================================================")
+    if session.allocation:
+        allocation = session.allocation
+        print(file_name, "Mini temporaries:", allocation['temps'], "before,",
+              allocation['peak'], "live at most,", allocation['slots'], "after,",
+              allocation['stack slots'], "stack slots")
+    if session.cache:
+        stats = session.cache.stats
+        print(file_name, "Mini cache:", stats['hits'], "hits,", stats['misses'],
+              "misses,", stats['stores'], "stores,", stats['evictions'], "evictions")
+    if session.execution:
+        print(file_name, "Mini executed", session.execution['executed'], "instructions")
+    for timing in session.timings.values():
+        print(file_name, "Mini", timing.phase, "runs in:",
+              timing.wall_ns / 1e9, "seconds (cpu:",
+              timing.cpu_ns / 1e9, "seconds)")
 
-icg_start_time = time.time()
+    if error:
+        exit(1)
 
-run_icg()
 
-icg_finish_time = time.time()
-icg_total_run_time = icg_finish_time - icg_start_time
-print("=====================================================================")
-print("\n", file_name, "Mini Intermediate Code Generator runs in:", icg_total_run_time, "seconds")
+if __name__ == '__main__':
+    main()
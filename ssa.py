@@ -0,0 +1,515 @@
+from ir import *
+from cfg import EXIT, load, build_graphs
+
+"""
+    This document contains the following:
+    1. The dominator tree and the dominance frontiers of a ControlFlowGraph
+    2. Phi class
+    3. SSAFunction class
+    4. SSAProgram class
+    5. to_ssa function, which builds the static single assignment form
+    6. from_ssa function, which turns it back into three address code
+    7. verify_ssa function
+    8. The printer of the SSA form
+
+    Every variable, and every temporary written more than once, gets a new
+    temporary for each of its assignments, and a phi where the assignments
+    of different paths meet. The origin of such a temporary is the operand
+    it is a version of. Variables are shared by all the functions, so a
+    CALL, an arg or a func_start gives a variable the value stored in it,
+    which is the variable operand itself.
+"""
+
+
+# ===============================================================================
+# DOMINATORS
+# ===============================================================================
+def reverse_postorder(graph):
+    # The blocks reachable from the entry, each one before its successors
+    # except along back edges
+    if not graph.blocks:
+        return []
+
+    order = []
+    visited = bytearray(len(graph.blocks))
+    visited[0] = 1
+    stack = [(0, iter(graph.blocks[0].successors))]
+    while stack:
+        block, successors = stack[-1]
+        for successor in successors:
+            if successor != EXIT and not visited[successor]:
+                visited[successor] = 1
+                stack.append(
+                    (successor, iter(graph.blocks[successor].successors)))
+                break
+        else:
+            stack.pop()
+            order.append(block)
+    order.reverse()
+    return order
+
+
+def dominators(graph, order):
+    # The immediate dominator of every block, None for unreachable blocks.
+    # The iterative algorithm of Cooper, Harvey and Kennedy, which settles
+    # in a couple of passes over the blocks of structured code.
+    idom = [None] * len(graph.blocks)
+    if not order:
+        return idom
+
+    position = [0] * len(graph.blocks)
+    for number, block in enumerate(order):
+        position[block] = number
+
+    idom[0] = 0
+    changed = True
+    while changed:
+        changed = False
+        for block in order[1:]:
+            new_idom = None
+            for predecessor in graph.blocks[block].predecessors:
+                if idom[predecessor] is None:
+                    continue
+                if new_idom is None:
+                    new_idom = predecessor
+                    continue
+                # The nearest common dominator of the two
+                finger = predecessor
+                while finger != new_idom:
+                    while position[finger] > position[new_idom]:
+                        finger = idom[finger]
+                    while position[new_idom] > position[finger]:
+                        new_idom = idom[new_idom]
+            if idom[block] != new_idom:
+                idom[block] = new_idom
+                changed = True
+    return idom
+
+
+def dominance_frontiers(graph, idom):
+    frontiers = [set() for _ in graph.blocks]
+    for block in graph.blocks:
+        if idom[block.index] is None:
+            continue
+        predecessors = [predecessor for predecessor in block.predecessors
+                        if idom[predecessor] is not None]
+        if len(predecessors) < 2:
+            continue
+        for runner in predecessors:
+            while runner != idom[block.index]:
+                frontiers[runner].add(block.index)
+                runner = idom[runner]
+    return frontiers
+
+
+"""Phi class
+
+    Description:
+        The value of a name where the paths of several predecessor blocks
+        meet.
+
+    Arguments:
+        dest (int): The temporary the phi defines
+        origin (int): The variable or temporary dest is a version of
+        count (int): The number of predecessors of the block
+
+    Attributes:
+        args (list): The version coming from each predecessor, in the order
+            of the predecessors of the block
+
+    Returns:
+        Phi: A Phi object
+"""
+
+
+class Phi:
+    __slots__ = ('dest', 'origin', 'args')
+
+    def __init__(self, dest, origin, count):
+        self.dest = dest
+        self.origin = origin
+        self.args = [origin] * count
+
+
+"""SSAFunction class
+
+    Description:
+        The SSA form of one ControlFlowGraph. The code of every block is a
+        list of (opcode, dest, arg1, arg2, layout) tuples.
+
+    Arguments:
+        graph (ControlFlowGraph): The graph of the function
+
+    Attributes:
+        order (list): The reachable blocks in reverse postorder
+        idom (list): The immediate dominator of every block
+        children (list): The blocks every block immediately dominates
+        frontiers (list): The dominance frontier of every block
+        phis (list): The Phis at the start of every block
+        code (list): The instructions of every block
+
+    Returns:
+        SSAFunction: An SSAFunction object
+"""
+
+
+class SSAFunction:
+    def __init__(self, graph):
+        self.graph = graph
+        self.order = reverse_postorder(graph)
+        self.idom = dominators(graph, self.order)
+        self.frontiers = dominance_frontiers(graph, self.idom)
+
+        self.children = [[] for _ in graph.blocks]
+        for block in self.order[1:]:
+            self.children[self.idom[block]].append(block)
+
+        self.phis = [[] for _ in graph.blocks]
+        self.code = [[] for _ in graph.blocks]
+
+        # Entering and leaving the blocks in a walk of the dominator tree,
+        # so that dominance is a comparison of two numbers
+        self.entered = [0] * len(graph.blocks)
+        self.left = [-1] * len(graph.blocks)
+        clock = 0
+        stack = [(0, False)] if self.order else []
+        while stack:
+            block, done = stack.pop()
+            clock += 1
+            if done:
+                self.left[block] = clock
+                continue
+            self.entered[block] = clock
+            stack.append((block, True))
+            stack.extend((child, False) for child in self.children[block])
+
+    def dominates(self, block, other):
+        return self.entered[block] <= self.entered[other] \
+            and self.left[other] <= self.left[block]
+
+
+"""SSAProgram class
+
+    Description:
+        The SSA form of every ControlFlowGraph of a program.
+
+    Arguments:
+        program (Program): The program in SSA form. Its numbering goes on
+            after the temporaries of the versions.
+
+    Attributes:
+        functions (list): The SSAFunctions
+        origin (dict): The variable or temporary each version stands for
+
+    Returns:
+        SSAProgram: An SSAProgram object
+"""
+
+
+class SSAProgram:
+    def __init__(self, program):
+        self.program = program
+        self.functions = []
+        self.origin = {}
+
+
+# ===============================================================================
+# CONSTRUCTION
+# ===============================================================================
+def place_phis(function, renamed, instructions):
+    # Pruned SSA: a name gets a phi on the iterated dominance frontier of the
+    # blocks that assign it, where it is live. The liveness of every name is
+    # only followed back from the blocks that read it to the blocks that
+    # assign it, so the work stays near the code that uses the name.
+    blocks = function.graph.blocks
+    idom = function.idom
+    assigned_in = {}
+    read_in = {}
+    calls = set()
+    for block in function.order:
+        assigned = set()
+        called = False
+        for opcode, dest, arg1, arg2, layout in instructions[blocks[block].start:blocks[block].end]:
+            if opcode == OP_ARG or opcode == OP_FUNC_START:
+                # They store to their variable
+                dest, arg1 = arg1, NONE
+            for operand in (arg1, arg2):
+                # After a CALL, a variable is read from where it is stored
+                if operand in renamed and operand not in assigned \
+                        and not (called and operand & 3 == KIND_VAR):
+                    read_in.setdefault(operand, set()).add(block)
+            if opcode == OP_CALL:
+                calls.add(block)
+                called = True
+            if dest in renamed:
+                assigned.add(dest)
+                assigned_in.setdefault(dest, set()).add(block)
+
+    for name, live_in in read_in.items():
+        assigned = assigned_in.get(name, set())
+        # A CALL stores to all the variables
+        stored = calls if name & 3 == KIND_VAR else assigned
+
+        live_in = set(live_in)
+        work = list(live_in)
+        reaching = set()
+        while work:
+            block = work.pop()
+            for predecessor in blocks[block].predecessors:
+                if idom[predecessor] is None:
+                    continue
+                if predecessor in assigned or predecessor in stored:
+                    reaching.add(predecessor)
+                elif predecessor not in live_in:
+                    live_in.add(predecessor)
+                    work.append(predecessor)
+
+        placed = set()
+        work = list(reaching)
+        while work:
+            block = work.pop()
+            for frontier in function.frontiers[block]:
+                if frontier in placed or frontier not in live_in:
+                    continue
+                placed.add(frontier)
+                function.phis[frontier].append(
+                    Phi(NONE, name, len(blocks[frontier].predecessors)))
+                if frontier not in reaching:
+                    work.append(frontier)
+
+
+def rename(ssa, function, renamed, instructions):
+    # Walks the dominator tree with a stack of versions for every name. A
+    # CALL stores to all the variables: rather than pushing a version of
+    # each of them, every version remembers the last CALL before it, and a
+    # variable assigned before the last CALL on the way is read from where
+    # it is stored.
+    blocks = function.graph.blocks
+    new_number = ssa.program.new_number
+    origin = ssa.origin
+    versions = {name: [(name, 0)] for name in renamed}
+    calls = 0
+
+    def current(name):
+        version, call = versions[name][-1]
+        if call != last_call and name & 3 == KIND_VAR:
+            return name
+        return version
+
+    def define(name, version=None):
+        if version is None:
+            version = temp(new_number())
+            origin[version] = name
+        versions[name].append((version, last_call))
+        pushed.append(name)
+        return version
+
+    stack = [(0, None, 0)] if function.order else []
+    while stack:
+        block, pushed, last_call = stack.pop()
+        if pushed is not None:
+            # Leaving the block, its versions go out of scope
+            for name in pushed:
+                versions[name].pop()
+            continue
+        pushed = []
+        stack.append((block, pushed, last_call))
+
+        for phi in function.phis[block]:
+            phi.dest = define(phi.origin)
+
+        code = function.code[block]
+        for opcode, dest, arg1, arg2, layout in instructions[blocks[block].start:blocks[block].end]:
+            if opcode == OP_ARG or opcode == OP_FUNC_START:
+                if arg1 in versions:
+                    define(arg1, arg1)
+                code.append((opcode, dest, arg1, arg2, layout))
+                continue
+            if arg1 in versions:
+                arg1 = current(arg1)
+            if arg2 in versions:
+                arg2 = current(arg2)
+            if opcode == OP_CALL:
+                calls += 1
+                last_call = calls
+            if dest in versions:
+                dest = define(dest)
+            code.append((opcode, dest, arg1, arg2, layout))
+
+        for successor in blocks[block].successors:
+            if successor == EXIT:
+                continue
+            position = blocks[successor].predecessors.index(block)
+            for phi in function.phis[successor]:
+                phi.args[position] = current(phi.origin)
+
+        stack.extend((child, None, last_call) for child in function.children[block])
+
+
+def to_ssa(program):
+    # Returns the SSAProgram of a program
+    ssa = SSAProgram(program.derive())
+    instructions = load(program)
+
+    # The temporaries written more than once in the whole program. Each
+    # function may number its temporaries from t0, so a temporary written
+    # once in two functions gets a version in both.
+    written = set()
+    rewritten = set()
+    for opcode, dest, arg1, arg2, layout in instructions:
+        if dest >= 0 and dest & 3 == KIND_TEMP:
+            if dest in written:
+                rewritten.add(dest)
+            written.add(dest)
+
+    for graph in build_graphs(program):
+        function = SSAFunction(graph)
+        ssa.functions.append(function)
+
+        # The variables the function assigns, and the temporaries it assigns
+        # that are written more than once
+        renamed = set()
+        for block in graph.blocks:
+            for opcode, dest, arg1, arg2, layout in instructions[block.start:block.end]:
+                if dest >= 0 and dest & 3 == KIND_TEMP:
+                    if dest in rewritten:
+                        renamed.add(dest)
+                elif dest >= 0 and dest & 3 == KIND_VAR:
+                    renamed.add(dest)
+                elif opcode == OP_ARG or (opcode == OP_FUNC_START and arg1 >= 0):
+                    renamed.add(arg1)
+
+        place_phis(function, renamed, instructions)
+        rename(ssa, function, renamed, instructions)
+
+        # Unreachable blocks are kept as they are
+        for block in graph.blocks:
+            if function.idom[block.index] is None:
+                function.code[block.index] = instructions[block.start:block.end]
+
+    return ssa
+
+
+# ===============================================================================
+# DESTRUCTION
+# ===============================================================================
+def from_ssa(ssa):
+    # Every version becomes the name it stands for again and the phis are
+    # dropped. The versions of a name are never live at the same time in the
+    # form to_ssa builds, so no copies are needed.
+    origin = ssa.origin
+    blocks = []
+    for function in ssa.functions:
+        for block in function.graph.blocks:
+            blocks.append((block.start, function.code[block.index]))
+    blocks.sort()
+
+    program = ssa.program.derive()
+    for start, code in blocks:
+        for opcode, dest, arg1, arg2, layout in code:
+            program.append(opcode, origin.get(dest, dest),
+                           origin.get(arg1, arg1), origin.get(arg2, arg2),
+                           layout)
+    return program
+
+
+# ===============================================================================
+# VERIFIER
+# ===============================================================================
+def verify_ssa(ssa):
+    # Returns the list of the problems found, empty when the form is valid:
+    # every version is assigned once, by a phi or an instruction that
+    # dominates its uses, and every phi has one version per predecessor.
+    problems = []
+    program = ssa.program
+    origin = ssa.origin
+    defined_at = {}
+
+    def describe(operand):
+        return program.format_operand(operand)
+
+    def define(operand, where):
+        if operand in defined_at:
+            problems.append(f'{describe(operand)} is assigned more than once')
+        else:
+            defined_at[operand] = where
+
+    for number, function in enumerate(ssa.functions):
+        for block in function.order:
+            for phi in function.phis[block]:
+                define(phi.dest, (number, block, -1))
+            for position, instruction in enumerate(function.code[block]):
+                dest = instruction[1]
+                if dest >= 0 and dest & 3 == KIND_TEMP:
+                    define(dest, (number, block, position))
+
+    def check_use(operand, number, block, position):
+        if operand not in origin:
+            return
+        where = defined_at.get(operand)
+        if where is None:
+            problems.append(f'{describe(operand)} is never assigned')
+            return
+        function = ssa.functions[number]
+        def_number, def_block, def_position = where
+        if def_number != number:
+            problems.append(f'{describe(operand)} is used in another function')
+        elif def_block == block:
+            if def_position >= position:
+                problems.append(f'{describe(operand)} is used before it is '
+                                f'assigned in B{block}')
+        elif not function.dominates(def_block, block):
+            problems.append(f'{describe(operand)} does not dominate its use '
+                            f'in B{block}')
+
+    for number, function in enumerate(ssa.functions):
+        blocks = function.graph.blocks
+        for block in function.order:
+            predecessors = blocks[block].predecessors
+            for phi in function.phis[block]:
+                if len(phi.args) != len(predecessors):
+                    problems.append(f'the phi of {describe(phi.dest)} has '
+                                    f'{len(phi.args)} arguments for '
+                                    f'{len(predecessors)} predecessors')
+                    continue
+                for arg, predecessor in zip(phi.args, predecessors):
+                    if origin.get(arg, arg) != phi.origin:
+                        problems.append(f'the phi of {describe(phi.dest)} '
+                                        f'mixes {describe(phi.origin)} with '
+                                        f'{describe(origin.get(arg, arg))}')
+                    if function.idom[predecessor] is not None:
+                        check_use(arg, number, predecessor,
+                                  len(function.code[predecessor]))
+            for position, instruction in enumerate(function.code[block]):
+                check_use(instruction[2], number, block, position)
+                check_use(instruction[3], number, block, position)
+
+    return problems
+
+
+# ===============================================================================
+# PRINTER
+# ===============================================================================
+def write_ssa(ssa, write):
+    # The blocks of every function with their phis first, each block
+    # headed by its number and its immediate dominator
+    program = ssa.program
+    for function in ssa.functions:
+        write(f'# {function.graph.function}\n')
+        for block in function.graph.blocks:
+            idom = function.idom[block.index]
+            dominator = 'unreachable' if idom is None else f'idom B{idom}'
+            write(f'B{block.index}: # {dominator}\n')
+            for phi in function.phis[block.index]:
+                args = ', '.join(map(program.format_operand, phi.args))
+                write(f'{program.format_operand(phi.dest)} = phi({args})\n')
+            code = program.derive()
+            for instruction in function.code[block.index]:
+                code.append(*instruction)
+            write_program(code, write)
+
+
+def format_ssa(ssa):
+    lines = []
+    write_ssa(ssa, lines.append)
+    return ''.join(lines)
@@ -0,0 +1,367 @@
+from ir import *
+from cfg import load, function_ends
+from error import RTError
+
+"""
+    This document contains the following:
+    1. Function class
+    2. Executable class
+    3. load_program function, which resolves a Program for the machine
+    4. execute function, the dispatch loop of the register machine
+    5. run_program function
+
+    The machine keeps every value in one list of registers. The variables
+    come first, one register per name of the program, then the constants,
+    then the temporaries of the top level, then a window for the frame of
+    the running function. The temporaries and the arguments of a function
+    are numbered from the start of the window, so a CALL saves the caller's
+    part of the window and its RETURN puts it back; a CALL from the top
+    level saves nothing, so it costs the same however long the program is.
+    The arguments of a function are local to its call, the other variables
+    are shared by all the functions.
+
+    Labels are resolved to the index of the instruction that follows them
+    and are not kept, so the machine only executes the other instructions.
+"""
+
+
+# Deeper calls are reported as an error rather than growing the call stack
+# until memory runs out
+MAX_CALL_DEPTH = 100000
+
+
+"""Function class
+
+    Description:
+        The value a func_start stores in the variable of its function.
+
+    Arguments:
+        name (str): The name of the function, None when it is anonymous
+        entry (int): The index of the first instruction of its body
+
+    Returns:
+        Function: A Function object
+"""
+
+
+class Function:
+    __slots__ = ('name', 'entry')
+
+    def __init__(self, name, entry):
+        self.name = name
+        self.entry = entry
+
+    # The same definition loaded twice gives equal functions
+    def __eq__(self, other):
+        return (other.__class__ is Function and self.name == other.name
+                and self.entry == other.entry)
+
+    def __hash__(self):
+        return hash((self.name, self.entry))
+
+    def __repr__(self):
+        return f'<function {self.name or "anonymous"}>'
+
+
+"""Executable class
+
+    Description:
+        The instructions of a Program for the machine, as (opcode, dest,
+        arg1, arg2, extra) tuples. Operands are register indexes and jump
+        targets are instruction indexes. The extra field holds what an
+        instruction needs besides its operands: the table lookup of a
+        SWITCH, the Function of a func_start, the size of the caller's frame
+        of a CALL and the position of an arg.
+
+    Arguments:
+        program (Program): The program the instructions come from
+
+    Attributes:
+        code (list): The instructions
+        registers (list): The registers before the program runs, with the
+            constants in place
+        window (int): The index of the first register of the frame
+        sources (list): The index in the program of every instruction, for
+            the error messages
+
+    Returns:
+        Executable: An Executable object
+"""
+
+
+class Executable:
+    def __init__(self, program):
+        self.program = program
+        self.code = []
+        self.registers = [None] * len(program.names)
+        self.window = 0
+        self.sources = []
+
+    def __len__(self):
+        return len(self.code)
+
+    def variables(self, registers):
+        # The variables of the program that hold a value, by name
+        return {name: registers[idx] for idx, name in enumerate(self.program.names)
+                if registers[idx] is not None and name != ANONYMOUS_FUNCTION_VARIABLE}
+
+    def instruction_text(self, pc):
+        lines = []
+        idx = self.sources[pc]
+        write_program(self.program, lines.append, idx, idx + 1)
+        return ''.join(lines).strip()
+
+
+# ===============================================================================
+# LOADER
+# ===============================================================================
+def load_program(program):
+    # Two passes: the first gives every instruction but the labels its index
+    # in the machine code, the second rewrites the operands
+    instructions = load(program)
+    ends = function_ends(instructions)
+
+    positions = []
+    targets = {}
+    count = 0
+    for opcode, dest, arg1, arg2, layout in instructions:
+        positions.append(count)
+        if opcode == OP_LABEL:
+            targets[dest] = count
+        else:
+            count += 1
+    positions.append(count)
+
+    executable = Executable(program)
+    registers = executable.registers
+    constant_registers = {}
+
+    def constant(operand):
+        register = constant_registers.get(operand)
+        if register is None:
+            register = constant_registers[operand] = len(registers)
+            registers.append(None if operand == NONE
+                             else program.constants[operand >> 2])
+        return register
+
+    # The registers of the constants are known before those of the frames,
+    # and so are the temporaries of the top level, outside every function
+    top_level_temps = set()
+    depth = 0
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        for operand in (arg1, arg2):
+            if operand >= 0 and operand & 3 == KIND_CONST and opcode != OP_SWITCH:
+                constant(operand)
+        if depth == 0:
+            for operand in (dest, arg1, arg2):
+                if operand >= 0 and operand & 3 == KIND_TEMP:
+                    top_level_temps.add(operand)
+        if opcode == OP_FUNC_START and idx in ends:
+            depth += 1
+        elif opcode == OP_FUNC_END and depth:
+            depth -= 1
+    none_register = constant(NONE)
+
+    # The top level is never called, so its frame has registers of its own
+    # that a CALL does not save. Every function numbers its temporaries and
+    # arguments from the window after them, and a CALL is given the size of
+    # the frame it is in once the frame is done.
+    top_level = len(registers)
+    window = executable.window = top_level + len(top_level_temps)
+    frames = [({}, [], top_level)]
+    frame_size = 0
+    arg_position = 0
+
+    def register(operand):
+        if operand & 3 == KIND_VAR:
+            slot = frames[-1][0].get(operand)
+            return operand >> 2 if slot is None else slot
+        if operand & 3 == KIND_CONST:
+            return constant(operand)
+        slots, calls, base = frames[-1]
+        slot = slots.get(operand)
+        if slot is None:
+            slot = slots[operand] = base + len(slots)
+        return slot
+
+    def close_frame():
+        nonlocal frame_size
+        slots, calls, base = frames.pop()
+        saved = len(slots) if base == window else 0
+        frame_size = max(frame_size, saved)
+        for pc in calls:
+            opcode, dest, arg1, arg2, extra = code[pc]
+            code[pc] = (opcode, dest, arg1, arg2, saved)
+
+    code = executable.code
+    sources = executable.sources
+    for idx, (opcode, dest, arg1, arg2, layout) in enumerate(instructions):
+        if opcode == OP_LABEL:
+            continue
+        sources.append(idx)
+
+        if opcode <= OP_POS:
+            instruction = (opcode, register(dest), register(arg1),
+                           register(arg2) if arg2 >= 0 else arg2, None)
+        elif opcode == OP_GOTO:
+            instruction = (opcode, targets[dest], NONE, NONE, None)
+        elif opcode == OP_IF_FALSE or opcode == OP_IF_TRUE:
+            instruction = (opcode, targets[dest], register(arg1), NONE, None)
+        elif opcode == OP_IF_GREATER:
+            instruction = (opcode, targets[dest], register(arg1), register(arg2), None)
+        elif opcode == OP_SWITCH:
+            table = tuple((value, targets[label])
+                          for value, label in program.constants[arg2 >> 2])
+            instruction = (opcode, targets[dest], register(arg1), NONE,
+                           switch_lookup(table))
+        elif opcode == OP_FUNC_START:
+            # Stores the function and goes past its body
+            name = program.names[arg1 >> 2] if arg1 >= 0 else None
+            if name == ANONYMOUS_FUNCTION_VARIABLE:
+                name = None
+            skip = positions[ends[idx] + 1] if idx in ends else len(code) + 1
+            instruction = (opcode, skip, register(arg1) if arg1 >= 0 else NONE, NONE,
+                           Function(name, len(code) + 1))
+            if idx in ends:
+                frames.append(({}, [], window))
+            arg_position = 0
+        elif opcode == OP_ARG:
+            # The arguments take the first slots of the frame
+            slots = frames[-1][0]
+            slot = slots.get(arg1)
+            if slot is None:
+                slot = slots[arg1] = window + len(slots)
+            instruction = (opcode, slot, NONE, NONE, arg_position)
+            arg_position += 1
+        elif opcode == OP_PARAM:
+            instruction = (opcode, NONE, register(arg1), NONE, None)
+        elif opcode == OP_CALL:
+            frames[-1][1].append(len(code))
+            instruction = (opcode, register(dest), register(arg1), NONE, 0)
+        elif opcode == OP_RETURN:
+            instruction = (opcode, NONE, register(arg1) if arg1 >= 0 else none_register,
+                           NONE, None)
+        else:
+            instruction = (OP_RETURN, NONE, none_register, NONE, None)
+        code.append(instruction)
+
+        if opcode == OP_FUNC_END and len(frames) > 1:
+            close_frame()
+
+    while frames:
+        close_frame()
+    registers.extend([None] * (len(top_level_temps) + frame_size))
+    return executable
+
+
+# ===============================================================================
+# MACHINE
+# ===============================================================================
+def execute(executable, stats=None):
+    # Runs the code until it runs off its end or returns at the top level.
+    # Returns the registers, with the count of the instructions executed in
+    # stats['executed'] if it is given.
+    code = executable.code
+    registers = list(executable.registers)
+    window = executable.window
+    end = len(code)
+    stack = []
+    params = []
+    args = ()
+    executed = 0
+    pc = 0
+
+    try:
+        while pc < end:
+            opcode, dest, arg1, arg2, extra = code[pc]
+            pc += 1
+            executed += 1
+
+            # Ordered by how often the generated code runs them
+            if opcode == OP_MOVE:
+                registers[dest] = registers[arg1]
+            elif opcode == OP_ADD:
+                registers[dest] = registers[arg1] + registers[arg2]
+            elif opcode == OP_IF_FALSE:
+                if not registers[arg1]:
+                    pc = dest
+            elif opcode == OP_IF_TRUE:
+                if registers[arg1]:
+                    pc = dest
+            elif opcode == OP_GOTO:
+                pc = dest
+            elif opcode == OP_LT:
+                registers[dest] = 1 if registers[arg1] < registers[arg2] else 0
+            elif opcode == OP_LTE:
+                registers[dest] = 1 if registers[arg1] <= registers[arg2] else 0
+            elif opcode == OP_SUB:
+                registers[dest] = registers[arg1] - registers[arg2]
+            elif opcode == OP_MUL:
+                registers[dest] = registers[arg1] * registers[arg2]
+            elif opcode == OP_IF_GREATER:
+                if registers[arg1] > registers[arg2]:
+                    pc = dest
+            elif opcode == OP_PARAM:
+                params.append(registers[arg1])
+            elif opcode == OP_CALL:
+                if len(stack) >= MAX_CALL_DEPTH:
+                    return None, RTError('Maximum call depth exceeded',
+                                         executable.instruction_text(pc - 1))
+                entry = registers[arg1].entry
+                stack.append((pc, dest, registers[window:window + extra]))
+                args = params
+                params = []
+                pc = entry
+            elif opcode == OP_ARG:
+                registers[dest] = args[extra] if extra < len(args) else None
+            elif opcode == OP_RETURN:
+                if not stack:
+                    break
+                value = registers[arg1]
+                pc, dest, frame = stack.pop()
+                registers[window:window + len(frame)] = frame
+                registers[dest] = value
+            elif opcode == OP_EQ:
+                registers[dest] = 1 if registers[arg1] == registers[arg2] else 0
+            elif opcode == OP_NE:
+                registers[dest] = 1 if registers[arg1] != registers[arg2] else 0
+            elif opcode == OP_GT:
+                registers[dest] = 1 if registers[arg1] > registers[arg2] else 0
+            elif opcode == OP_GTE:
+                registers[dest] = 1 if registers[arg1] >= registers[arg2] else 0
+            elif opcode == OP_DIV:
+                registers[dest] = registers[arg1] / registers[arg2]
+            elif opcode == OP_POW:
+                registers[dest] = registers[arg1] ** registers[arg2]
+            elif opcode == OP_NEG:
+                registers[dest] = -registers[arg1]
+            elif opcode == OP_POS:
+                registers[dest] = +registers[arg1]
+            elif opcode == OP_SWITCH:
+                target = extra(registers[arg1])
+                pc = dest if target is None else target
+            elif opcode == OP_FUNC_START:
+                if arg1 >= 0:
+                    registers[arg1] = extra
+                pc = dest
+    except AttributeError:
+        # Only a Function has an entry
+        function = registers[code[pc - 1][2]]
+        return None, RTError(f'{function!r} is not a function',
+                             executable.instruction_text(pc - 1))
+    except (ArithmeticError, TypeError, ValueError) as exception:
+        return None, RTError(str(exception), executable.instruction_text(pc - 1))
+    finally:
+        if stats is not None:
+            stats['executed'] = executed
+
+    return registers, None
+
+
+def run_program(program, stats=None):
+    # The variables the program ends with, by name
+    executable = load_program(program)
+    registers, error = execute(executable, stats)
+    if error:
+        return None, error
+    return executable.variables(registers), None